@@ -0,0 +1,194 @@
+# acronym_lexicon.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from spell_index import QuerySpeller
+
+logger = logging.getLogger(__name__)
+
+# Kleinschreibung im Korpus höchstens dieser Anteil der Großschreibung → auch "tara" gilt als Akronym
+LEXICON_LOWER_RATIO = float(os.getenv("LEXICON_LOWER_RATIO", "0.2"))
+
+# gleiche Tokenisierung wie detect_acronym
+_TOKEN_RE = re.compile(r"\b[A-Za-zÄÖÜäöüß0-9\-/]{2,20}\b")
+# mind. zwei Großbuchstaben, keine Kleinbuchstaben ("CAN", "CAN-FD", "ISO/SAE", "UN R155" → "UN")
+_ACRONYM_RE = re.compile(r"^(?=(?:.*[A-ZÄÖÜ]){2})[A-ZÄÖÜ0-9][A-ZÄÖÜ0-9\-/]{1,19}$")
+
+
+# Wortschatz für die Tippfehlerkorrektur: Wörter ab 4 Buchstaben, Zahlen ab 3 Ziffern (Normnummern)
+_VOCAB_RE = re.compile(r"^(?:[a-zäöüß]{4,20}|\d{3,8})$")
+
+
+def _count_tokens(texts: Iterable[str]) -> Counter:
+    counts: Counter = Counter()
+    for text in texts:
+        counts.update(_TOKEN_RE.findall(text or ""))
+    return counts
+
+
+def extract_acronyms(texts: Iterable[str], counts: Optional[Counter] = None) -> Dict[str, List[int]]:
+    """
+    Akronyme eines Dokuments: TERM → [Vorkommen in Großschreibung, Vorkommen als normales Wort
+    ("can", "Can")]. Zusammengesetzte Formen (CAN-FD, ISO/SAE) zählen auch für ihre Teile.
+    """
+    if counts is None:
+        counts = _count_tokens(texts)
+    upper: Counter = Counter()
+    for tok, n in counts.items():
+        if not _ACRONYM_RE.match(tok) or tok.strip("-/").isdigit():
+            continue
+        upper[tok] += n
+        for part in re.split(r"[-/]", tok):
+            if part != tok and _ACRONYM_RE.match(part):
+                upper[part] += n
+    return {
+        term: [n, counts.get(term.lower(), 0) + counts.get(term.capitalize(), 0)]
+        for term, n in upper.items()
+    }
+
+
+def extract_vocabulary(counts: Counter) -> Dict[str, int]:
+    """Kleingeschriebener Wortschatz eines Dokuments (Wort → Häufigkeit) ohne Akronyme."""
+    vocab: Counter = Counter()
+    for tok, n in counts.items():
+        if tok.isupper() and not tok.isdigit():
+            continue
+        low = tok.lower()
+        if _VOCAB_RE.match(low):
+            vocab[low] += n
+    return dict(vocab)
+
+
+class AcronymLexicon:
+    """
+    Im Korpus tatsächlich vorkommende Akronyme mit Dokumenthäufigkeit, beim Indexieren aufgebaut.
+    detect_acronym prüft Kandidaten per Dict-Lookup gegen dieses Lexikon. Dazu der Wortschatz
+    des Korpus für die Tippfehlerkorrektur (speller()). Persistiert als JSON neben der Chroma-Datenbank.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict[str, List[int]]] = {}
+        self._vocab_docs: Dict[str, Dict[str, int]] = {}
+        self._terms: Dict[str, Tuple[int, int, int]] = {}  # TERM → (df, upper, lower)
+        self._speller: Optional[QuerySpeller] = None
+        self._load()
+
+    # ---- Persistenz ---------------------------------------------------------
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            self._docs = dict(data.get("docs") or {})
+            self._vocab_docs = dict(data.get("vocab") or {})
+        except FileNotFoundError:
+            self._docs, self._vocab_docs = {}, {}
+        except Exception as e:
+            logger.warning("acronym lexicon load failed (%s): %s", self.path, e)
+            self._docs, self._vocab_docs = {}, {}
+        self._rebuild()
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 2, "docs": self._docs, "vocab": self._vocab_docs}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning("acronym lexicon save failed (%s): %s", self.path, e)
+
+    def _rebuild(self) -> None:
+        terms: Dict[str, Tuple[int, int, int]] = {}
+        for entries in self._docs.values():
+            for term, (upper, lower) in entries.items():
+                df, u, lo = terms.get(term, (0, 0, 0))
+                terms[term] = (df + 1, u + upper, lo + lower)
+        self._terms = terms
+        self._speller = None  # beim nächsten speller()-Aufruf neu aufbauen
+
+    # ---- public API ---------------------------------------------------------
+    def has_document(self, doc_id: str) -> bool:
+        # Lexika ohne Wortschatz (version 1) gelten als unvollständig → Nachindexierung
+        return doc_id in self._docs and doc_id in self._vocab_docs
+
+    def set_document(self, doc_id: str, texts: Iterable[str]) -> int:
+        counts = _count_tokens(texts)
+        entries = extract_acronyms((), counts)
+        vocab = extract_vocabulary(counts)
+        with self._lock:
+            self._docs[doc_id] = entries
+            self._vocab_docs[doc_id] = vocab
+            self._rebuild()
+            self._save()
+        return len(entries)
+
+    def remove_document(self, doc_id: str) -> None:
+        with self._lock:
+            self._vocab_docs.pop(doc_id, None)
+            if self._docs.pop(doc_id, None) is not None:
+                self._rebuild()
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs, self._vocab_docs = {}, {}
+            self._rebuild()
+            self._save()
+
+    def accepts(self, term: str, typed_lower: bool = False) -> bool:
+        """
+        term (großgeschrieben) kommt im Korpus als Akronym vor. Klein getippte Anfragen ("can you …")
+        zählen nur, wenn das Wort im Korpus überwiegend als Akronym auftritt.
+        """
+        entry = self._terms.get(term)
+        if entry is None:
+            return False
+        return not typed_lower or entry[2] <= LEXICON_LOWER_RATIO * entry[1]
+
+    def speller(self) -> QuerySpeller:
+        """Löschnachbarschafts-Index über Akronyme und Wortschatz (lazy, bis zur nächsten Änderung)."""
+        speller = self._speller
+        if speller is None:
+            with self._lock:
+                speller = self._speller
+                if speller is None:
+                    words: Counter = Counter()
+                    for vocab in self._vocab_docs.values():
+                        words.update(vocab)
+                    acronyms = {t: e[1] for t, e in self._terms.items()}
+                    speller = QuerySpeller(acronyms, words, accepts=self.accepts)
+                    self._speller = speller
+                    logger.info("Spell index: %s acronyms, %s words", len(acronyms), len(words))
+        return speller
+
+    def document_frequency(self, term: str) -> int:
+        entry = self._terms.get((term or "").upper())
+        return entry[0] if entry else 0
+
+    def __contains__(self, term: object) -> bool:
+        return isinstance(term, str) and term.upper() in self._terms
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def top_terms(self, limit: int = 20) -> List[Tuple[str, int]]:
+        """Häufigste Akronyme nach Dokumenthäufigkeit (Diagnose)."""
+        ranked = sorted(self._terms.items(), key=lambda kv: (-kv[1][0], -kv[1][1]))
+        return [(t, e[0]) for t, e in ranked[:limit]]
+
+
+def load_lexicon(path: str) -> Optional[AcronymLexicon]:
+    try:
+        return AcronymLexicon(path)
+    except Exception as e:  # pragma: no cover - defensiv
+        logger.warning("acronym lexicon unavailable: %s", e)
+        return None
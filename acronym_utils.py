@@ -19,8 +19,29 @@ PREFERRED_TERMS = {
     "CAN", "CAN-FD", "OEM", "RASIC", "CAL", "ISO", "SAE",
 }
 
+# Definitionszeilen mit diesen Wörtern stammen aus Vorwort/Impressum o. Ä. und werden verworfen
+# (gemeinsam genutzt von retrieval und dem Glossar-Index).
+BAD_DEFN_WORDS = {
+    "foreword", "vorwort", "table of contents", "inhalt", "copyright",
+    "all rights reserved", "wto", "technical barriers to trade", "patent",
+    "feedback", "iec", "beuth", "best beuth",
+    "figure", "overview of this document", "general considerations",
+    "scope of this", "introduction", "normative references"
+}
+
+
+# Korpus-Lexikon (acronym_lexicon.AcronymLexicon), von vector_store beim Start registriert.
+# Solange es leer ist, entscheidet allein die Heuristik unten.
+_lexicon = None
+
+
+def set_lexicon(lexicon) -> None:
+    """Aktives Akronym-Lexikon setzen (None = nur Heuristik)."""
+    global _lexicon
+    _lexicon = lexicon
 
-def detect_acronym(text: str) -> Optional[str]:
+
+def detect_acronym(text: str, lexicon=None) -> Optional[str]:
     """
     Gibt das wahrscheinlichste Schlüsselwort/die wahrscheinlichste Abkürzung (in Großbuchstaben) aus dem Text zurück.
     Gleiche Logik für die Abfrage und die Vektorspeicherung:
@@ -30,6 +51,9 @@ def detect_acronym(text: str) -> Optional[str]:
         * für GROSSBUCHSTABEN (CAN, OEM)
         * für bevorzugte Begriffe (CAN, CAN-FD, OEM, RASIC, CAL, ISO, SAE)
         - Bei Punktgleichheit wird der Wert links neben der Frage ausgewählt.
+    Ist ein Korpus-Lexikon aktiv, zählen Wörter ohne Ziffern nur, wenn sie als Akronym in den
+    Dokumenten vorkommen (Dict-Lookup) – klein getippt ("can you …") nur, wenn das Wort im
+    Korpus überwiegend großgeschrieben steht.
     """
     if not text:
         return None
@@ -38,6 +62,10 @@ def detect_acronym(text: str) -> Optional[str]:
     if not tokens:
         return None
 
+    lex = lexicon if lexicon is not None else _lexicon
+    if lex is not None and not len(lex):
+        lex = None
+
     candidates: List[Tuple[int, int, str]] = []  # (score, index, TERM)
 
     for idx, tok in enumerate(tokens):
@@ -45,10 +73,14 @@ def detect_acronym(text: str) -> Optional[str]:
         if norm.lower() in ACRONYM_STOP:
             continue
 
+        has_digit = any(ch.isdigit() for ch in norm)
+        if lex is not None and not has_digit and not lex.accepts(norm, typed_lower=not tok.isupper()):
+            continue
+
         score = 0
 
         # 1) Begriffe mit Zahlen (21434, ISO/SAE 21434) – wichtige Standards
-        if any(ch.isdigit() for ch in norm):
+        if has_digit:
             score += 2
 
         # 2) Vollständig großgeschriebene – typische Abkürzungen: CAN, OEM, CAL, RASIC
@@ -0,0 +1,141 @@
+# answer_cache.py
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from query_plan import question_guard  # Akronym + Normnummern: "Was ist CAL?" ≠ "Was ist TARA?"
+
+logger = logging.getLogger("answer_cache")
+
+
+class SemanticAnswerCache:
+    """
+    Antwort-Cache für fast gleiche Fragen, indiziert über das Frage-Embedding.
+    Treffer nur bei gleicher Zielsprache, gleicher Korpus-Generation, gleichen Guard-Merkmalen
+    und Kosinus-Distanz ≤ max_distance (Embeddings sind L2-normalisiert → Skalarprodukt).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        *,
+        max_distance: float = 0.1,
+        ttl: float = 0.0,
+        name: str = "answers",
+    ) -> None:
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.max_distance = max(0.0, float(max_distance))
+        self.ttl = max(0.0, float(ttl))
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[Tuple, List[int]] = {}  # (lang, generation, guard) -> Eintrags-IDs
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.guard_misses = 0  # kein Eintrag mit passender Sprache/Generation/Guard
+        self.evictions = 0
+        self._hit_sim_sum = 0.0
+        self._best_miss_sim = 0.0
+
+    def _bucket(self, question: str, lang: str, generation: int, guard: Optional[Tuple]) -> Tuple:
+        return ((lang or "").upper(), int(generation), guard if guard is not None else question_guard(question))
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets.get(entry["bucket"])
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._buckets[entry["bucket"]]
+
+    def lookup(
+        self, question: str, embedding: Sequence[float], *, lang: str, generation: int,
+        guard: Optional[Tuple] = None,
+    ) -> Optional[Tuple[str, float, str]]:
+        """Rückgabe: (Antwort, Ähnlichkeit, ursprüngliche Frage) oder None. guard: QueryPlan.guard."""
+        bucket = self._bucket(question, lang, generation, guard)
+        now = time.monotonic()
+        with self._lock:
+            for i in [i for i in self._buckets.get(bucket, []) if 0 < self._entries[i]["expires_at"] < now]:
+                self._drop(i)
+            ids = list(self._buckets.get(bucket, []))
+            if not ids:
+                self.misses += 1
+                self.guard_misses += 1
+                return None
+            q = np.asarray(embedding, dtype=np.float32)
+            sims = np.stack([self._entries[i]["emb"] for i in ids]) @ q
+            j = int(np.argmax(sims))
+            sim = float(sims[j])
+            if 1.0 - sim > self.max_distance:
+                self.misses += 1
+                self._best_miss_sim = max(self._best_miss_sim, sim)
+                logger.info("answer cache miss: best sim=%.3f (need ≥ %.3f) q=%r", sim, 1.0 - self.max_distance, question)
+                return None
+            entry = self._entries[ids[j]]
+            self._entries.move_to_end(ids[j])
+            self.hits += 1
+            self._hit_sim_sum += sim
+        logger.info(
+            "answer cache hit: sim=%.3f q=%r ~ %r (hit rate %.0f%%)",
+            sim, question, entry["question"], 100.0 * self.hits / max(1, self.hits + self.misses),
+        )
+        return entry["answer"], sim, entry["question"]
+
+    def store(
+        self, question: str, embedding: Sequence[float], answer: str, *, lang: str, generation: int,
+        guard: Optional[Tuple] = None,
+    ) -> None:
+        if not answer:
+            return
+        emb = np.asarray(embedding, dtype=np.float32)
+        bucket = self._bucket(question, lang, generation, guard)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "emb": emb,
+                "bucket": bucket,
+                "question": question,
+                "answer": answer,
+                "expires_at": time.monotonic() + self.ttl if self.ttl else 0.0,
+            }
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "guard_misses": self.guard_misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "avg_hit_similarity": (self._hit_sim_sum / self.hits) if self.hits else 0.0,
+            "best_miss_similarity": self._best_miss_sim,
+            "evictions": self.evictions,
+        }
+
+
+answer_cache = SemanticAnswerCache(
+    int(os.getenv("ANSWER_CACHE_SIZE", "256")),
+    max_distance=float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.1")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+)
@@ -8,7 +8,8 @@ from telegram import Update, BotCommand
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 import asyncio
 from contextlib import asynccontextmanager
-from llm_client import test_ollama_connection
+from llm_client import LLM_BACKEND, probe_capabilities, test_ollama_connection
+import http_pool
 
 
 # Konfiguration aus Umgebungsvariablen (kein hartkodiertes Token!)
@@ -107,6 +108,8 @@ async def lifespan(_app: FastAPI):
     await application.initialize()
     await application.start()
     await setup_webhook(application)
+    # Gemeinsame HTTP-Pools für die LLM-Backends (Keep-Alive statt Handshake pro Anfrage)
+    await http_pool.start(["groq"] if LLM_BACKEND == "groq" else ["ollama"])
     # Ollama availability check
     try:
         ok = await test_ollama_connection()
@@ -114,6 +117,9 @@ async def lifespan(_app: FastAPI):
             logger.error("Ollama ist nicht erreichbar – bitte prüfen (URL/Port/Modell).")
         else:
             logger.info("Ollama-Verbindung OK.")
+            if LLM_BACKEND != "groq":
+                # Endpunkt/Optionen einmal ermitteln → pro Frage genau eine Anfrage
+                await probe_capabilities()
     except Exception as e:
         logger.error(f"Ollama-Check Fehler: {e}")
     try:
@@ -138,6 +144,7 @@ async def lifespan(_app: FastAPI):
         await application.shutdown()
     except Exception as e:
         logger.exception(f"Fehler beim Stoppen des Bots: {e}")
+    await http_pool.close()
 
 # FastAPI App (mit Lifespan-Handler statt on_event)
 app = FastAPI(title="Telegram Bot API", version="1.0.0", lifespan=lifespan)
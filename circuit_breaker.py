@@ -0,0 +1,153 @@
+# circuit_breaker.py
+# Schutzschalter pro LLM-Backend: Häufen sich im gleitenden Fenster der letzten Aufrufe Fehler
+# (oder zu langsame Aufrufe), wird der Kreis geöffnet und Anfragen scheitern sofort mit CircuitOpen,
+# statt Handler-Slots bis zum Timeout zu blockieren. Nach der Sperrzeit prüft ein einzelner Test
+# (Ollama: /api/tags) bzw. ein einzelner Probeaufruf, ob das Backend wieder erreichbar ist.
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger("circuit_breaker")
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "4"))
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_OPEN_S = float(os.getenv("LLM_BREAKER_OPEN_S", "30"))
+# Aufrufe über dieser Dauer (s) zählen als ungesund (0 = nur Fehler zählen)
+LLM_BREAKER_SLOW_S = float(os.getenv("LLM_BREAKER_SLOW_S", "0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(RuntimeError):
+    """Backend gilt als gestört; Anfrage wurde ohne Netzwerkzugriff abgewiesen."""
+
+
+class CircuitBreaker:
+    """
+    Gleitendes Fenster der letzten window Aufrufe (Erfolg, Dauer), Einträge älter als horizon
+    Sekunden zählen nicht mehr. probe: optionaler Gesundheitstest für den halboffenen Zustand.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        failure_ratio: float = LLM_BREAKER_FAILURE_RATIO,
+        open_seconds: float = LLM_BREAKER_OPEN_S,
+        slow_seconds: float = LLM_BREAKER_SLOW_S,
+        horizon: float = 600.0,
+        probe: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> None:
+        self.name = name
+        self.min_calls = max(1, int(min_calls))
+        self.failure_ratio = float(failure_ratio)
+        self.open_seconds = max(0.0, float(open_seconds))
+        self.slow_seconds = max(0.0, float(slow_seconds))
+        self.horizon = float(horizon)
+        self.probe = probe
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool, float]] = deque(maxlen=max(1, int(window)))  # (Zeit, ok, Dauer)
+        self._opened_at = 0.0
+        self._trial = False  # halboffen ohne probe: genau ein Probeaufruf
+        self._probing = False
+        self.rejected = 0
+        self.trips = 0
+
+    def _window(self) -> Deque[Tuple[float, bool, float]]:
+        cutoff = time.monotonic() - self.horizon
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+        return self._calls
+
+    def _unhealthy(self, ok: bool, latency: float) -> bool:
+        return not ok or (self.slow_seconds > 0 and latency > self.slow_seconds)
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial = False
+        self.trips += 1
+        logger.warning("%s circuit opened (%s); failing fast for %.0f s", self.name, reason, self.open_seconds)
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._calls.clear()
+        self._trial = False
+        logger.info("%s circuit closed", self.name)
+
+    def is_open(self) -> bool:
+        """Offen und Sperrzeit noch nicht abgelaufen (ohne Zustandswechsel)."""
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    async def before(self) -> None:
+        """Vor jedem Aufruf: CircuitOpen, solange der Kreis offen ist (bzw. der Test fehlschlägt)."""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit open")
+            self.state = HALF_OPEN
+        if self.probe is not None:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit half-open, health probe running")
+            self._probing = True
+            try:
+                healthy = await self.probe()
+            except Exception as e:
+                logger.debug("%s probe failed: %s", self.name, e)
+                healthy = False
+            finally:
+                self._probing = False
+            if healthy:
+                self._close()
+                return
+            self._open("health probe failed")
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit open")
+        if self._trial:
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit half-open, trial call running")
+        self._trial = True
+
+    def record(self, ok: bool, latency: float) -> None:
+        """Ergebnis eines Aufrufs (Abbrüche durch den Aufrufer nicht melden)."""
+        unhealthy = self._unhealthy(ok, latency)
+        if self.state == HALF_OPEN:
+            if unhealthy:
+                self._open("trial call failed")
+            else:
+                self._close()
+            return
+        calls = self._window()
+        calls.append((time.monotonic(), ok, latency))
+        if self.state == CLOSED and len(calls) >= self.min_calls:
+            bad = sum(1 for _, ok_, lat in calls if self._unhealthy(ok_, lat))
+            if bad / len(calls) >= self.failure_ratio:
+                self._open(f"{bad}/{len(calls)} recent calls failed or slow")
+
+    def abort(self) -> None:
+        """Aufruf ohne Ergebnis beendet (abgebrochen): halboffen darf der nächste Aufruf testen."""
+        self._trial = False
+
+    def stats(self) -> Dict:
+        calls = list(self._window())
+        lats = sorted(lat for _, ok, lat in calls if ok)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "calls": len(calls),
+            "failures": sum(1 for _, ok, _ in calls if not ok),
+            "latency_p50_ms": lats[len(lats) // 2] * 1000.0 if lats else 0.0,
+            "latency_p95_ms": lats[min(len(lats) - 1, int(len(lats) * 0.95))] * 1000.0 if lats else 0.0,
+            "rejected": self.rejected,
+            "trips": self.trips,
+        }
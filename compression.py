@@ -0,0 +1,132 @@
+# compression.py
+# Extraktive Kontextkompression vor dem LLM-Aufruf (optional, CONTEXT_COMPRESSION=1).
+# Auszüge werden in Sätze zerlegt, Sätze gegen das Anfrage-Embedding bewertet (ein Batch über
+# alle Sätze, gecacht) und nur die besten bis zum Tokenbudget behalten. Definitionssätze und
+# Tabellenzeilen werden nicht weiter zerlegt und haben Vorrang; passen sie nicht ins Budget, werden
+# sie gekürzt – die Definition des gefragten Begriffs entfällt nie.
+import logging
+import os
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cache_utils import LRUCache
+from matchers import defn_regex, split_sentences
+from token_budget import TokenCounter, token_counter
+
+logger = logging.getLogger("compression")
+
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "0") == "1"
+# Anteil der Auszugstokens, der höchstens behalten wird (zusätzlich zum Tokenbudget)
+COMPRESSION_RATIO = float(os.getenv("COMPRESSION_RATIO", "0.5"))
+COMPRESSION_MIN_TOKENS = int(os.getenv("COMPRESSION_MIN_TOKENS", "96"))
+
+_TABLE_ROW_RE = re.compile(r"^(table|tabelle)\b", re.IGNORECASE)
+# generische Glossarzeile "TERM – Definition" / "TERM: Definition"
+_DEFN_LINE_RE = re.compile(r"^[A-ZÄÖÜ][A-ZÄÖÜ0-9/\-]{1,14}\s*[-–—:]\s+\S")
+
+# Rang einer Einheit: Definition des gefragten Begriffs > Tabellen-/Glossarzeile > normaler Satz
+_TERM_DEFN, _WHOLE, _FREE = 2, 1, 0
+# Tabellen-/Glossarzeilen werden nur gekürzt aufgenommen, wenn mindestens so viel Budget übrig ist
+_MIN_UNIT_TOKENS = 24
+
+# Satz → Embedding; dieselben Chunks kommen über Anfragen hinweg immer wieder
+_sentence_embeddings = LRUCache(int(os.getenv("SENTENCE_CACHE_SIZE", "8192")), name="sentence_embeddings")
+
+
+def _unit_rank(sentence: str, term_re: Optional[re.Pattern]) -> int:
+    if term_re is not None and term_re.search(sentence):
+        return _TERM_DEFN
+    if "|" in sentence or _TABLE_ROW_RE.match(sentence) or _DEFN_LINE_RE.match(sentence):
+        return _WHOLE
+    return _FREE
+
+
+def _encode_cached(sentences: Sequence[str], encode: Callable[[List[str]], List[List[float]]]) -> np.ndarray:
+    found = {s: _sentence_embeddings.get(s) for s in dict.fromkeys(sentences)}
+    missing = [s for s, e in found.items() if e is None]
+    if missing:
+        for s, e in zip(missing, encode(missing)):
+            found[s] = np.asarray(e, dtype=np.float32)
+            _sentence_embeddings.put(s, found[s])
+    return np.stack([found[s] for s in sentences])
+
+
+def compress_chunks(
+    q_emb: Sequence[float],
+    chunks: List[Dict],
+    max_tokens: int,
+    *,
+    encode: Callable[[List[str]], List[List[float]]],
+    term: Optional[str] = None,
+    ratio: float = COMPRESSION_RATIO,
+    counter: Optional[TokenCounter] = None,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Kürzt die Texte der Chunks auf die relevantesten Sätze.
+    Ziel = min(max_tokens, ratio · Gesamttokens), mindestens COMPRESSION_MIN_TOKENS.
+    Rückgabe: (neue Chunk-Liste in gleicher Reihenfolge, {"tokens_before", "tokens_after", "sentences", "kept"}).
+    Glossartreffer bleiben unverändert; Chunks ohne behaltenen Satz entfallen.
+    """
+    counter = counter or token_counter
+    term_re = defn_regex(term) if term else None
+
+    # Einheiten: (chunk, zeile, satz, rang) – Chunks sind meist eine einzige lange Zeile,
+    # deshalb immer erst in Sätze zerlegen und nur den passenden Satz bevorzugen
+    units: List[Tuple[int, int, str, int]] = []
+    for ci, c in enumerate(chunks):
+        if c.get("glossary"):
+            units.append((ci, 0, (c.get("text") or "").strip(), _TERM_DEFN))
+            continue
+        for li, raw in enumerate((c.get("text") or "").splitlines()):
+            for sent in split_sentences(raw.strip()):
+                sent = sent.strip()
+                if sent:
+                    units.append((ci, li, sent, _unit_rank(sent, term_re)))
+
+    costs = np.fromiter((counter.count(u[2]) for u in units), dtype=np.int64, count=len(units))
+    total = int(costs.sum())
+    stats = {"tokens_before": total, "tokens_after": total, "sentences": len(units), "kept": len(units)}
+    target = min(max_tokens, max(COMPRESSION_MIN_TOKENS, int(total * ratio)))
+    if not units or total <= target:
+        return chunks, stats
+
+    ranks = np.fromiter((u[3] for u in units), dtype=np.int64, count=len(units))
+    free = np.flatnonzero(ranks == _FREE)
+    scores = np.zeros(len(units), dtype=np.float32)
+    if free.size:
+        q = np.asarray(q_emb, dtype=np.float32)
+        scores[free] = _encode_cached([units[i][2] for i in free], encode) @ q
+
+    texts = [u[2] for u in units]
+    keep = np.zeros(len(units), dtype=bool)
+    used = 0
+    for i in np.lexsort((-scores, -ranks)):  # Rang zuerst, dann Ähnlichkeit
+        room = target - used
+        if costs[i] <= room:
+            keep[i] = True
+            used += int(costs[i])
+        elif ranks[i] == _TERM_DEFN or (ranks[i] == _WHOLE and room >= _MIN_UNIT_TOKENS):
+            # zu lange Definition/Tabellenzeile kürzen statt verwerfen
+            texts[i] = counter.truncate(texts[i], max(room, _MIN_UNIT_TOKENS))
+            keep[i] = True
+            used += counter.count(texts[i])
+
+    out: List[Dict] = []
+    for ci, c in enumerate(chunks):
+        lines: Dict[int, List[str]] = {}
+        for i, (uci, li, _, _) in enumerate(units):
+            if uci == ci and keep[i]:
+                lines.setdefault(li, []).append(texts[i])
+        if lines:
+            out.append({**c, "text": "\n".join(" ".join(parts) for _, parts in sorted(lines.items()))})
+
+    if not out:
+        return chunks, stats
+    stats.update(tokens_after=used, kept=int(keep.sum()))
+    logger.info(
+        "context compressed: %s → %s tokens (%.0f%%), %s/%s sentences, %s → %s chunks",
+        total, used, 100.0 * (1 - used / max(1, total)), stats["kept"], len(units), len(chunks), len(out),
+    )
+    return out, stats
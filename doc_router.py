@@ -0,0 +1,151 @@
+# doc_router.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Gewicht des besten Abschnitts gegenüber dem Dokument-Zentroid beim Routing
+ROUTE_SECTION_WEIGHT = float(os.getenv("ROUTE_SECTION_WEIGHT", "0.7"))
+
+
+def _centroid(embs: np.ndarray) -> np.ndarray:
+    c = embs.mean(axis=0)
+    n = float(np.linalg.norm(c))
+    return c / n if n > 0 else c
+
+
+class DocumentRouter:
+    """
+    Grob-Routing vor der Chunk-Suche: pro Dokument ein Zentroid und pro Abschnitt ein Zentroid
+    (L2-normalisierte Mittelwerte der Chunk-Embeddings), beim Indexieren berechnet.
+    route() ist eine Matrixmultiplikation über alle Dokumente/Abschnitte – unabhängig von
+    der Chunk-Anzahl. Persistiert als JSON neben der Chroma-Datenbank.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict] = {}
+        self._ids: List[str] = []
+        self._doc_mat = np.zeros((0, 0), dtype=np.float32)
+        self._sec_mat = np.zeros((0, 0), dtype=np.float32)
+        self._sec_owner = np.zeros(0, dtype=np.int64)
+        self._load()
+
+    # ---- Persistenz ---------------------------------------------------------
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            self._docs = dict(data.get("docs") or {})
+        except FileNotFoundError:
+            self._docs = {}
+        except Exception as e:
+            logger.warning("router load failed (%s): %s", self.path, e)
+            self._docs = {}
+        self._rebuild()
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "docs": self._docs}, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning("router save failed (%s): %s", self.path, e)
+
+    def _rebuild(self) -> None:
+        ids = sorted(self._docs)
+        dim = len(self._docs[ids[0]]["centroid"]) if ids else 0
+        docs, secs, owner = [], [], []
+        for i, doc_id in enumerate(ids):
+            entry = self._docs[doc_id]
+            docs.append(entry["centroid"])
+            for s in entry.get("sections") or []:
+                secs.append(s["centroid"])
+                owner.append(i)
+        self._ids = ids
+        self._doc_mat = np.asarray(docs, dtype=np.float32).reshape(len(ids), dim)
+        self._sec_mat = np.asarray(secs, dtype=np.float32).reshape(len(secs), dim)
+        self._sec_owner = np.asarray(owner, dtype=np.int64)
+
+    # ---- public API ---------------------------------------------------------
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def set_document(self, doc_id: str, embeddings: np.ndarray, sections: Sequence[Tuple[str, Sequence[int]]]) -> int:
+        """
+        embeddings: [n_chunks, d] (L2-normalisiert); sections: [(Name, Zeilenindizes in embeddings)].
+        Rückgabe: Anzahl Abschnitte.
+        """
+        embs = np.asarray(embeddings, dtype=np.float32)
+        if embs.ndim != 2 or not len(embs):
+            return 0
+        entry = {
+            "centroid": _centroid(embs).tolist(),
+            "chunks": int(len(embs)),
+            "sections": [
+                {"name": name, "centroid": _centroid(embs[list(rows)]).tolist()}
+                for name, rows in sections
+                if len(rows)
+            ],
+        }
+        with self._lock:
+            if self._doc_mat.size and self._doc_mat.shape[1] != embs.shape[1]:
+                # anderes Embedding-Modell → alte Zentroiden sind unbrauchbar
+                self._docs = {}
+            self._docs[doc_id] = entry
+            self._rebuild()
+            self._save()
+        return len(entry["sections"])
+
+    def remove_document(self, doc_id: str) -> None:
+        with self._lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self._rebuild()
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs = {}
+            self._rebuild()
+            self._save()
+
+    def route(
+        self, q_emb: Sequence[float], k: int, candidates: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Die k passendsten Dokumente (Score = w · bester Abschnitt + (1 − w) · Dokument-Zentroid).
+        candidates schränkt auf diese Dokumente ein; unbekannte Kandidaten (noch ohne Zentroid)
+        werden mit Score None angehängt, damit sie nicht unsichtbar bleiben.
+        """
+        ids, doc_mat, sec_mat, owner = self._ids, self._doc_mat, self._sec_mat, self._sec_owner
+        q = np.asarray(q_emb, dtype=np.float32)
+        out: List[Tuple[str, float]] = []
+        if ids and doc_mat.shape[1] == q.shape[0]:
+            doc_sims = doc_mat @ q
+            best_sec = doc_sims.copy()
+            if len(sec_mat):
+                np.maximum.at(best_sec, owner, sec_mat @ q)
+            scores = ROUTE_SECTION_WEIGHT * best_sec + (1.0 - ROUTE_SECTION_WEIGHT) * doc_sims
+            allowed = None if candidates is None else set(candidates)
+            for i in np.argsort(-scores, kind="stable"):
+                if allowed is None or ids[i] in allowed:
+                    out.append((ids[i], float(scores[i])))
+                if len(out) >= k:
+                    break
+        if candidates is not None:
+            known = set(ids)
+            out.extend((c, None) for c in candidates if c not in known)
+        return out
+
+    def __len__(self) -> int:
+        return len(self._ids)
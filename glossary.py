@@ -0,0 +1,204 @@
+# glossary.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from matchers import BAD_DEFN_MATCHER, has_url
+
+logger = logging.getLogger(__name__)
+
+# Wörter, die beim Abgleich der Anfangsbuchstaben einer Ausschreibung übersprungen werden dürfen
+_FILLER_WORDS = {
+    "and", "of", "for", "the", "to", "in", "on", "a", "an",
+    "und", "der", "die", "das", "für", "von", "zur", "zum",
+}
+
+_ACR = r"[A-ZÄÖÜ][A-ZÄÖÜ0-9]{1,9}(?:-[A-Z0-9]{1,5})?"
+
+# TERM – Expansion / TERM: Definition (endet am Satzende oder am nächsten "TERM –")
+_RIGHT_RE = re.compile(
+    rf"(?<![\w\-/])({_ACR})\s*[-–—:]\s*([A-Za-zÄÖÜäöüß][^\n]{{2,200}}?)"
+    rf"(?=\s+{_ACR}\s*[-–—:]\s|[\.;](?:\s|$)|\n|$)"
+)
+# Expansion (TERM)
+_LEFT_RE = re.compile(rf"([A-Za-zÄÖÜäöüß][A-Za-zÄÖÜäöüß \-/]{{2,80}}?)\s*\(\s*({_ACR})\s*\)")
+
+
+def _initials_match(term: str, words: List[str]) -> bool:
+    """True, wenn die Anfangsbuchstaben der (nicht-Füll-)Wörter das Akronym ergeben."""
+    letters = [ch for ch in term.upper() if ch.isalpha()]
+    initials = [w[0].upper() for w in words if w and w.casefold() not in _FILLER_WORDS]
+    return bool(letters) and initials == letters
+
+
+def _prefix_matches(term: str, words: List[str]) -> bool:
+    """True, wenn ein Anfangsstück der Definition das Akronym ausschreibt ("CAN — Controller Area Network used …")."""
+    return any(_initials_match(term, words[:n]) for n in range(1, min(len(words), 12) + 1))
+
+
+def _trim_left_expansion(term: str, text: str) -> Optional[str]:
+    """
+    Bei "… lange Vorrede Threat Analysis and Risk Assessment (TARA)" nur den Teil behalten,
+    dessen Anfangsbuchstaben das Akronym bilden. Gibt None zurück, wenn nichts passt.
+    """
+    words = text.split()
+    for start in range(len(words) - 1, -1, -1):
+        cand = words[start:]
+        if _initials_match(term, cand):
+            return " ".join(cand)
+    return None
+
+
+def _is_clean(defn: str) -> bool:
+    low = (defn or "").casefold()
+    if len(low) < 3 or has_url(low):
+        return False
+    return not BAD_DEFN_MATCHER.search(low)
+
+
+def extract_glossary_entries(text: str) -> List[Dict]:
+    """
+    Findet Glossarzeilen der Form "TERM – Expansion", "TERM: Definition" und "Expansion (TERM)".
+    Rückgabe: Liste von {"term", "definition", "form", "initials"}; gefiltert über BAD_DEFN_WORDS.
+    """
+    if not text:
+        return []
+    out: List[Dict] = []
+    for m in _RIGHT_RE.finditer(text):
+        term = m.group(1).upper()
+        defn = m.group(2).strip(" ,–—-")
+        if not _is_clean(defn):
+            continue
+        out.append({
+            "term": term,
+            "definition": defn,
+            "form": "right",
+            "initials": _prefix_matches(term, defn.split()),
+        })
+    for m in _LEFT_RE.finditer(text):
+        term = m.group(2).upper()
+        defn = _trim_left_expansion(term, m.group(1).strip())
+        if not defn or not _is_clean(defn):
+            continue
+        out.append({"term": term, "definition": defn, "form": "left", "initials": True})
+    return out
+
+
+def _entry_score(entry: Dict) -> float:
+    score = 0.0
+    if entry.get("initials"):
+        score += 2.0
+    if entry.get("form") == "right":
+        score += 1.0
+    # kurze, prägnante Zeilen bevorzugen (wie find_definition_in_chunks)
+    score += max(0, 160 - len(entry.get("definition", ""))) / 160.0
+    return score
+
+
+class GlossaryIndex:
+    """
+    Akronym → Liste von Definitionszeilen (doc, chunk, Seite), beim Indexieren aufgebaut.
+    Persistiert als JSON neben der Chroma-Datenbank; Lookup ist ein einzelner Dict-Zugriff.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs: Dict[str, List[Dict]] = {}
+        self._terms: Dict[str, List[Dict]] = {}
+        self._load()
+
+    # ---- Persistenz ---------------------------------------------------------
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            self._docs = {k: list(v or []) for k, v in (data.get("docs") or {}).items()}
+        except FileNotFoundError:
+            self._docs = {}
+        except Exception as e:
+            logger.warning("glossary load failed (%s): %s", self.path, e)
+            self._docs = {}
+        self._rebuild()
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "docs": self._docs}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning("glossary save failed (%s): %s", self.path, e)
+
+    def _rebuild(self) -> None:
+        terms: Dict[str, List[Dict]] = {}
+        for entries in self._docs.values():
+            for e in entries:
+                terms.setdefault(e["term"], []).append(e)
+        for term, entries in terms.items():
+            # gleiche Ausschreibung in mehreren Dokumenten/Chunks → höheres Gewicht
+            freq: Dict[str, int] = {}
+            for e in entries:
+                k = e["definition"].casefold()
+                freq[k] = freq.get(k, 0) + 1
+            entries.sort(
+                key=lambda e: (_entry_score(e) + 0.5 * (freq[e["definition"].casefold()] - 1)),
+                reverse=True,
+            )
+        self._terms = terms
+
+    # ---- public API ---------------------------------------------------------
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def set_document(self, doc_id: str, chunks: List[Dict]) -> int:
+        """
+        Ersetzt die Glossareinträge eines Dokuments.
+        chunks: [{"text", "chunk_id", "chunk_index", "page"?}] (wie in Chroma gespeichert)
+        """
+        entries: List[Dict] = []
+        seen = set()
+        for c in chunks or []:
+            for e in extract_glossary_entries(c.get("text") or ""):
+                key = (e["term"], e["definition"].casefold())
+                if key in seen:
+                    continue
+                seen.add(key)
+                entries.append({
+                    **e,
+                    "doc_id": doc_id,
+                    "chunk_id": c.get("chunk_id", ""),
+                    "chunk_index": c.get("chunk_index", 0),
+                    "page": c.get("page"),
+                })
+        with self._lock:
+            self._docs[doc_id] = entries
+            self._rebuild()
+            self._save()
+        return len(entries)
+
+    def remove_document(self, doc_id: str) -> None:
+        with self._lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self._rebuild()
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs = {}
+            self._terms = {}
+            self._save()
+
+    def lookup(self, term: str, limit: int = 5) -> List[Dict]:
+        if not term:
+            return []
+        return list(self._terms.get(term.upper(), [])[:limit])
+
+    def __len__(self) -> int:
+        return len(self._terms)
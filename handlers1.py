@@ -3,7 +3,7 @@ import os
 import re
 import logging
 import asyncio
-from typing import Dict, List
+from typing import Dict, List, Optional
 import io
 import contextlib
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
@@ -14,13 +14,36 @@ from indexer import schedule_index, preindex_running, preindex_done, preindex_to
 from retrieval import (
     get_best_chunks_for_document,
     get_best_chunks_global,
+    get_best_chunks_scoped,
     build_combined_excerpts,
-    detect_acronym,
     find_definition_in_chunks,
     find_chunk_with_term,
+    select_diverse,
+    expand_neighbours,
+    retrieval_cache_stats,
+    scoped_hits_sufficient,
 )
+from ranking import dedup_chunks
+from answer_cache import answer_cache
+from query_plan import QueryPlan, detect_language
+from spell_index import correct_query, format_corrections
+from compression import CONTEXT_COMPRESSION, compress_chunks
 from vector_store import vector_store
-from llm_client import ask_ollama
+from llm_client import (
+    LLM_BACKEND,
+    OLLAMA_STREAM,
+    StreamRenderer,
+    ask_ollama,
+    ask_ollama_stream,
+    context_token_budget,
+    finalize_response,
+    llm_flights,
+    llm_router,
+    response_cache,
+    tier_selector,
+)
+from http_pool import pool_stats
+from llm_scheduler import PRIORITY_ANSWER, PRIORITY_DEFINITION, llm_scheduler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -70,6 +93,11 @@ logger.addFilter(_CensorFilter())
 MAX_EXCERPTS = int(os.getenv("MAX_EXCERPTS", "2"))
 PROTECT_CONTENT = os.getenv("PROTECT_CONTENT", "1") == "1"
 ACRONYM_STRICT = os.getenv("ACRONYM_STRICT", "1") == "1"
+# Auffächerung pro Dokument nur auf die k per Zentroid gerouteten Dokumente
+ROUTE_TOP_K = int(os.getenv("ROUTE_TOP_K", "3"))
+# Antworten streamen (OLLAMA_STREAM=1, nur Ollama) und die Nachricht höchstens alle N Sekunden bearbeiten
+STREAM_ANSWERS = OLLAMA_STREAM and LLM_BACKEND == "ollama"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
 
 _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PDF_DIR = os.getenv('PDF_DIR', _SCRIPT_DIR)
@@ -80,6 +108,8 @@ if PDF_DIR == _SCRIPT_DIR:
 user_pages_state: Dict[int, Dict] = {}
 # Einfacher Screenshot-Zustand pro Benutzer
 SCREENSHOT_STATE: Dict[int, Dict] = {}
+# Time-to-first-visible-token der gestreamten Antworten (Sekunden)
+stream_stats: Dict[str, float] = {"answers": 0, "ttft_total": 0.0, "ttft_max": 0.0}
 
 async def _typing_loop(bot, chat_id: int, stop_evt: asyncio.Event, period: float = 4.0) -> None:
     """Periodically send 'typing…' action until stop_evt is set."""
@@ -172,11 +202,64 @@ async def help_command(update: Update, _context: ContextTypes.DEFAULT_TYPE):
 
 async def status_command(update: Update, _context: ContextTypes.DEFAULT_TYPE):
     info = await asyncio.to_thread(vector_store.get_document_info)
+    rc = retrieval_cache_stats()
+    ac = answer_cache.stats()
     text = (
         f"VectorStore chunks: {info.get('total_chunks', 'unknown')}\n"
         f"Persist dir: {info.get('persist_directory', 'unknown')}\n"
+        f"Acronym lexicon: {info.get('acronyms', 0)} terms\n"
         f"Preindex: running={preindex_running}, done={preindex_done}/{preindex_total}\n"
+        f"Retrieval cache: {rc['entries']} entries, {rc['bytes'] // 1024} KiB, "
+        f"hit rate {rc['hit_rate']:.0%} ({rc['hits']}/{rc['hits'] + rc['misses']}), "
+        f"generation={info.get('generation', '?')}\n"
+        f"Answer cache: {ac['entries']} entries, hit rate {ac['hit_rate']:.0%} "
+        f"({ac['hits']}/{ac['hits'] + ac['misses']}), avg hit sim {ac['avg_hit_similarity']:.3f}\n"
+    )
+    if stream_stats["answers"]:
+        text += (
+            f"Streaming: {stream_stats['answers']:.0f} answers, first tokens after "
+            f"{stream_stats['ttft_total'] / stream_stats['answers'] * 1000:.0f} ms avg "
+            f"(max {stream_stats['ttft_max'] * 1000:.0f} ms)\n"
+        )
+    lc = await asyncio.to_thread(response_cache.stats)
+    if response_cache.enabled:
+        text += (
+            f"LLM cache: {lc['entries']} entries, {lc['bytes'] // 1024} KiB, hit rate {lc['hit_rate']:.0%} "
+            f"({lc['hits']}/{lc['hits'] + lc['misses']})\n"
+        )
+    ls = llm_scheduler.stats()
+    text += (
+        f"LLM queue: {ls['active']}/{ls['concurrency']} running, {ls['queued']} waiting (max {ls['max_queued']}), "
+        f"wait avg {ls['wait_avg_ms']:.0f} ms (max {ls['wait_max_ms']:.0f} ms), "
+        f"shed {ls['shed'] + ls['timed_out'] + ls['evicted']}\n"
     )
+    sf = llm_flights.stats()
+    if sf["coalesced"]:
+        text += f"LLM coalescing: {sf['coalesced']} requests joined {sf['leaders']} generations, {sf['abandoned']} abandoned\n"
+    for ep in llm_router.endpoints:
+        cb = llm_router.breaker_for(ep).stats()
+        text += (
+            f"LLM backend ({cb['name']}): circuit {cb['state']}, {cb['failures']}/{cb['calls']} recent failures, "
+            f"p50 {cb['latency_p50_ms']:.0f} ms, p95 {cb['latency_p95_ms']:.0f} ms, {cb['rejected']} fast-failed\n"
+        )
+    if len(llm_router.endpoints) > 1:
+        rs = llm_router.stats()
+        text += f"LLM routing: {rs['hedges']} hedged ({rs['hedges_skipped']} skipped), {rs['failovers']} failovers; " + ", ".join(
+            f"{e['name']} w={e['weight']:g} {e['requests']} req, {e['latency_ms']:.0f} ms, {e['hedge_wins']} hedge wins"
+            for e in rs["endpoints"]
+        ) + "\n"
+    if tier_selector is not None:
+        ts = tier_selector.stats()
+        text += "LLM model tiers: " + ", ".join(
+            f"{t['model']} {t['selected']}× ({t['tokens_per_sec']:.1f} tok/s)" for t in ts["tiers"]
+        ) + f", {ts['shortened']} shortened\n"
+    hp = pool_stats().get(LLM_BACKEND)
+    if hp:
+        text += (
+            f"LLM HTTP ({hp['name']}): {hp['requests']} requests, connections reused "
+            f"{hp['connections_reused']}/{hp['connections_reused'] + hp['connections_created']}, "
+            f"TTFB avg {hp['ttfb_avg_ms']:.0f} ms (max {hp['ttfb_max_ms']:.0f} ms)\n"
+        )
     await update.message.reply_text(text, disable_web_page_preview=True)
 
 async def button_callback(update: Update, _context: ContextTypes.DEFAULT_TYPE):
@@ -331,19 +414,25 @@ def _split_pages(text: str, max_len: int = 3600) -> List[str]:
         pages.append(current)
     return pages
 
-async def _send_paginated(update: Update, _context: ContextTypes.DEFAULT_TYPE, text: str):
+async def _send_paginated(update: Update, _context: ContextTypes.DEFAULT_TYPE, text: str, message=None):
+    """Antwort senden (bei mehreren Seiten mit Prev/Next); message: bestehende Nachricht bearbeiten statt neu senden."""
     user_id = update.effective_user.id
     # автоопределение режима
     use_html = ("<pre>" in (text or "")) or ("<b>" in (text or ""))
     parse_mode = ParseMode.HTML if use_html else None
     pages = _split_pages(text)
+
+    async def send(body: str, **kwargs):
+        if message is not None:
+            return await message.edit_text(body, **kwargs)
+        return await update.message.reply_text(body, protect_content=PROTECT_CONTENT, **kwargs)
+
     try:
         if len(pages) == 1:
-            await update.message.reply_text(
+            await send(
                 pages[0],
                 disable_web_page_preview=True,
                 parse_mode=parse_mode,
-                protect_content=PROTECT_CONTENT,
             )
             return
         user_pages_state[user_id] = {'pages': pages, 'idx': 0, 'html': use_html}
@@ -355,22 +444,20 @@ async def _send_paginated(update: Update, _context: ContextTypes.DEFAULT_TYPE, t
                 ]
             ]
         )
-        msg = await update.message.reply_text(
+        msg = await send(
             pages[0] + f"\n\n📄 1/{len(pages)}",
             reply_markup=kb,
             disable_web_page_preview=True,
             parse_mode=parse_mode,
-            protect_content=PROTECT_CONTENT,
         )
         user_pages_state[user_id]['last_message_id'] = msg.message_id
     except Exception as e:
         logger.warning(f"Send failed: {e}")
         if len(pages) == 1:
-            await update.message.reply_text(
+            await send(
                 pages[0],
                 parse_mode=None,
                 disable_web_page_preview=True,
-                protect_content=PROTECT_CONTENT,
             )
             return
         user_pages_state[user_id] = {'pages': pages, 'idx': 0, 'html': False}
@@ -382,17 +469,120 @@ async def _send_paginated(update: Update, _context: ContextTypes.DEFAULT_TYPE, t
                 ]
             ]
         )
-        msg = await update.message.reply_text(
+        msg = await send(
             pages[0] + f"\n\n📄 1/{len(pages)}",
             reply_markup=kb,
             parse_mode=None,
             disable_web_page_preview=True,
-            protect_content=PROTECT_CONTENT,
         )
         user_pages_state[user_id]['last_message_id'] = msg.message_id
 
 # --- Kernnachrichten-Handler (dünn, verwendet Retrieval/Indexer) ---
 
+# Antworten, die nicht wiederverwendet werden dürfen (Fehler / "nichts gefunden")
+_UNCACHEABLE_ANSWERS = ("Keine relevanten Informationen", "INFORMATION NICHT GEFUNDEN", "⏳")
+
+
+def _remember(plan: QueryPlan, answer: str, generation: int) -> None:
+    """Ablage im semantischen Antwort-Cache (nur echte Antworten)."""
+    if plan.embedding is not None and answer and not answer.startswith(_UNCACHEABLE_ANSWERS):
+        answer_cache.store(plan.text, plan.embedding, answer, lang=plan.lang, generation=generation, guard=plan.guard)
+
+
+async def _ask_and_remember(
+    plan: QueryPlan, ctx: str, chunks: List[dict], generation: int, priority: int = PRIORITY_ANSWER
+) -> str:
+    """ask_ollama + Ablage im semantischen Antwort-Cache."""
+    answer = await ask_ollama(plan, ctx, chunks, priority=priority)
+    _remember(plan, answer, generation)
+    return answer
+
+
+_STREAM_ABORTED_NOTE = "\n\n<b>⚠️ Antwort abgebrochen (LLM-Fehler) – bitte erneut fragen.</b>"
+
+
+async def _stream_answer(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, plan: QueryPlan, ctx: str, chunks: List[dict],
+    priority: int = PRIORITY_ANSWER,
+) -> Optional[str]:
+    """
+    Antwort streamen: erste Tokens sofort als Nachricht, danach höchstens alle STREAM_EDIT_INTERVAL
+    Sekunden bearbeiten (Telegram-Limit); bei Überlänge wird die jeweils letzte Seite angezeigt.
+    Am Ende die vollständig aufbereitete Antwort (Seite 1 mit Prev/Next wie _send_paginated).
+    Löscht der Nutzer die Nachricht während des Streams, wird die Generierung abgebrochen.
+    Fehler vor der ersten Nachricht werden weitergereicht (Aufrufer antwortet ohne Stream); danach
+    wird die Nachricht zur Teilantwort mit Hinweis und None zurückgegeben (nichts cachen).
+    """
+    loop = asyncio.get_running_loop()
+    renderer = StreamRenderer()
+    msg = None
+    shown = ""
+    last_edit = 0.0
+    gone = False
+    t0 = loop.time()
+    try:
+        async for piece in ask_ollama_stream(plan, ctx, chunks, cancelled=lambda: gone, priority=priority):
+            renderer.feed(piece)
+            if msg is not None and loop.time() - last_edit < STREAM_EDIT_INTERVAL:
+                continue
+            text = renderer.render()
+            if not text or text == shown:
+                continue
+            pages = _split_pages(text)
+            view = pages[-1] + (f"\n\n📄 {len(pages)}/…" if len(pages) > 1 else " …")
+            try:
+                if msg is None:
+                    msg = await update.message.reply_text(
+                        view, parse_mode=ParseMode.HTML, disable_web_page_preview=True, protect_content=PROTECT_CONTENT
+                    )
+                    ttft = loop.time() - t0
+                    stream_stats["answers"] += 1
+                    stream_stats["ttft_total"] += ttft
+                    stream_stats["ttft_max"] = max(stream_stats["ttft_max"], ttft)
+                    logger.info("stream: first visible tokens after %.0f ms", ttft * 1000.0)
+                else:
+                    await msg.edit_text(view, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+                shown = text
+            except Exception as e:
+                logger.debug("Stream edit failed: %s", e)
+                gone = msg is not None and "not found" in str(e).lower()
+            last_edit = loop.time()
+    except Exception as e:
+        if msg is None:
+            raise
+        # schon sichtbare Teilantwort: dieselbe Nachricht abschließen statt eine zweite Antwort zu erzeugen
+        logger.warning("Streaming failed after the first message (%s); keeping the partial answer", e)
+        if not gone:
+            partial = finalize_response(renderer.raw, ctx) if renderer.raw.strip() else ""
+            await _send_paginated(update, context, partial + _STREAM_ABORTED_NOTE, message=msg)
+        return None
+    answer = finalize_response(renderer.raw, ctx)
+    if gone:
+        logger.info("stream: message deleted by the user; generation cancelled")
+        return answer
+    await _send_paginated(update, context, answer, message=msg)
+    logger.info("stream: done after %.0f ms (%s chars)", (loop.time() - t0) * 1000.0, len(renderer.raw))
+    return answer
+
+
+async def _answer(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, plan: QueryPlan, ctx: str, chunks: List[dict], generation: int,
+    priority: int = PRIORITY_ANSWER,
+) -> None:
+    """LLM-Antwort erzeugen, senden und cachen – gestreamt, falls aktiviert."""
+    if STREAM_ANSWERS:
+        try:
+            answer = await _stream_answer(update, context, plan, ctx, chunks, priority)
+            if answer is not None:
+                _remember(plan, answer, generation)
+            return
+        except Exception as e:
+            # nur hier, wenn noch nichts gesendet wurde
+            logger.warning("Streaming failed (%s); falling back to a single answer", e)
+    answer = await _ask_and_remember(plan, ctx, chunks, generation, priority)
+    await _send_paginated(update, context, answer)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_question = (update.message.text or "").strip()
@@ -558,13 +748,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if _shot.get("mode") in ("awaiting_target","pick_doc") and not user_question.startswith("/screenshot"):
         SCREENSHOT_STATE.pop(user_id, None)
 
-    # Sprachrichtlinie: Standard EN; wenn die Frage wie Deutsch aussieht, antworte DE
-    t = f" {(user_question or '').casefold()} "
-    is_german = any(w in t for w in (
-        " was ", " ist ", " sind ", " sollte ", " wie ", " wann ", " warum ",
-        " worum ", " worauf ", " inwiefern ", " der ", " die ", " das ", " über ", " und "
-    )) or any(ch in user_question for ch in ("ä","ö","ü","Ä","Ö","Ü","ß"))
-    context.user_data["lang"] = "DE" if is_german else "EN"
+    # Tippfehler in Akronymen/Fachwörtern/Normnummern gegen das Korpus-Lexikon korrigieren ("TRAA" → "TARA"),
+    # bevor das Retrieval mit einem Begriff sucht, den es im Korpus nicht gibt
+    try:
+        corrected, corrections = await asyncio.to_thread(correct_query, user_question, vector_store.acronyms)
+    except Exception as e:
+        logger.debug("Spell correction error: %s", e)
+        corrected, corrections = user_question, []
+
+    # Einmal pro Frage: Normalform, Akronym, Sprache (Standard EN; deutsch aussehende Fragen → DE),
+    # Langantwort-Flag, Matcher; das Embedding wird unten einmal nachgetragen
+    # (Sprache aus der Originalfrage, die Korrektur soll sie nicht kippen)
+    plan = QueryPlan(corrected, lang=detect_language(user_question), corrections=corrections)
+    context.user_data["lang"] = plan.lang
 
     # Schneller Check: Wenn keine PDFs indexiert sind, Indexierung planen und Benutzer informieren
     pdfs = get_pdf_files()
@@ -584,20 +780,61 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Global beste Abschnitte über alle Dokumente hinweg, um Präzision und Recall zu maximieren
+    if plan.corrections:
+        logger.info("Query corrected: %s", format_corrections(plan.corrections))
+        note = "Suche mit" if plan.lang == "DE" else "Searching for"
+        with contextlib.suppress(Exception):
+            await update.message.reply_text(f"🔎 {note}: {format_corrections(plan.corrections)}")
+
+    # Fast gleiche Frage schon beantwortet (gleiche Sprache, Korpus-Generation, Akronym/Normnummern)?
+    generation = vector_store.generation
     try:
-        all_chunks = await get_best_chunks_global(user_question, max_chunks=MAX_EXCERPTS)
+        await asyncio.to_thread(plan.ensure_embedding, vector_store.embed_query)
+        cached = answer_cache.lookup(
+            plan.text, plan.embedding, lang=plan.lang, generation=generation, guard=plan.guard
+        )
     except Exception as e:
-        logger.error("Global retrieval error: %s", e)
-        all_chunks = []
+        logger.debug("Answer cache lookup error: %s", e)
+        cached = None
+    if cached:
+        await _send_paginated(update, context, cached[0])
+        return
+
+    # Eingegrenzte Frage ("Tabelle H.3", "Kapitel 15 zu TARA", "Seite 12"): nur Chunks aus diesem Bereich
+    scoped = await get_best_chunks_scoped(plan, max_chunks=MAX_EXCERPTS) if plan.scope else []
+    scoped_only = scoped_hits_sufficient(plan, scoped)
+    if scoped_only:
+        logger.info("Scoped retrieval %s: %s chunks", plan.scope, len(scoped))
+        all_chunks = scoped
+    else:
+        # Global beste Abschnitte über alle Dokumente hinweg, um Präzision und Recall zu maximieren
+        try:
+            all_chunks = await get_best_chunks_global(plan, max_chunks=MAX_EXCERPTS)
+        except Exception as e:
+            logger.error("Global retrieval error: %s", e)
+            all_chunks = []
+        if scoped:
+            # schwache bzw. akronymlose Bereichstreffer nur beimischen
+            logger.info("Scoped retrieval %s weak (%s chunks); merged with global", plan.scope, len(scoped))
+            all_chunks = select_diverse(dedup_chunks(scoped + all_chunks), MAX_EXCERPTS)
 
 
     # Fallback: wenn zu wenige globale Ergebnisse vorliegen, pro Dokument parallel abfragen
-    if not all_chunks or len(all_chunks) < max(4, MAX_EXCERPTS // 2):
+    # (Glossartreffer auf eine Definitionsfrage sind bereits die Antwort – dann keine Auffächerung)
+    from_glossary = plan.definition and bool(all_chunks) and all(c.get("glossary") for c in all_chunks)
+    if not from_glossary and not scoped_only and (not all_chunks or len(all_chunks) < max(4, MAX_EXCERPTS // 2)):
         try:
+            targets = pdfs
+            if ROUTE_TOP_K > 0 and len(pdfs) > ROUTE_TOP_K:
+                try:
+                    routed = await asyncio.to_thread(vector_store.route_documents, plan, ROUTE_TOP_K, pdfs)
+                    targets = [d for d, _ in routed] or pdfs
+                    logger.debug("Routed fan-out: %s of %s documents", len(targets), len(pdfs))
+                except Exception as e:
+                    logger.debug("Document routing error: %s", e)
             tasks = [
-                get_best_chunks_for_document(user_question, p, max_chunks=max(4, MAX_EXCERPTS // 2))
-                for p in pdfs
+                get_best_chunks_for_document(plan, p, max_chunks=max(4, MAX_EXCERPTS // 2))
+                for p in targets
             ]
             results = await asyncio.gather(*tasks, return_exceptions=True)
             combined: List[dict] = []
@@ -607,16 +844,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     continue
                 if res:
                     combined.extend(res)
-            # Duplikate entfernen + sortieren
-            seen = set()
-            uniq = []
-            for c in combined:
-                key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-                if key in seen:
-                    continue
-                seen.add(key)
-                uniq.append(c)
-            all_chunks = sorted(uniq, key=lambda c: c.get("similarity_score", 0), reverse=True)[:MAX_EXCERPTS]
+            # Duplikate entfernen + relevante, aber nicht redundante Auszüge wählen (MMR)
+            all_chunks = select_diverse(dedup_chunks(combined), MAX_EXCERPTS)
         except Exception as e:
             logger.debug("Parallel per-doc retrieval error: %s", e)
 
@@ -625,7 +854,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Versuch deterministisches 'Definition zuerst' Verhalten
-    term = detect_acronym(user_question)
+    term = plan.acronym
     if term:
         defs = find_definition_in_chunks(term, all_chunks)
         if defs:
@@ -634,13 +863,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             stop_evt = asyncio.Event()
             task = asyncio.create_task(_typing_loop(context.bot, update.effective_chat.id, stop_evt))
             try:
-                answer = await ask_ollama(
-                    user_question,
-                    combined_context,
-                    defs[:3],
-                    target_language=(context.user_data.get("lang", "DE") if hasattr(context, "user_data") else "DE"),
-                )
-                await _send_paginated(update, context, answer)
+                await _answer(update, context, plan, combined_context, defs[:3], generation, PRIORITY_DEFINITION)
             except Exception as e:
                 logger.exception("LLM paraphrase error: %s", e)
                 await update.message.reply_text("Fehler beim Generieren der Antwort.")
@@ -655,10 +878,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             stop_evt2 = asyncio.Event()
             task2 = asyncio.create_task(_typing_loop(context.bot, update.effective_chat.id, stop_evt2))
             try:
-                answer = await ask_ollama(
-                    user_question, exact, [{"text": exact}], target_language=context.user_data.get("lang", "DE")
-                )
-                await _send_paginated(update, context, answer)
+                await _answer(update, context, plan, exact, [{"text": exact}], generation, PRIORITY_DEFINITION)
             except Exception as e:
                 logger.exception("LLM paraphrase error for exact chunk: %s", e)
                 await update.message.reply_text("Fehler beim Generieren der Antwort.")
@@ -674,7 +894,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Extra guard (optional): if query contains a short acronym token not present in chunks, refuse
     if ACRONYM_STRICT:
-        short_tokens = [t.upper() for t in re.findall(r"\b[A-Za-z]{2,3}\b", user_question or "")]
+        short_tokens = [t.upper() for t in re.findall(r"\b[A-Za-z]{2,3}\b", plan.text)]
         if short_tokens:
             joined = " ".join((c.get("text") or "") for c in (all_chunks or []))
             joined_u = joined.upper()
@@ -683,8 +903,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
     # Fallback: kombinierte Auszüge vorbereiten und LLM mit strengem Prompt aufrufen
-    # Anzahl der gesendeten Auszüge begrenzen
-    final_chunks = sorted(all_chunks, key=lambda c: c.get("similarity_score", 0), reverse=True)[:MAX_EXCERPTS]
+    # Anzahl der gesendeten Auszüge begrenzen (MMR: keine fast identischen, überlappenden Auszüge)
+    final_chunks = select_diverse(all_chunks, MAX_EXCERPTS)
+    # Absatz davor/danach für die besten Treffer ergänzen (ID-Lookup statt breiterer Vektorsuche)
+    final_chunks = await expand_neighbours(final_chunks)
 
     # Hinweis statt harter Blockade: Wenn das Akronym eindeutig nicht gefunden wird, versuchen wir trotzdem, die Frage zu beantworten.
     if term and re.fullmatch(r"[A-ZÄÖÜ]{2,5}", term or ""):
@@ -692,17 +914,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not re.search(rf"(?<![A-Za-zÄÖÜäöüß]){re.escape(term)}(?![A-Za-zÄÖÜäöüß])", joined):
             # keine Unterbrechung der Antwort; das Modell kann trotzdem eine nützliche kurze Erklärung geben
             pass
-    combined = build_combined_excerpts(final_chunks)
+    # Auszüge in das Tokenbudget von OLLAMA_NUM_CTX packen (Systemprompt + num_predict reserviert)
+    budget = context_token_budget(plan)
+    if CONTEXT_COMPRESSION and plan.embedding is not None:
+        # optional: nur die zur Frage passenden Sätze behalten (Definitionen/Tabellenzeilen ganz)
+        try:
+            final_chunks, _ = await asyncio.to_thread(
+                compress_chunks, plan.embedding, final_chunks, budget, encode=vector_store.detail_encode, term=term
+            )
+        except Exception as e:
+            logger.debug("Context compression error: %s", e)
+    combined = build_combined_excerpts(final_chunks, max_tokens=budget)
     stop_evt3 = asyncio.Event()
     task3 = asyncio.create_task(_typing_loop(context.bot, update.effective_chat.id, stop_evt3))
     try:
-        answer = await ask_ollama(
-            user_question,
-            combined,
-            final_chunks,
-            target_language=(context.user_data.get("lang", "DE") if hasattr(context, "user_data") else "DE"),
-        )
-        await _send_paginated(update, context, answer)
+        await _answer(update, context, plan, combined, final_chunks, generation)
     except Exception as e:
         logger.exception("Llm call failed: %s", e)
         await update.message.reply_text("Fehler beim Generieren der Antwort.")
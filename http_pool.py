@@ -0,0 +1,162 @@
+# http_pool.py
+# Anwendungsweite aiohttp-Sessions pro LLM-Backend statt einer neuen Session (TCP/TLS-Handshake,
+# Connector-Aufbau) pro Anfrage. Jede Session hat einen eigenen Connector mit Limit, Keep-Alive
+# und DNS-Cache; bot.lifespan öffnet die Pools beim Start und schließt sie beim Herunterfahren.
+# Über aiohttp-Tracing werden Verbindungs-Wiederverwendung und Time-to-first-Byte gezählt.
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger("http_pool")
+
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "4"))
+GROQ_POOL_SIZE = int(os.getenv("GROQ_POOL_SIZE", "8"))
+# Leerlaufzeit offener Verbindungen (s) und DNS-Cache-Dauer (s)
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+
+_DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=360)
+
+
+class BackendPool:
+    """Eine ClientSession mit eigenem Connector für ein Backend (ollama, groq) plus Kennzahlen."""
+
+    def __init__(self, name: str, *, limit: int, trust_env: bool, timeout: aiohttp.ClientTimeout = _DEFAULT_TIMEOUT) -> None:
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.trust_env = trust_env
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.ttfb_count = 0
+        self.ttfb_total = 0.0
+        self.ttfb_max = 0.0
+        self.ttfb_last = 0.0
+        self._trace = self._trace_config()
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(_session, ctx, _params):
+            ctx.start = asyncio.get_running_loop().time()
+            self.requests += 1
+
+        async def on_request_end(_session, ctx, _params):
+            # feuert nach Eingang der Antwort-Header, vor dem Body → Time-to-first-Byte
+            start = getattr(ctx, "start", None)
+            if start is None:
+                return
+            ttfb = asyncio.get_running_loop().time() - start
+            self.ttfb_count += 1
+            self.ttfb_total += ttfb
+            self.ttfb_last = ttfb
+            self.ttfb_max = max(self.ttfb_max, ttfb)
+
+        async def on_connection_create_end(_session, _ctx, _params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(_session, _ctx, _params):
+            self.connections_reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Gemeinsame Session; wird bei Bedarf (erster Aufruf, nach close(), anderer Event-Loop
+        z. B. in Skripten mit asyncio.run) neu angelegt.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                logger.debug("%s pool bound to another event loop; opening a new session", self.name)
+                self._discard_stale()
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit,
+                ttl_dns_cache=HTTP_DNS_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trust_env=self.trust_env,
+                trace_configs=[self._trace],
+            )
+            self._loop = loop
+        return self._session
+
+    def _discard_stale(self) -> None:
+        """Session eines anderen (meist schon beendeten) Event-Loops schließen, ohne dort zu awaiten."""
+        session, old_loop = self._session, self._loop
+        self._session = None
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            # Loop läuft noch (anderer Thread): regulär dort schließen
+            old_loop.call_soon_threadsafe(lambda: old_loop.create_task(session.close()))
+            return
+        connector = session.connector
+        session.detach()
+        if connector is not None:
+            try:
+                connector._close()  # synchron; close() liefert nur ein Awaitable für Abwärtskompatibilität
+            except Exception as e:
+                logger.debug("Closing stale %s connector failed: %s", self.name, e)
+
+    async def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+
+    def stats(self) -> Dict:
+        conns = self.connections_created + self.connections_reused
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "open": self._session is not None and not self._session.closed,
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_rate": (self.connections_reused / conns) if conns else 0.0,
+            "ttfb_avg_ms": (self.ttfb_total / self.ttfb_count * 1000.0) if self.ttfb_count else 0.0,
+            "ttfb_max_ms": self.ttfb_max * 1000.0,
+            "ttfb_last_ms": self.ttfb_last * 1000.0,
+        }
+
+
+# Ollama läuft lokal/im Docker-Netz (kein Proxy), Groq über das Internet (Proxy-Variablen beachten)
+pools: Dict[str, BackendPool] = {
+    "ollama": BackendPool("ollama", limit=OLLAMA_POOL_SIZE, trust_env=False),
+    "groq": BackendPool("groq", limit=GROQ_POOL_SIZE, trust_env=True),
+}
+
+
+def get_session(backend: str) -> aiohttp.ClientSession:
+    return pools[backend].session()
+
+
+async def start(backends=None) -> None:
+    """Sessions für die genannten (Standard: alle) Backends öffnen – im laufenden Event-Loop der App."""
+    for name in backends or pools:
+        pools[name].session()
+    logger.info("HTTP pools ready: %s", ", ".join(f"{p.name}(limit={p.limit})" for p in pools.values()))
+
+
+async def close() -> None:
+    for pool in pools.values():
+        try:
+            await pool.close()
+        except Exception as e:
+            logger.debug("Closing %s pool failed: %s", pool.name, e)
+
+
+def pool_stats() -> Dict[str, Dict]:
+    return {name: pool.stats() for name, pool in pools.items()}
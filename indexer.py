@@ -104,10 +104,19 @@ async def ensure_document_indexed(document_name: str):
             # If already indexed with same version, skip
             if existing_version == current_version and await asyncio.to_thread(vector_store.has_document, document_name):
                 logger.info("Document already indexed (same version): %s", document_name)
+                # Glossar nachziehen, falls der Index noch aus einer älteren Version stammt
+                if not vector_store.has_glossary(document_name):
+                    await asyncio.to_thread(vector_store.index_glossary, document_name)
+                if not vector_store.has_routing(document_name):
+                    await asyncio.to_thread(vector_store.index_routing, document_name)
+                if not vector_store.has_scopes(document_name):
+                    await asyncio.to_thread(vector_store.index_scopes, document_name)
                 return
 
             logger.info("Indexing document: %s", document_name)
-            paragraphs = await pdf_parser.extract_paragraphs_from_pdf(document_name)
+            # Absätze mit Seite/Abschnitt/Tabelle/Inhaltstyp (landen als Chunk-Metadaten im Index)
+            records = await pdf_parser.extract_paragraph_records(document_name)
+            paragraphs = [r["text"] for r in records]
             if not paragraphs:
                 logger.warning("No paragraphs extracted for %s", document_name)
                 return
@@ -130,9 +139,22 @@ async def ensure_document_indexed(document_name: str):
                 document_name,
                 paragraphs,
                 {"source": document_name, "type": "pdf", "doc_version": current_version},
+                records,
             )
             if success:
                 logger.info("Indexed %s: %d paragraphs", document_name, len(paragraphs))
+                try:
+                    await asyncio.to_thread(vector_store.index_glossary, document_name)
+                except Exception as e:
+                    logger.warning("Glossary indexing failed for %s: %s", document_name, e)
+                try:
+                    await asyncio.to_thread(vector_store.index_routing, document_name)
+                except Exception as e:
+                    logger.warning("Routing index failed for %s: %s", document_name, e)
+                try:
+                    await asyncio.to_thread(vector_store.index_scopes, document_name)
+                except Exception as e:
+                    logger.warning("Scope index failed for %s: %s", document_name, e)
             else:
                 logger.error("Indexing reported failure for %s", document_name)
         except Exception as e:
@@ -1,13 +1,25 @@
 # llm_client.py
+import asyncio
 import aiohttp
 import re
 import os
 import logging
 import html 
-import json
-from typing import Dict, List, Tuple
+from contextlib import aclosing, suppress
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
+import http_pool
+from circuit_breaker import CircuitBreaker
+from llm_router import Endpoint, LLMRouter, parse_endpoints
+from llm_scheduler import PRIORITY_ANSWER, SchedulerBusy, llm_scheduler
+from model_tiers import TierChoice, TierSelector, parse_tiers
+from ndjson_stream import EarlyStop, StreamStats, answer_complete, iter_ollama_stream
+from query_plan import QueryPlan, wants_long_answer
+from response_cache import LLMResponseCache, fingerprint
+from singleflight import SingleFlight
+from token_budget import token_counter
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -18,11 +30,22 @@ LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama").lower()
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "tinyllama")
 OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "0") == "1"
+# Streams vorzeitig beenden (Verbindung schließen → Ollama stoppt): ab so vielen Zeichen (0 = aus)
+# bzw. sobald die Antwort vollständig erscheint (Meta-Nachsatz, wiederholter Absatz)
+STREAM_MAX_CHARS = int(os.getenv("STREAM_MAX_CHARS", "0"))
+STREAM_STOP_ON_COMPLETE = os.getenv("STREAM_STOP_ON_COMPLETE", "1") == "1"
 OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "1024"))
+# Kontextfenster für Groq (nur für das Packen der Auszüge)
+GROQ_NUM_CTX = int(os.getenv("GROQ_NUM_CTX", "8192"))
+# Tokens für Chat-Template/Rollenmarker, die nicht im Prompttext stehen
+PROMPT_TEMPLATE_TOKENS = int(os.getenv("PROMPT_TEMPLATE_TOKENS", "48"))
+# Untergrenze für das Auszugsbudget (lieber kurze Antwort als gar kein Kontext)
+MIN_CONTEXT_TOKENS = int(os.getenv("MIN_CONTEXT_TOKENS", "128"))
 
 # Groq (OpenAI-compatible) settings
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
 
 _ALLOWED_LOCAL_OLLAMA_HOSTS = {
     "localhost",
@@ -32,24 +55,123 @@ _ALLOWED_LOCAL_OLLAMA_HOSTS = {
 
 _ALLOW_REMOTE_OLLAMA = os.getenv("ALLOW_REMOTE_OLLAMA", "0") == "1"
 
-if LLM_BACKEND == "ollama":
-    _parsed_ollama = urlparse(OLLAMA_URL)
-    if _parsed_ollama.scheme not in ("http", "https") or not _parsed_ollama.hostname:
-        raise ValueError(f"Unsupported OLLAMA_URL={OLLAMA_URL!r}. Please use http/https with a valid hostname.")
-    if not _ALLOW_REMOTE_OLLAMA and _parsed_ollama.hostname not in _ALLOWED_LOCAL_OLLAMA_HOSTS:
+def _check_ollama_url(url: str) -> None:
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"Unsupported OLLAMA_URL={url!r}. Please use http/https with a valid hostname.")
+    if not _ALLOW_REMOTE_OLLAMA and parsed.hostname not in _ALLOWED_LOCAL_OLLAMA_HOSTS:
         raise ValueError(
-            f"Unsupported OLLAMA_URL host={_parsed_ollama.hostname!r}. Set ALLOW_REMOTE_OLLAMA=1 to allow remote hosts."
+            f"Unsupported OLLAMA_URL host={parsed.hostname!r}. Set ALLOW_REMOTE_OLLAMA=1 to allow remote hosts."
         )
 
+
+if LLM_BACKEND == "ollama":
+    _check_ollama_url(OLLAMA_URL)
+
+# Mehrere Endpunkte (leer = nur LLM_BACKEND): "kind|url|model|weight, ..." (siehe llm_router.parse_endpoints);
+# LLM_HEDGE_DELAY > 0: nach so vielen Sekunden ohne Antwort zusätzlich den nächsten Endpunkt fragen
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+_endpoints = parse_endpoints(LLM_ENDPOINTS) or [Endpoint(LLM_BACKEND, LLM_BACKEND)]
+for _ep in _endpoints:
+    if _ep.kind == "ollama" and _ep.url:
+        _check_ollama_url(_ep.url)
+
+# Modellstufen für Ollama, größte zuerst (leer = immer OLLAMA_MODEL): "model|num_predict, ..." (siehe model_tiers)
+LLM_MODEL_TIERS = os.getenv("LLM_MODEL_TIERS", "")
+_tiers = parse_tiers(LLM_MODEL_TIERS)
+tier_selector: Optional[TierSelector] = TierSelector(_tiers) if _tiers else None
+
 TEMPERATURE = 0.1
 TOP_P = 0.4
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "512"))
 TOP_K = 20
 REPEAT_PENALTY = 1.1
 
-TIMEOUT = aiohttp.ClientTimeout(total=360)
+# Getrennte Timeouts (s): TCP-Verbindungsaufbau, erstes Byte bzw. längste Pause zwischen zwei
+# Lesevorgängen (nicht gestreamt: Dauer der Generierung), gesamte Anfrage
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_FIRST_BYTE_TIMEOUT = float(os.getenv("LLM_FIRST_BYTE_TIMEOUT", "240"))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "360"))
+TIMEOUT = aiohttp.ClientTimeout(
+    total=LLM_TOTAL_TIMEOUT, sock_connect=LLM_CONNECT_TIMEOUT, sock_read=LLM_FIRST_BYTE_TIMEOUT
+)
+
+
+class LLMHTTPError(RuntimeError):
+    """Nicht-200-Antwort eines LLM-Endpunkts (status: HTTP-Status)."""
+
+    def __init__(self, message: str, status: int) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class OllamaCapabilities:
+    """Was Server und Modell unterstützen: endpoint "chat" | "generate", num_predict als Option ja/nein."""
+
+    __slots__ = ("url", "model", "endpoint", "num_predict", "version")
+
+    def __init__(self, url: str, model: str, endpoint: str, num_predict: bool, version: str = "") -> None:
+        self.url = url
+        self.model = model
+        self.endpoint = endpoint
+        self.num_predict = num_predict
+        self.version = version
+
+    def key(self) -> Tuple:
+        return (self.endpoint, self.num_predict)
+
+    def __repr__(self) -> str:
+        return f"OllamaCapabilities({self.endpoint}, num_predict={self.num_predict}, version={self.version or '?'})"
+
+
+# /api/chat gibt es ab Ollama 0.1.14
+_CHAT_MIN_VERSION = (0, 1, 14)
+_capabilities: Dict[Tuple[str, str], OllamaCapabilities] = {}  # (url, model) → Fähigkeiten
+
 DEBUG_PROMPTS = os.getenv("DEBUG_PROMPTS", "0") == "1"
 
+# Persistenter Cache der rohen Modellausgaben (Schlüssel: Backend, Modell, Optionen, Prompts)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or os.path.join(
+    os.getenv("CHROMA_DB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db")),
+    "llm_cache.sqlite3",
+)
+response_cache = LLMResponseCache(
+    LLM_CACHE_PATH,
+    ttl=float(os.getenv("LLM_CACHE_TTL", "604800")),
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "2000")),
+    max_mb=float(os.getenv("LLM_CACHE_MB", "64")),
+    models={
+        "ollama": [OLLAMA_MODEL] + [t.model for t in _tiers] + [ep.model for ep in _endpoints if ep.kind == "ollama" and ep.model],
+        "groq": [GROQ_MODEL] + [ep.model for ep in _endpoints if ep.kind == "groq" and ep.model],
+    },
+)
+# Gleichzeitige identische Anfragen (gleicher Cache-Schlüssel) teilen sich eine Generierung
+llm_flights = SingleFlight("llm")
+
+# Fähigkeiten-Test: gleichzeitige erste Anfragen warten auf denselben Test
+_probe_flight = SingleFlight("capabilities")
+
+# Schutzschalter pro Endpunkt; Ollama wird im halboffenen Zustand über /api/tags geprüft
+breakers: Dict[str, CircuitBreaker] = {
+    "ollama": CircuitBreaker("ollama", probe=lambda: test_ollama_connection()),
+    "groq": CircuitBreaker("groq"),
+}
+
+
+def _breaker_for(ep: Endpoint) -> CircuitBreaker:
+    breaker = breakers.get(ep.name)
+    if breaker is None:
+        probe = (lambda: test_ollama_connection(ep.url or None)) if ep.kind == "ollama" else None
+        breaker = breakers[ep.name] = CircuitBreaker(ep.name, probe=probe)
+    return breaker
+
+
+llm_router = LLMRouter(_endpoints, breaker_for=_breaker_for, hedge_delay=LLM_HEDGE_DELAY, hedge_slots=llm_scheduler)
+
+# Schnelle Antwort bei Lastabwurf durch llm_scheduler (wird nicht gecacht)
+BUSY_MESSAGE = "⏳ Der Server ist gerade ausgelastet – bitte in einer Minute erneut fragen. / Server busy, please retry shortly."
+
 def _is_truncated(text: str) -> bool:
     """A crude response break detector (HTML/Markdown features)."""
     if not text:
@@ -67,66 +189,461 @@ def _is_truncated(text: str) -> bool:
         return True
     return False
 
-def _wants_long_answer(q: str) -> bool:
-    if not q:
+# Langantwort-Heuristik liegt in query_plan (einmal pro Frage im QueryPlan berechnet)
+_wants_long_answer = wants_long_answer
+
+def _prepare_prompts(question: str | QueryPlan, context: str, chunks_info: List[Dict] | None, target_language: str | None):
+    """Prompts wie für ask_ollama: (system, user, want_long, geschätzte Prompt-Tokens, ggf. gekürzter Kontext)."""
+    plan = question if isinstance(question, QueryPlan) else None
+    if plan is not None:
+        question = plan.text
+        target_language = target_language or plan.lang
+    want_long = plan.want_long if plan is not None else _wants_long_answer(question)
+    budget = context_token_budget(plan or question, target_language)
+    if _estimate_tokens(context) > budget:
+        # Aufrufer ohne Packer (Definitionen/Zitat): sonst schneidet Ollama stillschweigend ab
+        context = token_counter.truncate(context, budget)
+    system_prompt, user_prompt = _create_prompts(question, context, chunks_info, target_language)
+    est_prompt = _estimate_tokens(system_prompt) + _estimate_tokens(user_prompt) + PROMPT_TEMPLATE_TOKENS
+    return system_prompt, user_prompt, want_long, est_prompt, context
+
+
+def _select_tier(want_long: bool) -> TierChoice:
+    """Modellstufe nach Last (Warteschlange, zuletzt gemessene Tokens/s) und Antwortlänge; Groq: fest."""
+    if tier_selector is None or LLM_BACKEND == "groq":
+        return TierChoice("", _num_predict(want_long))
+    return tier_selector.select(want_long, llm_scheduler.depth(), _num_predict(want_long))
+
+
+def _cache_key(system_prompt: str, user_prompt: str, want_long: bool) -> str:
+    """
+    Schlüssel für response_cache und llm_flights: Prompts plus Antwortlänge, ohne Modell und Stufe –
+    eine gecachte Antwort gilt für alle Modellstufen, gleiche Fragen teilen sich eine Generierung.
+    """
+    return fingerprint(system_prompt, user_prompt, {"temperature": 0.1, "want_long": want_long, "num_ctx": OLLAMA_NUM_CTX})
+
+
+def _tier_degraded(tier: TierChoice, want_long: bool) -> bool:
+    """
+    Unter Last gewählte kleinere Stufe oder gekürztes num_predict: solche Antworten nicht cachen,
+    sonst bekäme die nächste Anfrage im Leerlauf die schwächere Antwort für die ganze TTL.
+    """
+    if tier_selector is None or not tier.model:
         return False
-    ql = q.casefold()
-    long_keys = (
-        "ausführlich","ausfuehrlich","erklaere","erkläre","erläutere",
-        "liste","schritte","begruendung","begründung","beispiele",
-        "detailliert","worum geht es","worum geht es in","worum handelt es sich",
-        "was ist","was bedeutet","beschreibe","beschreibung",
-        "explain","detailed","steps","list","why","how",
-        "what is","what's","whats","what does","overview","overview of","describe","description"
-    )
-    if len(q) > 100:
-        return True
-    if any(k in ql for k in long_keys):
-        return True
-    if re.search(r'\b(ISO|SAE|UNR|standard|norm)\s*[\d/\-]+', q, re.IGNORECASE):
-        return True
-    return False
+    top = tier_selector.tiers[0]
+    default = _num_predict(want_long)
+    return tier.model != top.model or tier.num_predict < min(default, top.num_predict or default)
+
+
+def _cache_origin(tier: TierChoice, usage: Dict) -> Tuple[str, str]:
+    """
+    (Backend, Modell) des Endpunkts, der die Antwort tatsächlich erzeugt hat – nach Failover oder
+    Hedging nicht unbedingt LLM_BACKEND (für die Modellwechsel-Bereinigung im Cache).
+    """
+    backend = usage.get("backend") or LLM_BACKEND
+    if usage.get("model"):
+        return backend, usage["model"]
+    return backend, GROQ_MODEL if backend == "groq" else tier.model or OLLAMA_MODEL
+
 
-async def ask_ollama(question: str, context: str, chunks_info: List[Dict] | None = None, target_language: str | None = None) -> str:
+def finalize_response(response: str, context: str) -> str:
+    """Rohe Modellausgabe → Telegram-HTML (gemeinsam für ask_ollama und den Streaming-Pfad)."""
+    response = _strip_noinfo_sections(response)
+
+    if response:
+        _ood = ("wordpress", "instagram", "facebook", "tiktok", "twitter", "github", "stackoverflow")
+        low_resp = response.lower()
+        low_ctx = (context or "").lower()
+        if any(tok in low_resp for tok in _ood) and not any(tok in low_ctx for tok in _ood):
+            return "Keine relevanten Informationen im Kontext."
+
+    if _is_truncated(response):
+        is_german = any(word in (response or "").lower() for word in ['die', 'der', 'das', 'und', 'ist', 'werden'])
+        warning = "\n\n<i>Hinweis: Antwort möglicherweise unvollständig.</i>" if is_german else "\n\n<i>Note: Answer might be incomplete.</i>"
+        response = (response or "").rstrip() + warning
+
+    response = normalize_to_html(response)
+    response = _sanitize_for_telegram(response)
+    return _normalize_response(response)
+
+
+async def ask_ollama(
+    question: str | QueryPlan,
+    context: str,
+    chunks_info: List[Dict] | None = None,
+    target_language: str | None = None,
+    *,
+    priority: int = PRIORITY_ANSWER,
+) -> str:
+    """
+    question: Rohtext oder QueryPlan (dann werden Langantwort-Flag und Sprache aus dem Plan übernommen).
+    priority: Rang in der Warteschlange von llm_scheduler; bei Überlast kommt BUSY_MESSAGE zurück.
+    """
     try:
-        system_prompt, user_prompt = _create_prompts(question, context, chunks_info, target_language)
-        want_long = _wants_long_answer(question)
+        system_prompt, user_prompt, want_long, est_prompt, context = _prepare_prompts(
+            question, context, chunks_info, target_language
+        )
+        key = _cache_key(system_prompt, user_prompt, want_long)
+        cached = await asyncio.to_thread(response_cache.get, key)
+        if cached is not None:
+            logger.info("LLM cache hit (%s)", cached[1].get("model", "?"))
+            return finalize_response(cached[0], context)
 
+        response = await llm_flights.do(
+            key, lambda: _generate(system_prompt, user_prompt, want_long, est_prompt, key, priority)
+        )
+        return finalize_response(response, context)
+
+    except SchedulerBusy as e:
+        logger.warning("LLM request shed: %s", e)
+        return BUSY_MESSAGE
+    except Exception as e:
+        logger.error(f"Ollama-Fehler: {e}")
+        return "INFORMATION NICHT GEFUNDEN - LLM nicht erreichbar."
+
+
+async def _generate(
+    system_prompt: str, user_prompt: str, want_long: bool, est_prompt: int, key: str, priority: int = PRIORITY_ANSWER,
+) -> str:
+    """
+    Eine (geteilte) Generierung über llm_router (Endpunktwahl, Failover, Hedging); Rohausgabe in den Cache.
+    Die Modellstufe wird erst hier, nach dem Cache-Fehlschlag, gewählt.
+    Alle Schutzschalter offen → CircuitOpen sofort, ohne Warteschlange und Netzwerkzugriff.
+    """
+    llm_router.check()
+    tier = _select_tier(want_long)
+
+    async def attempt(ep: Endpoint) -> Tuple[str, Dict]:
+        # eigenes usage je Versuch: bei Hedging laufen zwei Versuche gleichzeitig, nur der Gewinner zählt
+        attempt_usage: Dict = {}
+        text = await _call_endpoint(ep, system_prompt, user_prompt, want_long, attempt_usage, tier)
+        return text, attempt_usage
+
+    async with llm_scheduler.slot(priority):
+        response, usage = await llm_router.call(attempt)
+
+    backend, model = _cache_origin(tier, usage)
+    _report_prompt_tokens(system_prompt, user_prompt, est_prompt, backend, tier, usage)
+    _report_tier(tier, usage)
+    if _tier_degraded(tier, want_long):
+        logger.debug("not caching answer of degraded tier %s", tier)
+    elif usage.get("stopped") not in ("cancelled", "max_chars"):
+        # /api/generate mit OLLAMA_STREAM kappt ebenfalls bei STREAM_MAX_CHARS → nicht für die TTL wiederholen
+        await asyncio.to_thread(response_cache.put, key, backend, model, response, usage)
+    return response
+
+
+async def ask_ollama_stream(
+    question: str | QueryPlan,
+    context: str,
+    chunks_info: List[Dict] | None = None,
+    target_language: str | None = None,
+    *,
+    cancelled: Optional[Callable[[], bool]] = None,
+    priority: int = PRIORITY_ANSWER,
+) -> AsyncIterator[str]:
+    """
+    Wie ask_ollama, liefert aber die rohen Textstücke, sobald Ollama sie erzeugt (/api/chat, stream=True).
+    Die Aufbereitung übernimmt der Aufrufer (StreamRenderer während, finalize_response nach dem Stream).
+    Groq bzw. ein Fehler vor dem ersten Token: eine einzige, nicht gestreamte Antwort.
+    Gleichzeitige identische Anfragen lesen denselben Stream mit. cancelled(): True → nicht weiter
+    lesen; die Generierung wird abgebrochen, sobald kein anderer Leser mehr daran hängt.
+    Lastabwurf durch llm_scheduler vor dem ersten Stück: BUSY_MESSAGE als einziges Stück.
+    """
+    system_prompt, user_prompt, want_long, est_prompt, context = _prepare_prompts(
+        question, context, chunks_info, target_language
+    )
+    key = _cache_key(system_prompt, user_prompt, want_long)
+    cached = await asyncio.to_thread(response_cache.get, key)
+    if cached is not None:
+        logger.info("LLM cache hit (%s)", cached[1].get("model", "?"))
+        yield cached[0]
+        return
+    shared = llm_flights.stream(
+        key, lambda: _generate_stream(system_prompt, user_prompt, want_long, est_prompt, key, priority)
+    )
+    emitted = False
+    async with aclosing(shared):
         try:
-            if LLM_BACKEND == "groq":
-                response = await _call_groq_chat(system_prompt, user_prompt, want_long=want_long)
-            else:
-                response = await _call_ollama_chat(system_prompt, user_prompt, want_long=want_long)
-        except Exception as chat_err:
-            if LLM_BACKEND == "groq":
+            async for piece in shared:
+                emitted = True
+                yield piece
+                if cancelled is not None and cancelled():
+                    logger.info("stream: client cancelled")
+                    break
+        except SchedulerBusy as e:
+            if emitted:
                 raise
-            logger.debug("chat API failed: %s; fallback to generate", chat_err)
-            response = await _call_ollama_api(system_prompt, user_prompt, want_long=want_long)
+            logger.warning("LLM request shed: %s", e)
+            yield BUSY_MESSAGE
+
+
+async def _generate_stream(
+    system_prompt: str, user_prompt: str, want_long: bool, est_prompt: int, key: str, priority: int = PRIORITY_ANSWER,
+) -> AsyncIterator[str]:
+    """Eine (geteilte) gestreamte Generierung; Modellstufe nach dem Cache-Fehlschlag, vollständige Rohausgabe in den Cache."""
+    attempts: List[Dict] = []
+    parts: List[str] = []
+    llm_router.check()
+    tier = _select_tier(want_long)
+
+    def attempt(ep: Endpoint) -> AsyncIterator[str]:
+        # eigenes usage je Versuch (Failover vor dem ersten Stück); der letzte Versuch hat geliefert
+        attempts.append({})
+        return _stream_endpoint(ep, system_prompt, user_prompt, want_long, attempts[-1], tier)
 
-        response = _strip_noinfo_sections(response)
+    async with llm_scheduler.slot(priority):
+        async for piece in llm_router.stream(attempt):
+            parts.append(piece)
+            yield piece
+    usage = attempts[-1] if attempts else {}
+    backend, model = _cache_origin(tier, usage)
+    _report_prompt_tokens(system_prompt, user_prompt, est_prompt, backend, tier, usage)
+    _report_tier(tier, usage)
+    if _tier_degraded(tier, want_long):
+        logger.debug("not caching answer of degraded tier %s", tier)
+    elif usage.get("stopped") not in ("cancelled", "max_chars"):
+        # abgebrochene oder bei STREAM_MAX_CHARS gekappte Antworten nicht für die TTL wiederholen
+        await asyncio.to_thread(response_cache.put, key, backend, model, "".join(parts), usage)
 
-        if response:
-            _ood = ("wordpress", "instagram", "facebook", "tiktok", "twitter", "github", "stackoverflow")
-            low_resp = response.lower()
-            low_ctx = (context or "").lower()
-            if any(tok in low_resp for tok in _ood) and not any(tok in low_ctx for tok in _ood):
-                return "Keine relevanten Informationen im Kontext."
 
-        if _is_truncated(response):
-            is_german = any(word in (response or "").lower() for word in ['die', 'der', 'das', 'und', 'ist', 'werden'])
-            warning = "\n\n<i>Hinweis: Antwort möglicherweise unvollständig.</i>" if is_german else "\n\n<i>Note: Answer might be incomplete.</i>"
-            response = (response or "").rstrip() + warning
+async def _stream_endpoint(
+    ep: Endpoint, system_prompt: str, user_prompt: str, want_long: bool, usage: Dict, tier: TierChoice
+) -> AsyncIterator[str]:
+    """Textstücke von einem Endpunkt: Ollama-Chat gestreamt, sonst (Groq, nur /api/generate) eine Antwort."""
+    usage["backend"] = ep.kind
+    if ep.kind == "groq":
+        yield await _call_endpoint(ep, system_prompt, user_prompt, want_long, usage, tier)
+        return
+    url, model = ep.url or OLLAMA_URL, ep.model or tier.model or OLLAMA_MODEL
+    if (await get_capabilities(url, model)).endpoint == "generate":
+        yield await _call_endpoint(ep, system_prompt, user_prompt, want_long, usage, tier)
+        return
+    usage["model"] = model
+    emitted = False
+    try:
+        async for piece in _stream_ollama_chat(
+            system_prompt, user_prompt, want_long=want_long, usage=usage, url=url, model=model, limit=tier.num_predict
+        ):
+            emitted = True
+            yield piece
+    except LLMHTTPError as chat_err:
+        if emitted or not await _refresh_after_error(chat_err, url, model):
+            raise
+        yield await _call_endpoint(ep, system_prompt, user_prompt, want_long, usage, tier)
+
+
+async def _call_endpoint(
+    ep: Endpoint, system_prompt: str, user_prompt: str, want_long: bool, usage: Dict, tier: TierChoice
+) -> str:
+    """
+    Genau eine Anfrage an den laut Fähigkeiten-Test passenden Endpunkt. Lehnt der Server sie ab
+    (4xx, z. B. nach einem Update oder Modellwechsel), wird neu getestet und – falls sich etwas
+    geändert hat – einmal mit den neuen Fähigkeiten wiederholt. Modellstufen gelten nur für Ollama
+    und nur für Endpunkte ohne eigenes Modell.
+    """
+    usage["backend"] = ep.kind
+    if ep.kind == "groq":
+        usage["model"] = ep.model or GROQ_MODEL
+        return await _call_groq_chat(
+            system_prompt, user_prompt, want_long=want_long, usage=usage, url=ep.url or GROQ_URL, model=usage["model"]
+        )
+    url, model = ep.url or OLLAMA_URL, ep.model or tier.model or OLLAMA_MODEL
+    usage["model"] = model
+    caps = await get_capabilities(url, model)
+    try:
+        return await _call_ollama(caps, system_prompt, user_prompt, want_long, usage, tier.num_predict)
+    except LLMHTTPError as e:
+        if not await _refresh_after_error(e, url, model):
+            raise
+        return await _call_ollama(
+            await get_capabilities(url, model), system_prompt, user_prompt, want_long, usage, tier.num_predict
+        )
+
+
+async def _call_ollama(
+    caps: OllamaCapabilities, system_prompt: str, user_prompt: str, want_long: bool, usage: Dict, limit: int = 0
+) -> str:
+    if caps.endpoint == "chat":
+        return await _call_ollama_chat(
+            system_prompt, user_prompt, want_long=want_long, usage=usage, num_predict=caps.num_predict,
+            url=caps.url, model=caps.model, limit=limit,
+        )
+    return await _call_ollama_api(
+        system_prompt, user_prompt, want_long=want_long, usage=usage, num_predict=caps.num_predict,
+        url=caps.url, model=caps.model, limit=limit,
+    )
+
+
+def _parse_version(text: str) -> Tuple[int, ...]:
+    m = re.match(r"(\d+)\.(\d+)\.(\d+)", text or "")
+    return tuple(int(x) for x in m.groups()) if m else ()
+
+
+async def probe_capabilities(url: str | None = None, model: str | None = None) -> OllamaCapabilities:
+    """
+    Endpunkt und Optionen für url/model (Standard: OLLAMA_URL/OLLAMA_MODEL) ermitteln: /api/version (ab 0.1.14 → Chat);
+    ohne Versionsangabe (ältere Builds, kompatible Server) je eine Anfrage mit num_predict=1 an
+    /api/chat bzw. /api/generate, zuletzt /api/generate ohne num_predict. Verbindungsfehler werden
+    weitergereicht (Schutzschalter), das Ergebnis bis zum nächsten Fehler zwischengespeichert.
+    """
+    url, model = url or OLLAMA_URL, model or OLLAMA_MODEL
+    session = http_pool.get_session("ollama")
+    probe_timeout = aiohttp.ClientTimeout(total=LLM_TOTAL_TIMEOUT, sock_connect=LLM_CONNECT_TIMEOUT)
+    version = ""
+    async with session.get(f"{url}/api/version", timeout=probe_timeout) as resp:
+        if resp.status == 200:
+            with suppress(Exception):
+                version = str((await resp.json(content_type=None)).get("version") or "")
+        else:
+            await resp.read()
+    parsed = _parse_version(version)
+    caps = None
+    if parsed and parsed >= _CHAT_MIN_VERSION:
+        caps = OllamaCapabilities(url, model, "chat", True, version)
+    else:
+        attempts = (
+            ("chat", True, "/api/chat", {"messages": [{"role": "user", "content": "ok"}]}),
+            ("generate", True, "/api/generate", {"prompt": "ok"}),
+            ("generate", False, "/api/generate", {"prompt": "ok"}),
+        )
+        for endpoint, with_num_predict, path, body in attempts:
+            payload = {"model": model, "stream": False, **body}
+            payload["options"] = {"num_predict": 1} if with_num_predict else {}
+            async with session.post(f"{url}{path}", json=payload, timeout=probe_timeout) as resp:
+                await resp.read()
+                if resp.status == 200:
+                    caps = OllamaCapabilities(url, model, endpoint, with_num_predict, version)
+                    break
+        if caps is None:
+            raise LLMHTTPError(f"Ollama at {url} accepts neither /api/chat nor /api/generate for {model}", 404)
+    _capabilities[(url, model)] = caps
+    logger.info("Ollama capabilities for %s at %s: %s", model, url, caps)
+    return caps
 
-        response = normalize_to_html(response)
-        response = _sanitize_for_telegram(response)
-        return _normalize_response(response)
 
+async def get_capabilities(url: str | None = None, model: str | None = None) -> OllamaCapabilities:
+    url, model = url or OLLAMA_URL, model or OLLAMA_MODEL
+    caps = _capabilities.get((url, model))
+    if caps is not None:
+        return caps
+    return await _probe_flight.do(f"{url}|{model}", lambda: probe_capabilities(url, model))
+
+
+async def _refresh_after_error(err: LLMHTTPError, url: str, model: str) -> bool:
+    """Nach einer 4xx-Antwort neu testen; True, wenn sich Endpunkt/Optionen geändert haben."""
+    if not 400 <= err.status < 500:
+        return False
+    old = _capabilities.pop((url, model), None)
+    logger.warning("Ollama rejected the request (%s); re-probing capabilities", err)
+    try:
+        new = await get_capabilities(url, model)
     except Exception as e:
-        logger.error(f"Ollama-Fehler: {e}")
-        return "INFORMATION NICHT GEFUNDEN - LLM nicht erreichbar."
+        logger.debug("capability re-probe failed: %s", e)
+        if old is not None:
+            _capabilities[(url, model)] = old
+        return False
+    return old is None or new.key() != old.key()
+
+
+def _num_predict(want_long: bool) -> int:
+    return min(MAX_TOKENS, 512 if want_long else 256)
 
-def _estimate_tokens(_prompt: str, *, want_long: bool = False) -> int:
-    return 512 if want_long else 256
+def _estimate_tokens(text: str) -> int:
+    return token_counter.count(text)
+
+def context_token_budget(question: str | QueryPlan, target_language: str | None = None) -> int:
+    """
+    Tokens, die für die EXCERPTS bleiben: Kontextfenster minus System-/Nutzerprompt (ohne Auszüge),
+    Template-Overhead und num_predict; 5 % Reserve, solange nur geschätzt wird.
+    """
+    if isinstance(question, QueryPlan):
+        want_long, target_language, question = question.want_long, target_language or question.lang, question.text
+    else:
+        want_long = _wants_long_answer(question)
+    num_ctx = GROQ_NUM_CTX if LLM_BACKEND == "groq" else OLLAMA_NUM_CTX
+    system, user = _create_prompts(question, "", None, target_language)
+    reserved = (
+        _estimate_tokens(system) + _estimate_tokens(user) + PROMPT_TEMPLATE_TOKENS
+        + _num_predict(want_long)
+    )
+    budget = num_ctx - reserved
+    if not token_counter.exact:
+        budget = int(budget * 0.95)
+    return max(MIN_CONTEXT_TOKENS, budget)
+
+def _plausible_prompt_count(actual: int, estimated: int, num_ctx: int) -> bool:
+    """
+    prompt_eval_count zählt nur die nicht aus dem KV-Cache wiederverwendeten Tokens (der Systemprompt
+    ist bei jeder Frage gleich) und ist bei abgeschnittenen Prompts auf num_ctx gedeckelt – solche
+    Werte würden die Schätzung nach unten ziehen und das Kontextfenster überfüllen.
+    """
+    return 0.5 * estimated <= actual <= 2.0 * estimated and actual < num_ctx
+
+def _report_prompt_tokens(
+    system_prompt: str, user_prompt: str, estimated: int, backend: str, tier: TierChoice, usage: Dict
+) -> None:
+    """
+    backend: Backend des Endpunkts, der geantwortet hat (nach Failover/Hedging nicht unbedingt
+    LLM_BACKEND) – nur Ollama-Zählungen kalibrieren token_counter. tier: tatsächliches num_predict.
+    """
+    actual = usage.get("prompt_tokens")
+    num_ctx = GROQ_NUM_CTX if backend == "groq" else OLLAMA_NUM_CTX
+    if actual and backend != "groq":
+        if _plausible_prompt_count(int(actual), estimated, num_ctx):
+            token_counter.calibrate(len(system_prompt) + len(user_prompt), int(actual) - PROMPT_TEMPLATE_TOKENS)
+        else:
+            logger.debug("prompt_eval_count=%s implausible (est=%s, num_ctx=%s); not calibrating", actual, estimated, num_ctx)
+    logger.info(
+        "prompt tokens: est=%s actual=%s completion=%s num_predict=%s num_ctx=%s",
+        estimated, actual if actual else "n/a", usage.get("completion_tokens", "n/a"), tier.num_predict, num_ctx,
+    )
+    if usage.get("tokens_per_sec") or usage.get("stopped"):
+        logger.info(
+            "generation: %s tok/s, stopped early: %s",
+            round(usage["tokens_per_sec"], 1) if usage.get("tokens_per_sec") else "n/a", usage.get("stopped") or "no",
+        )
+    if actual and int(actual) + tier.num_predict > num_ctx:
+        logger.warning("prompt (%s tokens) + num_predict exceeds num_ctx=%s", actual, num_ctx)
+
+def _report_tier(tier: TierChoice, usage: Dict) -> None:
+    """Verwendetes Modell zu jeder Antwort loggen; gemessene Tokens/s an tier_selector zurückmelden."""
+    model = usage.get("model") or tier.model or OLLAMA_MODEL
+    logger.info(
+        "LLM answer by %s (tier %s: %s, num_predict=%s)", model, tier.level, tier.reason, tier.num_predict,
+    )
+    if tier_selector is not None:
+        tier_selector.observe(model, usage.get("tokens_per_sec"))
+
+def _record_usage(usage: Dict | None, data) -> None:
+    """prompt_eval_count/eval_count (Ollama) bzw. usage (OpenAI-kompatibel) übernehmen."""
+    if usage is None or not isinstance(data, dict):
+        return
+    if "prompt_eval_count" in data:
+        usage["prompt_tokens"] = data.get("prompt_eval_count")
+        usage["completion_tokens"] = data.get("eval_count")
+        if data.get("eval_count") and data.get("eval_duration"):
+            usage["tokens_per_sec"] = data["eval_count"] / (data["eval_duration"] / 1e9)
+    elif isinstance(data.get("usage"), dict):
+        usage["prompt_tokens"] = data["usage"].get("prompt_tokens")
+        usage["completion_tokens"] = data["usage"].get("completion_tokens")
+
+def _record_stream(usage: Dict | None, stats: StreamStats) -> None:
+    """Kennzahlen eines Ollama-Streams (done-Objekt bzw. Abbruchgrund) übernehmen."""
+    if usage is None:
+        return
+    if stats.done:
+        usage["prompt_tokens"] = stats.prompt_eval_count
+        usage["completion_tokens"] = stats.eval_count
+        usage["tokens_per_sec"] = stats.tokens_per_second
+    usage["stopped"] = stats.stopped
+
+def _early_stop(cancelled: Optional[Callable[[], bool]] = None) -> EarlyStop:
+    return EarlyStop(
+        max_chars=STREAM_MAX_CHARS,
+        complete=answer_complete if STREAM_STOP_ON_COMPLETE else None,
+        cancelled=cancelled,
+    )
 
 def _create_prompts(question: str, context: str, chunks_info: List[Dict] | None, target_language: str | None) -> Tuple[str, str]:
     lang = (target_language or "DE").upper()
@@ -171,7 +688,10 @@ def _create_prompts(question: str, context: str, chunks_info: List[Dict] | None,
 
     return system, user
 
-async def _call_ollama_api(system_prompt: str, user_prompt: str, *, want_long: bool = False) -> str:
+async def _call_ollama_api(
+    system_prompt: str, user_prompt: str, *, want_long: bool = False, usage: Dict | None = None, num_predict: bool = True,
+    url: str | None = None, model: str | None = None, limit: int = 0,
+) -> str:
     def _extract_text(data) -> str:
         if not data: return ""
         if isinstance(data, dict):
@@ -181,80 +701,115 @@ async def _call_ollama_api(system_prompt: str, user_prompt: str, *, want_long: b
         return str(data)
 
     payload = {
-        "model": OLLAMA_MODEL,
+        "model": model or OLLAMA_MODEL,
         "prompt": f"<<SYS>>{system_prompt}\n<</SYS>>\n{user_prompt}",
         "options": {
             "temperature": 0.1,
             "top_p": 0.2,
-            "num_predict": min(MAX_TOKENS, 512 if want_long else 256),  # Limit answer length for speed
+            "num_predict": limit or _num_predict(want_long),  # Limit answer length for speed
             "top_k": 10,
             "repeat_penalty": 1.2,
             "num_ctx": OLLAMA_NUM_CTX,    # Use configured context size
             "num_thread": 1,
         },
-        "stream": False
+        "stream": OLLAMA_STREAM
     }
+    if not num_predict:
+        payload["options"].pop("num_predict")
 
-    async with aiohttp.ClientSession(timeout=TIMEOUT, trust_env=True) as session:
-        async with session.post(f"{OLLAMA_URL}/api/generate", json=payload, allow_redirects=False) as resp:
-            if resp.status == 200:
-                if not OLLAMA_STREAM:
-                    data = await resp.json()
-                    return _extract_text(data)
-                
-                acc = []
-                async for chunk in resp.content.iter_any():
-                    try:
-                        s = chunk.decode("utf-8", errors="ignore")
-                        for line in s.splitlines():
-                            if line.strip().startswith("{"):
-                                d = json.loads(line)
-                                t = d.get("response") or ""
-                                if t: acc.append(t)
-                    except Exception:
-                        continue
-                return "".join(acc)
+    session = http_pool.get_session("ollama")
+    async with session.post(f"{url or OLLAMA_URL}/api/generate", json=payload, allow_redirects=False, timeout=TIMEOUT) as resp:
+        if resp.status == 200:
+            if not OLLAMA_STREAM:
+                data = await resp.json()
+                _record_usage(usage, data)
+                return _extract_text(data)
             
-            # Fallback for 400/422 (compatibility)
-            if resp.status in (400, 422):
-                fallback = payload.copy()
-                fallback["options"].pop("num_predict", None)
-                async with session.post(f"{OLLAMA_URL}/api/generate", json=fallback) as resp2:
-                    if resp2.status == 200:
-                        data2 = await resp2.json()
-                        return _extract_text(data2)
-
-            err_text = await resp.text()
-            raise RuntimeError(f"Ollama API {resp.status}: {err_text}")
-
-async def _call_ollama_chat(system_prompt: str, user_prompt: str, *, want_long: bool = False) -> str:
+            stats = StreamStats()
+            acc = [t async for t in iter_ollama_stream(resp, lambda d: d.get("response") or "", stats, _early_stop())]
+            _record_stream(usage, stats)
+            return "".join(acc)
+
+        # 400/422 (z. B. num_predict nicht unterstützt): _call_endpoint testet neu statt blind zu wiederholen
+        err_text = await resp.text()
+        raise LLMHTTPError(f"Ollama API {resp.status}: {err_text}", resp.status)
+
+async def _call_ollama_chat(
+    system_prompt: str, user_prompt: str, *, want_long: bool = False, usage: Dict | None = None, num_predict: bool = True,
+    url: str | None = None, model: str | None = None, limit: int = 0,
+) -> str:
     payload = {
-        "model": OLLAMA_MODEL,
+        "model": model or OLLAMA_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
         "options": {
             "temperature": 0.1,
-            "num_predict": min(MAX_TOKENS, 512 if want_long else 256), # Limit answer length for speed
+            "num_predict": limit or _num_predict(want_long), # Limit answer length for speed
             "num_ctx": OLLAMA_NUM_CTX,    # Use configured context size
             "num_thread": 1,    # Keep one thread if CPU is very weak
         },
         "stream": False
     }
-    async with aiohttp.ClientSession(timeout=TIMEOUT, trust_env=False) as session:
-        async with session.post(f"{OLLAMA_URL}/api/chat", json=payload) as resp:
-            if resp.status != 200:
-                txt = await resp.text()
-                raise RuntimeError(f"Ollama chat {resp.status}: {txt}")
-            data = await resp.json()
-            return data.get("message", {}).get("content", "")
-
-async def _call_groq_chat(system_prompt: str, user_prompt: str, *, want_long: bool = False) -> str:
+    if not num_predict:
+        payload["options"].pop("num_predict")
+    session = http_pool.get_session("ollama")
+    async with session.post(f"{url or OLLAMA_URL}/api/chat", json=payload, timeout=TIMEOUT) as resp:
+        if resp.status != 200:
+            txt = await resp.text()
+            raise LLMHTTPError(f"Ollama chat {resp.status}: {txt}", resp.status)
+        data = await resp.json()
+        _record_usage(usage, data)
+        return data.get("message", {}).get("content", "")
+
+async def _stream_ollama_chat(
+    system_prompt: str,
+    user_prompt: str,
+    *,
+    want_long: bool = False,
+    usage: Dict | None = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    url: str | None = None,
+    model: str | None = None,
+    limit: int = 0,
+) -> AsyncIterator[str]:
+    payload = {
+        "model": model or OLLAMA_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "options": {
+            "temperature": 0.1,
+            "num_predict": limit or _num_predict(want_long),
+            "num_ctx": OLLAMA_NUM_CTX,
+            "num_thread": 1,
+        },
+        "stream": True,
+    }
+    session = http_pool.get_session("ollama")
+    async with session.post(f"{url or OLLAMA_URL}/api/chat", json=payload, timeout=TIMEOUT) as resp:
+        if resp.status != 200:
+            txt = await resp.text()
+            raise LLMHTTPError(f"Ollama chat {resp.status}: {txt}", resp.status)
+        stats = StreamStats()
+        try:
+            async for piece in iter_ollama_stream(
+                resp, lambda d: (d.get("message") or {}).get("content") or "", stats, _early_stop(cancelled)
+            ):
+                yield piece
+        finally:
+            _record_stream(usage, stats)
+
+async def _call_groq_chat(
+    system_prompt: str, user_prompt: str, *, want_long: bool = False, usage: Dict | None = None,
+    url: str | None = None, model: str | None = None,
+) -> str:
     if not GROQ_API_KEY:
         raise RuntimeError("GROQ_API_KEY is not set")
     payload = {
-        "model": GROQ_MODEL,
+        "model": model or GROQ_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
@@ -267,13 +822,14 @@ async def _call_groq_chat(system_prompt: str, user_prompt: str, *, want_long: bo
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json",
     }
-    async with aiohttp.ClientSession(timeout=TIMEOUT, trust_env=True) as session:
-        async with session.post("https://api.groq.com/openai/v1/chat/completions", json=payload, headers=headers) as resp:
-            if resp.status != 200:
-                txt = await resp.text()
-                raise RuntimeError(f"Groq chat {resp.status}: {txt}")
-            data = await resp.json()
-            return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "")
+    session = http_pool.get_session("groq")
+    async with session.post(url or GROQ_URL, json=payload, headers=headers, timeout=TIMEOUT) as resp:
+        if resp.status != 200:
+            txt = await resp.text()
+            raise LLMHTTPError(f"Groq chat {resp.status}: {txt}", resp.status)
+        data = await resp.json()
+        _record_usage(usage, data)
+        return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "")
 
 def _md_bold_to_html_block(text: str) -> str:
     return re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", text or "")
@@ -385,6 +941,71 @@ def _sanitize_for_telegram(text: str) -> str:
     
     return escaped
 
+_OPEN_PRE_RE = re.compile(r"(?i)<pre\b")
+_CLOSE_PRE_RE = re.compile(r"(?i)</pre>")
+_ANY_TAG_RE = re.compile(r"</?[A-Za-z][^>]*>?$|</?[A-Za-z][^>]*>")
+_TAG_TOKEN_RE = re.compile(r"(?i)<(/?)(b|pre)>")
+
+
+def _balance_tags(text: str) -> str:
+    """Nicht geschlossene <b>/<pre> schließen, verwaiste Endtags entfernen (Telegram lehnt sonst ab)."""
+    out: List[str] = []
+    stack: List[str] = []
+    pos = 0
+    for m in _TAG_TOKEN_RE.finditer(text):
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        tag = m.group(2).lower()
+        if not m.group(1):
+            stack.append(tag)
+            out.append(f"<{tag}>")
+        elif tag in stack:
+            while stack:
+                top = stack.pop()
+                out.append(f"</{top}>")
+                if top == tag:
+                    break
+    out.append(text[pos:])
+    out.extend(f"</{t}>" for t in reversed(stack))
+    return "".join(out)
+
+
+class StreamRenderer:
+    """
+    Inkrementelle Aufbereitung einer gestreamten Antwort für Nachrichten-Edits: abgeschlossene
+    Absätze (außerhalb eines offenen <pre>-Blocks) werden einmal nach HTML umgewandelt und
+    zwischengespeichert; nur der offene Rest wird bei jedem render() als Klartext angehängt.
+    Die endgültige Fassung erzeugt finalize_response über den gesamten Text.
+    """
+
+    def __init__(self) -> None:
+        self.raw = ""
+        self._done = 0                 # Anzahl bereits gerenderter Rohzeichen
+        self._blocks: List[str] = []   # gerenderte, abgeschlossene Absätze
+
+    def feed(self, piece: str) -> None:
+        self.raw += piece or ""
+
+    def _stable_end(self) -> int:
+        pos = self.raw.rfind("\n\n")
+        while pos > self._done:
+            head = self.raw[:pos]
+            if len(_OPEN_PRE_RE.findall(head)) <= len(_CLOSE_PRE_RE.findall(head)):
+                return pos
+            pos = self.raw.rfind("\n\n", 0, pos)
+        return self._done
+
+    def render(self) -> str:
+        end = self._stable_end()
+        if end > self._done:
+            block = _strip_noinfo_sections(self.raw[self._done:end])
+            if block:
+                self._blocks.append(_balance_tags(_sanitize_for_telegram(normalize_to_html(block))))
+            self._done = end
+        tail = html.escape(_ANY_TAG_RE.sub("", self.raw[self._done:]).strip())
+        return "\n\n".join(self._blocks + ([tail] if tail else []))
+
+
 def _strip_noinfo_sections(text: str) -> str:
     if not text: return ""
     _NOINFO_RE = re.compile(r"(?im)^\s*(kommentare?|comments?)\s*:.*$|^\s*keine\s+relevanten\s+informationen.*$")
@@ -394,10 +1015,10 @@ def _strip_noinfo_sections(text: str) -> str:
 def _normalize_response(text: str) -> str:
     return text.strip() if text and text.strip() else "Keine relevanten Informationen im Kontext."
 
-async def test_ollama_connection() -> bool:
+async def test_ollama_connection(url: str | None = None) -> bool:
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            async with session.get(f"{OLLAMA_URL}/api/tags") as r:
-                return r.status == 200
+        session = http_pool.get_session("ollama")
+        async with session.get(f"{url or OLLAMA_URL}/api/tags", timeout=aiohttp.ClientTimeout(total=5)) as r:
+            return r.status == 200
     except:
         return False
\ No newline at end of file
@@ -0,0 +1,242 @@
+# llm_router.py
+# Verteilung der Generierungen auf mehrere Ollama-/OpenAI-kompatible Endpunkte (z. B. zwei lokale
+# Ollama-Hosts plus Groq). Reihenfolge nach Gewicht, gemessener Latenz (EWMA) und laufenden Anfragen;
+# Endpunkte mit offenem Schutzschalter werden übersprungen. Optional "Hedging": Antwortet der erste
+# Endpunkt nicht innerhalb von hedge_delay Sekunden, geht dieselbe Anfrage zusätzlich an den nächsten,
+# die erste Antwort gewinnt, die andere wird abgebrochen. Eine Hedge-Anfrage belegt einen eigenen Slot
+# in llm_scheduler und entfällt, wenn keiner frei ist – so bleibt es bei LLM_CONCURRENCY Generierungen.
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from llm_scheduler import LLMScheduler
+
+logger = logging.getLogger("llm_router")
+
+_EWMA_ALPHA = 0.3
+
+
+class Endpoint:
+    """Ein LLM-Endpunkt; url/model leer = Standardwerte des Backends (OLLAMA_URL/OLLAMA_MODEL bzw. Groq)."""
+
+    __slots__ = ("name", "kind", "url", "model", "weight", "latency", "inflight", "requests", "failures", "wins")
+
+    def __init__(self, name: str, kind: str, url: str = "", model: str = "", weight: float = 1.0) -> None:
+        self.name = name
+        self.kind = kind
+        self.url = url
+        self.model = model
+        self.weight = max(0.01, float(weight))
+        self.latency: Optional[float] = None  # EWMA erfolgreicher Aufrufe (s)
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0  # als Hedge-Anfrage schneller als der eigentlich gewählte Endpunkt
+
+    def observe(self, ok: bool, latency: float) -> None:
+        self.requests += 1
+        if not ok:
+            self.failures += 1
+            return
+        self.latency = latency if self.latency is None else (1 - _EWMA_ALPHA) * self.latency + _EWMA_ALPHA * latency
+
+    def score(self, default_latency: float) -> float:
+        """Kleiner = bevorzugt: erwartete Latenz × Auslastung / Gewicht."""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + self.inflight) / self.weight
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name}, {self.kind}, weight={self.weight})"
+
+
+def parse_endpoints(spec: str) -> List[Endpoint]:
+    """
+    "kind|url|model|weight, ..." – z. B. "ollama|http://host1:11434||2, ollama|http://host2:11434, groq".
+    Leere Felder → Standardwerte; Name = kind@host (bzw. kind).
+    """
+    endpoints: List[Endpoint] = []
+    names: Dict[str, int] = {}
+    for entry in (spec or "").split(","):
+        fields = [f.strip() for f in entry.split("|")]
+        if not fields[0]:
+            continue
+        kind = fields[0].lower()
+        url = fields[1] if len(fields) > 1 else ""
+        model = fields[2] if len(fields) > 2 else ""
+        weight = float(fields[3]) if len(fields) > 3 and fields[3] else 1.0
+        name = f"{kind}@{urlparse(url).netloc}" if url else kind
+        names[name] = names.get(name, 0) + 1
+        if names[name] > 1:
+            name = f"{name}#{names[name]}"
+        endpoints.append(Endpoint(name, kind, url, model, weight))
+    return endpoints
+
+
+class LLMRouter:
+    """
+    call(fn): fn(endpoint) auf dem besten Endpunkt, bei Fehler der nächste (Failover), mit Hedging.
+    stream(fn): Async-Generator; Failover nur vor dem ersten Stück, kein Hedging.
+    breaker_for(endpoint) liefert den Schutzschalter des Endpunkts. hedge_slots: Scheduler, aus dem
+    jede Hedge-Anfrage zusätzlich einen freien Slot nehmen muss (None = unbegrenzt).
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        *,
+        breaker_for: Callable[[Endpoint], CircuitBreaker],
+        hedge_delay: float = 0.0,
+        hedge_slots: Optional[LLMScheduler] = None,
+    ) -> None:
+        if not endpoints:
+            raise ValueError("LLMRouter needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.breaker_for = breaker_for
+        self.hedge_delay = max(0.0, float(hedge_delay))
+        self.hedge_slots = hedge_slots
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.failovers = 0
+
+    def ordered(self) -> List[Endpoint]:
+        """Endpunkte ohne offenen Schutzschalter, bester zuerst (bei Gleichstand: Konfigurationsreihenfolge)."""
+        known = [ep.latency for ep in self.endpoints if ep.latency is not None]
+        default = sum(known) / len(known) if known else 1.0
+        usable = [ep for ep in self.endpoints if not self.breaker_for(ep).is_open()]
+        return sorted(usable, key=lambda ep: ep.score(default))
+
+    def check(self) -> None:
+        """CircuitOpen, wenn kein Endpunkt verfügbar ist (vor dem Einreihen in die Warteschlange)."""
+        if not self.ordered():
+            for ep in self.endpoints:
+                self.breaker_for(ep).rejected += 1
+            raise CircuitOpen("all LLM endpoints unavailable")
+
+    async def _attempt(self, ep: Endpoint, fn: Callable[[Endpoint], Awaitable]):
+        breaker = self.breaker_for(ep)
+        await breaker.before()
+        ep.inflight += 1
+        t0 = time.monotonic()
+        try:
+            result = await fn(ep)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            breaker.record(False, time.monotonic() - t0)
+            ep.observe(False, time.monotonic() - t0)
+            raise
+        finally:
+            ep.inflight -= 1
+            breaker.abort()
+        breaker.record(True, time.monotonic() - t0)
+        ep.observe(True, time.monotonic() - t0)
+        return result
+
+    async def call(self, fn: Callable[[Endpoint], Awaitable]):
+        candidates = self.ordered()
+        if not candidates:
+            raise CircuitOpen("all LLM endpoints unavailable")
+        pending: Dict[asyncio.Future, Endpoint] = {}
+        errors: List[BaseException] = []
+        primary = candidates[0]
+        nxt = 1
+        hedged = False
+        pending[asyncio.ensure_future(self._attempt(primary, fn))] = primary
+        try:
+            while pending:
+                hedge = self.hedge_delay > 0 and not hedged and nxt < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_delay if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # erster Endpunkt zu langsam → dieselbe Anfrage zusätzlich an den nächsten
+                    hedged = True
+                    if self.hedge_slots is not None and not self.hedge_slots.try_acquire():
+                        self.hedges_skipped += 1
+                        logger.debug("no free LLM slot for a hedge request; waiting for %s", primary.name)
+                        continue
+                    ep = candidates[nxt]
+                    nxt += 1
+                    self.hedges += 1
+                    logger.info("hedging LLM request to %s after %.1f s", ep.name, self.hedge_delay)
+                    task = asyncio.ensure_future(self._attempt(ep, fn))
+                    if self.hedge_slots is not None:
+                        task.add_done_callback(lambda _t, slots=self.hedge_slots: slots.release())
+                    pending[task] = ep
+                    continue
+                for task in done:
+                    ep = pending.pop(task)
+                    if task.exception() is None:
+                        if ep is not primary and hedged:
+                            ep.wins += 1
+                        return task.result()
+                    errors.append(task.exception())
+                    logger.warning("LLM endpoint %s failed: %s", ep.name, task.exception())
+                if not pending and nxt < len(candidates):
+                    ep = candidates[nxt]
+                    nxt += 1
+                    self.failovers += 1
+                    pending[asyncio.ensure_future(self._attempt(ep, fn))] = ep
+            raise errors[-1]
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, fn: Callable[[Endpoint], AsyncIterator[str]]) -> AsyncIterator[str]:
+        last: Optional[BaseException] = None
+        for i, ep in enumerate(self.ordered()):
+            breaker = self.breaker_for(ep)
+            try:
+                await breaker.before()
+            except CircuitOpen as e:
+                last = e
+                continue
+            if i:
+                self.failovers += 1
+            emitted = False
+            ep.inflight += 1
+            t0 = time.monotonic()
+            try:
+                async for piece in fn(ep):
+                    emitted = True
+                    yield piece
+            except Exception as e:
+                breaker.record(False, time.monotonic() - t0)
+                ep.observe(False, time.monotonic() - t0)
+                if emitted:
+                    raise
+                logger.warning("LLM endpoint %s failed: %s", ep.name, e)
+                last = e
+                continue
+            finally:
+                ep.inflight -= 1
+                breaker.abort()
+            breaker.record(True, time.monotonic() - t0)
+            ep.observe(True, time.monotonic() - t0)
+            return
+        raise last or CircuitOpen("all LLM endpoints unavailable")
+
+    def stats(self) -> Dict:
+        return {
+            "hedges": self.hedges,
+            "hedges_skipped": self.hedges_skipped,
+            "failovers": self.failovers,
+            "endpoints": [
+                {
+                    "name": ep.name,
+                    "weight": ep.weight,
+                    "requests": ep.requests,
+                    "failures": ep.failures,
+                    "latency_ms": (ep.latency or 0.0) * 1000.0,
+                    "inflight": ep.inflight,
+                    "hedge_wins": ep.wins,
+                    "state": self.breaker_for(ep).state,
+                }
+                for ep in self.endpoints
+            ],
+        }
@@ -0,0 +1,136 @@
+# llm_scheduler.py
+# Zulassungssteuerung für LLM-Generierungen: höchstens LLM_CONCURRENCY gleichzeitig (eine CPU-Instanz
+# von Ollama wird durch parallele Generierungen nur für alle langsamer), der Rest wartet in einer
+# begrenzten Prioritätswarteschlange. Ist sie voll oder wird die Wartefrist überschritten, kommt sofort
+# SchedulerBusy zurück (→ kurze "ausgelastet"-Antwort) statt einer Antwort nach Minuten.
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("llm_scheduler")
+
+# Kleinere Zahl = früher an der Reihe: kurze Definitions-Umformulierungen vor vollen Antworten
+PRIORITY_DEFINITION = 0
+PRIORITY_ANSWER = 1
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "1"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "8"))
+# maximale Wartezeit in der Warteschlange (s), danach Lastabwurf
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+
+class SchedulerBusy(RuntimeError):
+    """Anfrage abgewiesen: Warteschlange voll, verdrängt oder Wartefrist überschritten."""
+
+
+class LLMScheduler:
+    """
+    Prioritätswarteschlange (Heap aus (Priorität, Reihenfolge, Future)) vor einer festen Zahl von
+    Generierungs-Slots. Bei voller Warteschlange verdrängt eine wichtigere Anfrage die unwichtigste
+    wartende; sonst wird die neue Anfrage abgewiesen.
+    """
+
+    def __init__(self, concurrency: int = 1, *, max_queue: int = 8, queue_timeout: float = 30.0, name: str = "llm") -> None:
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = max(0.0, float(queue_timeout))
+        self._active = 0
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.evicted = 0
+        self.max_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def depth(self) -> int:
+        return sum(1 for _, _, fut in self._heap if not fut.done())
+
+    def _admit(self, waited: float) -> None:
+        self.admitted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _make_room(self, priority: int) -> None:
+        """Volle Warteschlange: unwichtigsten (zuletzt gekommenen) Wartenden verdrängen oder abweisen."""
+        waiting = [e for e in self._heap if not e[2].done()]
+        worst = max(waiting, key=lambda e: (e[0], e[1]), default=None)
+        if worst is None or worst[0] <= priority:
+            self.shed += 1
+            raise SchedulerBusy(f"{self.name}: queue full ({len(waiting)} waiting)")
+        worst[2].set_exception(SchedulerBusy(f"{self.name}: evicted by a higher-priority request"))
+        self.evicted += 1
+
+    async def acquire(self, priority: int = PRIORITY_ANSWER, timeout: Optional[float] = None) -> None:
+        if self._active < self.concurrency and not self.depth():
+            self._active += 1
+            self._admit(0.0)
+            return
+        if self.depth() >= self.max_queue:
+            self._make_room(priority)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self.max_depth = max(self.max_depth, self.depth())
+        t0 = loop.time()
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(fut, timeout or None)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release()  # Slot wurde gerade übergeben, wird aber nicht mehr gebraucht
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise SchedulerBusy(f"{self.name}: queue wait exceeded {timeout:.0f} s") from None
+            raise
+        self._admit(loop.time() - t0)
+
+    def try_acquire(self) -> bool:
+        """Slot nur nehmen, wenn sofort einer frei ist und niemand wartet (z. B. für Hedge-Anfragen)."""
+        if self._active < self.concurrency and not self.depth():
+            self._active += 1
+            self._admit(0.0)
+            return True
+        return False
+
+    def release(self) -> None:
+        self._active -= 1
+        while self._heap:
+            _, _, fut = heapq.heappop(self._heap)
+            if not fut.done():
+                self._active += 1  # Slot direkt an den nächsten Wartenden übergeben
+                fut.set_result(None)
+                break
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_ANSWER, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "queued": self.depth(),
+            "max_queued": self.max_depth,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "evicted": self.evicted,
+            "wait_avg_ms": (self._wait_total / self.admitted * 1000.0) if self.admitted else 0.0,
+            "wait_max_ms": self._wait_max * 1000.0,
+        }
+
+
+llm_scheduler = LLMScheduler(LLM_CONCURRENCY, max_queue=LLM_QUEUE_SIZE, queue_timeout=LLM_QUEUE_TIMEOUT)
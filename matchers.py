@@ -0,0 +1,114 @@
+# matchers.py
+# Vorkompilierte, gecachte Matcher für die Retrieval-Hotpaths.
+# Pro Begriff wird genau einmal kompiliert (lru_cache); Mehrwortprüfungen wie BAD_DEFN_WORDS
+# laufen über einen Aho–Corasick-Automaten (pyahocorasick, falls installiert – sonst über
+# C-seitige Substring-Scans, die bei kleinen Wortlisten schneller sind als ein Automat in reinem Python).
+import re
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+try:
+    import ahocorasick  # optional (pyahocorasick)
+except ImportError:  # pragma: no cover - abhängig von der Umgebung
+    ahocorasick = None
+
+from acronym_utils import BAD_DEFN_WORDS
+
+_NORM_RE = re.compile(r"[\s\-/]+")
+_SHORT_ACR_RE = re.compile(r"[A-ZÄÖÜ]{2,5}")
+_URL_RE = re.compile(r"https?://", re.IGNORECASE)
+_SENT_SPLIT_RE = re.compile(r"(?<=[\.\!\?])\s+")
+
+
+def normalize_text(s: str) -> str:
+    return _NORM_RE.sub("", s or "").casefold()
+
+
+@lru_cache(maxsize=2048)
+def normalized(text: str) -> str:
+    """Wie normalize_text, aber gecacht – Chunktexte wiederholen sich über Anfragen hinweg."""
+    return normalize_text(text)
+
+
+def is_short_acronym(term: str) -> bool:
+    return bool(_SHORT_ACR_RE.fullmatch(term or ""))
+
+
+class TermMatcher:
+    """Prüft, ob ein Begriff in einem Text vorkommt (kurze Akronyme nur an Wortgrenzen)."""
+
+    __slots__ = ("term", "pattern", "norm")
+
+    def __init__(self, term: str) -> None:
+        self.term = term
+        self.pattern: Optional[re.Pattern] = (
+            re.compile(rf"(?<![A-Za-zÄÖÜäöüß]){re.escape(term)}(?![A-Za-zÄÖÜäöüß])")
+            if is_short_acronym(term)
+            else None
+        )
+        self.norm = normalize_text(term)
+
+    def __call__(self, text: str, *, cached: bool = False) -> bool:
+        """cached=True für ganze Chunktexte (Normalisierung wird über Anfragen hinweg wiederverwendet)."""
+        if not text:
+            return False
+        if self.pattern is not None:
+            return self.pattern.search(text) is not None
+        return self.norm in (normalized(text) if cached else normalize_text(text))
+
+
+@lru_cache(maxsize=1024)
+def term_matcher(term: str) -> TermMatcher:
+    return TermMatcher(term)
+
+
+@lru_cache(maxsize=1024)
+def defn_regex(term: str) -> re.Pattern:
+    return re.compile(
+        rf"\b{re.escape(term)}\b\s*(?:[-–—:]\s*)([^\n]{{5,200}})",
+        re.IGNORECASE,
+    )
+
+
+@lru_cache(maxsize=1024)
+def expansion_regexes(term: str) -> Tuple[re.Pattern, re.Pattern]:
+    """(TERM - Expansion, Expansion (TERM))"""
+    t = re.escape(term)
+    return (
+        re.compile(rf"\b{t}\b\s*[-–—:]\s*([A-Za-z][A-Za-z \-\/]{{2,60}})"),
+        re.compile(rf"([A-Za-z][A-Za-z \-\/]{{2,60}})\s*\(\s*{t}\s*\)"),
+    )
+
+
+def has_url(s: str) -> bool:
+    return _URL_RE.search(s or "") is not None
+
+
+def split_sentences(text: str):
+    return _SENT_SPLIT_RE.split(text or "")
+
+
+class MultiTermMatcher:
+    """Enthält der (bereits casefoldete) Text eines der Wörter? Einmal aufgebaut, beliebig oft genutzt."""
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self.words = tuple(sorted({w.casefold() for w in words if w}))
+        self._automaton = None
+        if ahocorasick is not None and self.words:
+            a = ahocorasick.Automaton()
+            for w in self.words:
+                a.add_word(w, w)
+            a.make_automaton()
+            self._automaton = a
+
+    def search(self, text_cf: str) -> bool:
+        if not text_cf:
+            return False
+        if self._automaton is not None:
+            for _ in self._automaton.iter(text_cf):
+                return True
+            return False
+        return any(w in text_cf for w in self.words)
+
+
+BAD_DEFN_MATCHER = MultiTermMatcher(BAD_DEFN_WORDS)
@@ -0,0 +1,147 @@
+# model_tiers.py
+# Lastabhängige Modellwahl: geordnete Liste von Modellstufen (groß → klein). Im Leerlauf antwortet die
+# größte Stufe; wartende Anfragen in llm_scheduler und eine zuletzt zu niedrige Generierungsrate
+# (Tokens/s) schieben die Auswahl zu kleineren Modellen, jenseits der kleinsten Stufe wird num_predict
+# halbiert. Lange Antworten (Zusammenfassungen, Erklärungen) bleiben eine Stufe länger beim größeren Modell.
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("model_tiers")
+
+# je LLM_TIER_QUEUE_STEP wartende Anfragen eine Stufe kleiner (0 = Warteschlange ignorieren)
+LLM_TIER_QUEUE_STEP = int(os.getenv("LLM_TIER_QUEUE_STEP", "2"))
+# liefert die gewählte Stufe zuletzt weniger Tokens/s, eine Stufe kleiner (0 = aus)
+LLM_TIER_MIN_TPS = float(os.getenv("LLM_TIER_MIN_TPS", "0"))
+
+_EWMA_ALPHA = 0.3
+_MIN_NUM_PREDICT = 64
+
+
+class ModelTier:
+    """Eine Modellstufe; num_predict: Obergrenze für die Antwortlänge (0 = Standard)."""
+
+    __slots__ = ("model", "num_predict", "tokens_per_sec", "observed_at", "selected")
+
+    def __init__(self, model: str, num_predict: int = 0) -> None:
+        self.model = model
+        self.num_predict = max(0, int(num_predict))
+        self.tokens_per_sec: Optional[float] = None  # EWMA
+        self.observed_at = 0.0
+        self.selected = 0
+
+    def observe(self, tokens_per_sec: float) -> None:
+        if self.tokens_per_sec is None:
+            self.tokens_per_sec = tokens_per_sec
+        else:
+            self.tokens_per_sec = (1 - _EWMA_ALPHA) * self.tokens_per_sec + _EWMA_ALPHA * tokens_per_sec
+        self.observed_at = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"ModelTier({self.model}, num_predict={self.num_predict or 'default'})"
+
+
+def parse_tiers(spec: str) -> List[ModelTier]:
+    """"llama3.2:3b, llama3.2:1b|384, tinyllama|256" – Modell|num_predict-Obergrenze, größtes zuerst."""
+    tiers: List[ModelTier] = []
+    for entry in (spec or "").split(","):
+        fields = [f.strip() for f in entry.split("|")]
+        if not fields[0]:
+            continue
+        num_predict = int(fields[1]) if len(fields) > 1 and fields[1] else 0
+        tiers.append(ModelTier(fields[0], num_predict))
+    return tiers
+
+
+class TierChoice:
+    """Ergebnis der Auswahl: Modell ("" = OLLAMA_MODEL), num_predict, Stufe (0 = größte) und Grund."""
+
+    __slots__ = ("model", "num_predict", "level", "reason")
+
+    def __init__(self, model: str, num_predict: int, level: int = 0, reason: str = "fixed") -> None:
+        self.model = model
+        self.num_predict = num_predict
+        self.level = level
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return f"TierChoice({self.model or 'default'}, num_predict={self.num_predict}, level={self.level}, {self.reason})"
+
+
+class TierSelector:
+    """
+    select(want_long, queue_depth, default_num_predict): Stufe = wartende Anfragen // queue_step,
+    bei langen Antworten eine weniger, eine mehr, wenn die Stufe zuletzt langsamer als min_tps war
+    (Messungen älter als horizon Sekunden zählen nicht). observe(model, tok/s) nach jeder Antwort.
+    """
+
+    def __init__(
+        self,
+        tiers: List[ModelTier],
+        *,
+        queue_step: int = LLM_TIER_QUEUE_STEP,
+        min_tps: float = LLM_TIER_MIN_TPS,
+        horizon: float = 300.0,
+    ) -> None:
+        if not tiers:
+            raise ValueError("TierSelector needs at least one model tier")
+        self.tiers = list(tiers)
+        self.queue_step = max(0, int(queue_step))
+        self.min_tps = max(0.0, float(min_tps))
+        self.horizon = float(horizon)
+        self.shortened = 0
+
+    def _slow(self, tier: ModelTier) -> bool:
+        return (
+            self.min_tps > 0
+            and tier.tokens_per_sec is not None
+            and time.monotonic() - tier.observed_at < self.horizon
+            and tier.tokens_per_sec < self.min_tps
+        )
+
+    def select(self, want_long: bool, queue_depth: int, default_num_predict: int) -> TierChoice:
+        last = len(self.tiers) - 1
+        reasons: List[str] = []
+        level = 0
+        if self.queue_step and queue_depth >= self.queue_step:
+            level = queue_depth // self.queue_step
+            reasons.append(f"queue={queue_depth}")
+            if want_long:
+                level -= 1
+        tier = self.tiers[min(level, last)]
+        if self._slow(tier):
+            level += 1
+            reasons.append(f"{tier.model} {tier.tokens_per_sec:.1f} tok/s")
+            tier = self.tiers[min(level, last)]
+        num_predict = min(default_num_predict, tier.num_predict or default_num_predict)
+        if level > last:
+            # kleinste Stufe ist schon gewählt → Antwort kürzen
+            num_predict = max(_MIN_NUM_PREDICT, num_predict >> (level - last))
+            self.shortened += 1
+        tier.selected += 1
+        return TierChoice(tier.model, num_predict, level, ", ".join(reasons) or "idle")
+
+    def observe(self, model: str, tokens_per_sec: Optional[float]) -> None:
+        if not tokens_per_sec:
+            return
+        for tier in self.tiers:
+            if tier.model == model:
+                tier.observe(tokens_per_sec)
+
+    def models(self) -> List[str]:
+        return [tier.model for tier in self.tiers]
+
+    def stats(self) -> Dict:
+        return {
+            "shortened": self.shortened,
+            "tiers": [
+                {
+                    "model": tier.model,
+                    "num_predict": tier.num_predict,
+                    "selected": tier.selected,
+                    "tokens_per_sec": tier.tokens_per_sec or 0.0,
+                }
+                for tier in self.tiers
+            ],
+        }
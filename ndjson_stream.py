@@ -0,0 +1,191 @@
+# ndjson_stream.py
+# Inkrementeller NDJSON-Decoder für die Streaming-Endpunkte von Ollama (/api/chat, /api/generate)
+# mit Abbruchkriterien: Sobald ein Kriterium greift, wird die HTTP-Verbindung geschlossen –
+# Ollama bemerkt den Abbruch und hört auf zu generieren, statt bis num_predict weiterzurechnen.
+import asyncio
+import codecs
+import json
+import logging
+import re
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger("ndjson_stream")
+
+# Meta-Zeilen, mit denen kleine Modelle nach der eigentlichen Antwort weiterschreiben
+# (dieselben Zeilen entfernt llm_client._strip_noinfo_sections ohnehin)
+_TRAILER_RE = re.compile(r"(?im)^\s*(?:kommentare?|comments?)\s*:|^\s*keine\s+relevanten\s+informationen")
+_MIN_ANSWER_CHARS = 200
+
+
+class NDJSONDecoder:
+    """
+    Bytes → JSON-Objekte, eine Zeile pro Objekt. Zeilen und UTF-8-Sequenzen dürfen über
+    Chunk-Grenzen hinweg geteilt sein; der unvollständige Rest wird bis zum nächsten feed() gepuffert.
+    """
+
+    def __init__(self) -> None:
+        self._utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buf = ""
+        self.errors = 0
+
+    def _parse(self, line: str, out: List[Dict]) -> None:
+        line = line.strip()
+        if not line:
+            return
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            self.errors += 1
+            logger.debug("skipping malformed NDJSON line: %.80s", line)
+            return
+        if isinstance(obj, dict):
+            out.append(obj)
+
+    def feed(self, data: bytes) -> List[Dict]:
+        self._buf += self._utf8.decode(data)
+        out: List[Dict] = []
+        *lines, self._buf = self._buf.split("\n")
+        for line in lines:
+            self._parse(line, out)
+        return out
+
+    def close(self) -> List[Dict]:
+        """Rest ohne abschließenden Zeilenumbruch (letztes Objekt) auswerten."""
+        self._buf += self._utf8.decode(b"", final=True)
+        out: List[Dict] = []
+        self._parse(self._buf, out)
+        self._buf = ""
+        return out
+
+
+class StreamStats:
+    """Abschlussdaten eines Streams (Ollama-Felder des done-Objekts) und ggf. der Abbruchgrund."""
+
+    __slots__ = (
+        "done", "done_reason", "eval_count", "eval_duration", "prompt_eval_count",
+        "total_duration", "chars", "stopped",
+    )
+
+    def __init__(self) -> None:
+        self.done = False
+        self.done_reason: Optional[str] = None
+        self.eval_count: Optional[int] = None
+        self.eval_duration: Optional[int] = None  # Nanosekunden
+        self.prompt_eval_count: Optional[int] = None
+        self.total_duration: Optional[int] = None
+        self.chars = 0
+        self.stopped: Optional[str] = None  # "max_chars" | "complete" | "cancelled"
+
+    def update(self, obj: Dict) -> None:
+        self.done = bool(obj.get("done"))
+        self.done_reason = obj.get("done_reason", self.done_reason)
+        for key in ("eval_count", "eval_duration", "prompt_eval_count", "total_duration"):
+            if obj.get(key) is not None:
+                setattr(self, key, obj.get(key))
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.eval_count and self.eval_duration:
+            return self.eval_count / (self.eval_duration / 1e9)
+        return None
+
+    def __repr__(self) -> str:
+        tps = self.tokens_per_second
+        return (
+            f"StreamStats(done={self.done}, eval_count={self.eval_count}, "
+            f"tok/s={tps and round(tps, 1)}, chars={self.chars}, stopped={self.stopped})"
+        )
+
+
+def answer_complete(text: str) -> bool:
+    """
+    Antwort ist fertig, wenn nach genügend Inhalt eine Meta-Zeile ("Kommentar:", "Keine relevanten
+    Informationen …") beginnt oder der zuletzt abgeschlossene Absatz einen früheren wiederholt.
+    """
+    if len(text) < _MIN_ANSWER_CHARS:
+        return False
+    m = _TRAILER_RE.search(text, _MIN_ANSWER_CHARS // 2)
+    if m:
+        return True
+    paras = [p.strip() for p in text.split("\n\n")]
+    if len(paras) >= 3:
+        last = paras[-2]  # paras[-1] ist noch offen
+        if len(last) >= 40 and last in paras[:-2]:
+            return True
+    return False
+
+
+class EarlyStop:
+    """
+    Abbruchkriterien für einen laufenden Stream: max_chars (0 = aus), complete (Antwort erkannt
+    als vollständig, Standard answer_complete), cancelled (z. B. Client hat abgebrochen).
+    """
+
+    def __init__(
+        self,
+        max_chars: int = 0,
+        complete: Optional[Callable[[str], bool]] = answer_complete,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.max_chars = max_chars
+        self.complete = complete
+        self.cancelled = cancelled
+
+    def check(self, text: str) -> Optional[str]:
+        if self.cancelled is not None and self.cancelled():
+            return "cancelled"
+        if self.max_chars and len(text) >= self.max_chars:
+            return "max_chars"
+        if self.complete is not None and self.complete(text):
+            return "complete"
+        return None
+
+
+async def iter_ollama_stream(
+    resp,
+    extract: Callable[[Dict], str],
+    stats: StreamStats,
+    stop: Optional[EarlyStop] = None,
+) -> AsyncIterator[str]:
+    """
+    Textstücke eines Ollama-Streams (resp: aiohttp-Response). extract holt den Text aus einem
+    Objekt (chat: message.content, generate: response). Bei einem Abbruchkriterium wird die
+    Verbindung geschlossen (nicht an den Pool zurückgegeben), damit Ollama die Generierung beendet.
+    """
+    decoder = NDJSONDecoder()
+    text = ""
+
+    def handle(obj: Dict) -> Optional[str]:
+        if obj.get("error"):
+            raise RuntimeError(f"Ollama stream error: {obj['error']}")
+        if obj.get("done"):
+            stats.update(obj)
+        return extract(obj) or ""
+
+    try:
+        async for chunk in resp.content.iter_any():
+            for obj in decoder.feed(chunk):
+                piece = handle(obj)
+                if piece:
+                    text += piece
+                    stats.chars = len(text)
+                    yield piece
+                if stats.done:
+                    return
+                reason = stop.check(text) if stop is not None else None
+                if reason:
+                    stats.stopped = reason
+                    logger.info("stream stopped early (%s) after %s chars", reason, len(text))
+                    resp.close()
+                    return
+        for obj in decoder.close():
+            piece = handle(obj)
+            if piece:
+                text += piece
+                stats.chars = len(text)
+                yield piece
+    except (GeneratorExit, asyncio.CancelledError):
+        # Verbraucher hat aufgehört zu lesen bzw. Task abgebrochen → Verbindung schließen
+        stats.stopped = stats.stopped or "cancelled"
+        resp.close()
+        raise
@@ -21,6 +21,15 @@ _sema = asyncio.Semaphore(_OCR_CONCURRENCY)
 
 # Heuristics for shortening definition lines (e.g. „TARA – Threat Analysis and Risk Assessment“)
 DEFN_RE = re.compile(r"\b([A-ZÄÖÜ]{2,10})\b\s*(?:[-–—:]\s*|\()", re.IGNORECASE)
+
+# Structure heuristics for chunk metadata (section path, table label, content type)
+HEADING_RE = re.compile(
+    r"^(?:(?:Clause|Section|Kapitel|Abschnitt)\s+)?(\d{1,2}(?:\.\d{1,3}){0,4}|[A-Z](?:\.\d{1,3}){1,4})\.?\s+([A-ZÄÖÜ][^|]{1,200})"
+)
+ANNEX_RE = re.compile(r"^(?:Annex|Anhang)\s+([A-Z])\b\s*(.*)", re.IGNORECASE)
+TABLE_CAPTION_RE = re.compile(r"^(?:Table|Tabelle)\s+([A-Z]?\.?\d{1,3}(?:\.\d{1,3})*)\b", re.IGNORECASE)
+GLOSSARY_LINE_RE = re.compile(r"^[A-ZÄÖÜ][A-ZÄÖÜ0-9\-/]{1,9}\s*(?:[-–—:]|\()\s*\S")
+TOC_LINE_RE = re.compile(r"(?:\.{3,}|…)\s*\d+\s*$")
 # ============================================================================
 # TEXT NORMALIZATION & PREPROCESSING
 # ============================================================================
@@ -105,6 +114,61 @@ class TextNormalizer:
         return result
 
 
+class StructureTracker:
+    """
+    Follows the document structure while paragraphs are read in page order and
+    classifies each one: page, section path ("15.2", "H.3"), section title,
+    table label and content type (paragraph, heading, table_row, glossary).
+    """
+
+    def __init__(self):
+        self.section: Optional[str] = None
+        self.section_title: Optional[str] = None
+        self.table: Optional[str] = None
+
+    def _heading(self, para: str) -> Optional[Tuple[str, str]]:
+        if TOC_LINE_RE.search(para):
+            return None
+        m = ANNEX_RE.match(para)
+        if m:
+            return m.group(1).upper(), (m.group(2) or "").strip()[:80]
+        m = HEADING_RE.match(para)
+        if not m:
+            return None
+        number, title = m.group(1), m.group(2).strip()
+        # bare numbers ("5 ECUs are ...") only count as heading on short lines
+        if "." not in number and len(para) > 120:
+            return None
+        return number, title[:80]
+
+    def classify(self, para: str, page: int) -> Dict:
+        content_type = "paragraph"
+        caption = TABLE_CAPTION_RE.match(para)
+        heading = None if caption else self._heading(para)
+        if heading:
+            self.section, self.section_title = heading
+            self.table = None
+            # headings are often merged with the first sentences of their body
+            content_type = "heading" if len(para) <= 80 and not para.endswith(".") else "paragraph"
+        elif caption:
+            label = caption.group(1).upper().rstrip(".")
+            self.table = re.sub(r"^([A-Z])\.?(\d)", r"\1.\2", label)
+        elif para.count("|") >= 2:
+            content_type = "table_row"
+        else:
+            self.table = None
+            if len(para) <= 300 and GLOSSARY_LINE_RE.match(para):
+                content_type = "glossary"
+        record = {"text": para, "page": page, "content_type": content_type}
+        if self.section:
+            record["section"] = self.section
+            if self.section_title:
+                record["section_title"] = self.section_title
+        if self.table and (caption or content_type == "table_row"):
+            record["table"] = self.table
+        return record
+
+
 # ============================================================================
 # ROBUST PDF EXTRACTION WITH pdfplumber FALLBACK
 # ============================================================================
@@ -128,15 +192,23 @@ class OptimizedPDFParser:
 
     async def extract_paragraphs_from_pdf(self, pdf_path: str) -> List[str]:
         """Route by OCR_ENABLED: 0 = simple (PyPDF2+pdfplumber), 1 = OCR pipeline."""
+        return [r["text"] for r in await self.extract_paragraph_records(pdf_path)]
+
+    async def extract_paragraph_records(self, pdf_path: str) -> List[Dict]:
+        """
+        Like extract_paragraphs_from_pdf, but one dict per paragraph with structure metadata:
+        {"text", "page" (1-based), "content_type", optional "section", "section_title", "table"}.
+        """
         if not OCR_ENABLED:
             return await self._extract_text_only(pdf_path)
         return await self._extract_with_ocr(pdf_path)
 
-    async def _extract_text_only(self, pdf_path: str) -> List[str]:
+    async def _extract_text_only(self, pdf_path: str) -> List[Dict]:
         """Lightweight path: extract text using PyPDF2 + pdfplumber fallback (no OCR)."""
         try:
             logger.info(f"Starte PDF-Verarbeitung (Text-only, PyPDF2+pdfplumber): {pdf_path}")
-            paragraphs: List[str] = []
+            paragraphs: List[Dict] = []
+            tracker = StructureTracker()
             
             with open(pdf_path, "rb") as f:
                 reader = PyPDF2.PdfReader(f)
@@ -164,7 +236,7 @@ class OptimizedPDFParser:
                         # Teile in Absätze und filtere
                         for para in self.normalizer.split_into_paragraphs(normalized):
                             if self._is_usable_para(para):
-                                paragraphs.append(para)
+                                paragraphs.append(tracker.classify(para, i + 1))
                     
                     except Exception as e:
                         logger.debug(f"Fehler Seite {i+1}: {e}")
@@ -217,7 +289,7 @@ class OptimizedPDFParser:
             logger.debug(f"_pdfplumber_extract Fehler: {e}")
             return ""
 
-    async def _extract_with_ocr(self, pdf_path: str) -> List[str]:
+    async def _extract_with_ocr(self, pdf_path: str) -> List[Dict]:
         """
         OCR Pipeline: mit Fallback-Strategie und Normalisierung.
         1. Versuche PyPDF2 + pdfplumber
@@ -231,7 +303,8 @@ class OptimizedPDFParser:
                 total_pages = len(reader.pages)
                 logger.info(f"PDF hat {total_pages} Seiten, OCR-Pipeline aktiv")
 
-                paragraphs: List[str] = []
+                paragraphs: List[Dict] = []
+                tracker = StructureTracker()
                 page_batch_size = max(1, _OCR_CONCURRENCY * 2)
                 
                 for start in range(0, total_pages, page_batch_size):
@@ -252,7 +325,7 @@ class OptimizedPDFParser:
                             if normalized:
                                 for para in self.normalizer.split_into_paragraphs(normalized):
                                     if self._is_usable_para(para):
-                                        paragraphs.append(para)
+                                        paragraphs.append(tracker.classify(para, batch_pages[i] + 1))
                 
                 logger.info(f"Erfolgreich {len(paragraphs)} Absätze extrahiert (OCR-Pipeline)")
                 return paragraphs
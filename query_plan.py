@@ -0,0 +1,125 @@
+# query_plan.py
+# Einmal pro Frage berechnete Anfrage-Merkmale (Normalform, Akronym, Sprache, Langantwort,
+# Embedding, Matcher). handle_message baut den Plan; retrieval, vector_store und llm_client
+# nehmen ihn statt des Rohtexts entgegen und rechnen nichts davon erneut.
+import re
+from typing import Callable, List, Optional, Tuple, Union
+
+from acronym_utils import detect_acronym
+from matchers import TermMatcher, defn_regex, term_matcher
+from scope_index import Scope, parse_scope
+
+_PUNCT_RE = re.compile(r"[^\w\s/\-]+")
+_WS_RE = re.compile(r"\s+")
+# Normnummern/Klauseln ("ISO 26262", "21434", "Clause 15.2")
+_NUMBER_RE = re.compile(r"\d+(?:[.\-/]\d+)*")
+_STANDARD_REF_RE = re.compile(r"\b(ISO|SAE|UNR|standard|norm)\s*[\d/\-]+", re.IGNORECASE)
+
+_GERMAN_WORDS = (
+    " was ", " ist ", " sind ", " sollte ", " wie ", " wann ", " warum ",
+    " worum ", " worauf ", " inwiefern ", " der ", " die ", " das ", " über ", " und ",
+)
+# Definitionsfragen ("Was ist TARA?", "Wofür steht CAL?", "What does ASIL stand for?") – nur sie
+# dürfen direkt aus dem Glossar beantwortet werden
+_DEFINITION_RE = re.compile(
+    r"\b(?:was\s+(?:ist|sind|bedeutet|bedeuten|hei(?:ß|ss)t)|wof(?:ü|ue)r\s+steht|steht\s+f(?:ü|ue)r|"
+    r"definition|definiere|bedeutung|abk(?:ü|ue)rzung|what\s+(?:is|are|does)|what's|whats|"
+    r"stands?\s+for|define|meaning\s+of|abbreviation)\b",
+    re.IGNORECASE,
+)
+_LONG_KEYS = (
+    "ausführlich", "ausfuehrlich", "erklaere", "erkläre", "erläutere",
+    "liste", "schritte", "begruendung", "begründung", "beispiele",
+    "detailliert", "worum geht es", "worum geht es in", "worum handelt es sich",
+    "was ist", "was bedeutet", "beschreibe", "beschreibung",
+    "explain", "detailed", "steps", "list", "why", "how",
+    "what is", "what's", "whats", "what does", "overview", "overview of", "describe", "description",
+)
+
+
+def normalize_query(query: str) -> str:
+    """Cache-Schlüsselform: casefold, ohne Satzzeichen, einfache Leerzeichen ("Was ist TARA?" → "was ist tara")."""
+    return _WS_RE.sub(" ", _PUNCT_RE.sub(" ", (query or "").casefold())).strip()
+
+
+def detect_language(question: str) -> str:
+    """Standard EN; wenn die Frage wie Deutsch aussieht, DE."""
+    t = f" {(question or '').casefold()} "
+    if any(w in t for w in _GERMAN_WORDS) or any(ch in (question or "") for ch in "äöüÄÖÜß"):
+        return "DE"
+    return "EN"
+
+
+def wants_long_answer(q: str) -> bool:
+    if not q:
+        return False
+    if len(q) > 100:
+        return True
+    ql = q.casefold()
+    if any(k in ql for k in _LONG_KEYS):
+        return True
+    return _STANDARD_REF_RE.search(q) is not None
+
+
+def is_definition_question(q: str) -> bool:
+    return bool(q) and _DEFINITION_RE.search(q) is not None
+
+
+def question_guard(question: str, acronym: Optional[str] = None) -> Tuple:
+    """Akronym + alle Zahlen/Normnummern – müssen zwischen "gleichen" Fragen übereinstimmen."""
+    acr = acronym if acronym is not None else detect_acronym(question or "")
+    numbers = tuple(sorted(set(_NUMBER_RE.findall(question or ""))))
+    return (acr.upper() if acr else None, numbers)
+
+
+class QueryPlan:
+    """Alle pro Frage einmal berechneten Merkmale; embedding wird bei Bedarf nachgetragen."""
+
+    __slots__ = (
+        "text", "normalized", "casefold", "acronym", "acronym_cf",
+        "lang", "want_long", "guard", "matcher", "embedding", "corrections",
+        "scope", "definition",
+    )
+
+    def __init__(
+        self,
+        question: str,
+        *,
+        lang: Optional[str] = None,
+        embedding: Optional[List[float]] = None,
+        corrections: Optional[List[Tuple[str, str]]] = None,
+    ) -> None:
+        self.text = question or ""
+        # bereits angewandte Tippfehlerkorrekturen [(Original, Korrektur)] – text ist die korrigierte Frage
+        self.corrections = list(corrections or [])
+        self.normalized = normalize_query(self.text)
+        self.casefold = self.text.casefold()
+        self.acronym = detect_acronym(self.text) if self.text else None
+        self.acronym_cf = self.acronym.casefold() if self.acronym else None
+        self.lang = (lang or detect_language(self.text)).upper()
+        self.want_long = wants_long_answer(self.text)
+        self.guard = question_guard(self.text, self.acronym or "")
+        self.matcher: Optional[TermMatcher] = term_matcher(self.acronym) if self.acronym else None
+        self.embedding = embedding
+        # Bereichsangabe ("Tabelle H.3", "Kapitel 15", "Seite 12") für die eingegrenzte Suche
+        self.scope: Optional[Scope] = parse_scope(self.text)
+        # Definitionsfrage zu einem Akronym → Glossar genügt
+        self.definition = bool(self.acronym) and is_definition_question(self.text)
+
+    @property
+    def defn_re(self) -> Optional[re.Pattern]:
+        return defn_regex(self.acronym) if self.acronym else None
+
+    def ensure_embedding(self, embed: Callable[[str], List[float]]) -> Optional[List[float]]:
+        """Embedding einmal berechnen (embed = vector_store.embed_query) und im Plan ablegen."""
+        if self.embedding is None and self.text:
+            self.embedding = embed(self.text)
+        return self.embedding
+
+    def __repr__(self) -> str:
+        return f"QueryPlan({self.text!r}, acronym={self.acronym!r}, lang={self.lang!r}, long={self.want_long})"
+
+
+def as_plan(query: Union[str, QueryPlan, None]) -> QueryPlan:
+    """Rohtext oder Plan → Plan (ältere Aufrufer übergeben weiterhin Strings)."""
+    return query if isinstance(query, QueryPlan) else QueryPlan(query or "")
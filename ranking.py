@@ -0,0 +1,116 @@
+# ranking.py
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Gewichtung Relevanz vs. Vielfalt für MMR (1.0 = reine Relevanz)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+
+def chunk_key(c: Dict) -> str:
+    return f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
+
+
+def dedup_chunks(chunks: Sequence[Dict]) -> List[Dict]:
+    """Duplikate nach chunk_id + führendem Text entfernen (linear, erste Vorkommen gewinnen)."""
+    uniq: Dict[str, Dict] = {}
+    for c in chunks:
+        uniq.setdefault(chunk_key(c), c)
+    return list(uniq.values())
+
+
+def merge_chunks(pool: Dict[str, Dict], items: Optional[Sequence[Dict]]) -> int:
+    """Neue Kandidaten in einen laufenden Pool (chunk_key → Chunk) übernehmen; Rückgabe: Anzahl neu."""
+    added = 0
+    for c in items or ():
+        key = chunk_key(c)
+        if key not in pool:
+            pool[key] = c
+            added += 1
+    return added
+
+
+def candidate_arrays(chunks: Sequence[Dict], dim: Optional[int] = None):
+    """
+    Liefert (sims[n], embs[n, d]) für eine Kandidatenliste.
+    Fehlende Embeddings (z. B. Keyword-/Glossartreffer) werden als Nullvektor geführt –
+    sie erzeugen dann keine Redundanzstrafe in der MMR.
+    """
+    sims = np.fromiter((float(c.get("similarity_score", 0.0)) for c in chunks), dtype=np.float32, count=len(chunks))
+    if dim is None:
+        dim = next((len(c["embedding"]) for c in chunks if c.get("embedding") is not None), 0)
+    embs = np.zeros((len(chunks), dim), dtype=np.float32)
+    if dim:
+        for i, c in enumerate(chunks):
+            e = c.get("embedding")
+            if e is not None and len(e) == dim:
+                embs[i] = e
+    return sims, embs
+
+
+def apply_boosts(
+    sims: np.ndarray,
+    flags: Optional[np.ndarray] = None,
+    boosts: Optional[Sequence[float]] = None,
+    *,
+    threshold: Optional[float] = None,
+    cap: Optional[float] = None,
+) -> np.ndarray:
+    """
+    scores = sims + flags @ boosts, optional gedeckelt; Kandidaten unter threshold erhalten -inf.
+    flags: bool-Matrix [n, f], boosts: [f].
+    """
+    scores = np.asarray(sims, dtype=np.float32).copy()
+    if flags is not None and boosts is not None and len(boosts):
+        scores += np.asarray(flags, dtype=np.float32) @ np.asarray(boosts, dtype=np.float32)
+    if cap is not None:
+        np.minimum(scores, cap, out=scores)
+    if threshold is not None:
+        scores[scores < threshold] = -np.inf
+    return scores
+
+
+def mmr_select(
+    scores: np.ndarray,
+    embs: Optional[np.ndarray],
+    k: int,
+    *,
+    lambda_: float = MMR_LAMBDA,
+) -> List[int]:
+    """
+    Maximal Marginal Relevance: wählt bis zu k Indizes mit hoher Relevanz und geringer
+    Ähnlichkeit zu bereits gewählten Kandidaten. Ohne Embeddings → reine Top-k-Auswahl.
+    """
+    valid = np.flatnonzero(np.isfinite(scores))
+    if k <= 0 or valid.size == 0:
+        return []
+    if embs is None or embs.size == 0 or lambda_ >= 1.0 or valid.size <= 1:
+        order = valid[np.argsort(-scores[valid], kind="stable")]
+        return order[:k].tolist()
+
+    rel = scores[valid]
+    E = embs[valid]
+    max_sim = np.zeros(valid.size, dtype=np.float32)
+    picked = np.zeros(valid.size, dtype=bool)
+    out: List[int] = []
+    for _ in range(min(k, valid.size)):
+        mmr = lambda_ * rel - (1.0 - lambda_) * max_sim
+        mmr[picked] = -np.inf
+        j = int(np.argmax(mmr))
+        picked[j] = True
+        out.append(int(valid[j]))
+        # Ähnlichkeit aller Kandidaten zum neu gewählten (Embeddings sind L2-normalisiert)
+        np.maximum(max_sim, E @ E[j], out=max_sim)
+    return out
+
+
+def rank_order(scores: np.ndarray, *primary: np.ndarray) -> np.ndarray:
+    """
+    Stabile absteigende Sortierung nach (primary..., scores) – Ersatz für sorted() mit Tupel-Keys.
+    Kandidaten mit -inf werden ausgelassen.
+    """
+    keep = np.isfinite(scores)
+    keys = [-scores] + [-np.asarray(p, dtype=np.float32) for p in reversed(primary)]
+    order = np.lexsort(keys)
+    return order[keep[order]]
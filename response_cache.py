@@ -0,0 +1,178 @@
+# response_cache.py
+# Persistenter Cache der rohen LLM-Ausgaben (vor normalize_to_html), Schlüssel = Hash aus den
+# Generierungsoptionen und den fertigen Prompts – unabhängig vom Modell, damit ein Treffer für jede
+# Modellstufe gilt; Backend und Modell der Antwort stehen in der Zeile. Formatierungsänderungen wirken
+# damit auch auf gecachte Antworten, ohne neu zu generieren. SQLite-Datei neben der Chroma-DB.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+logger = logging.getLogger("response_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    backend TEXT NOT NULL,
+    model TEXT NOT NULL,
+    raw TEXT NOT NULL,
+    usage TEXT,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses(used);
+"""
+
+
+def fingerprint(system_prompt: str, user_prompt: str, options: Mapping[str, Any]) -> str:
+    payload = json.dumps([dict(sorted(options.items())), system_prompt, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Rohe Antworten mit TTL (created) und Größenlimits (Einträge, MB; Verdrängung nach letzter
+    Nutzung). models: {backend: konfigurierte Modelle} – Einträge anderer Modelle werden beim
+    Öffnen gelöscht (Modellwechsel). max_entries=0 schaltet den Cache ab.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        ttl: float = 0.0,
+        max_entries: int = 2000,
+        max_mb: float = 64.0,
+        models: Optional[Mapping[str, Iterable[str]]] = None,
+    ) -> None:
+        self.path = path
+        self.ttl = max(0.0, float(ttl))
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = int(max(0.0, float(max_mb)) * 1024 * 1024)
+        self.models = {b: set(m) for b, m in (models or {}).items()}
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _conn(self) -> sqlite3.Connection:
+        """Verbindung beim ersten Zugriff öffnen; dabei abgelaufene und modellfremde Einträge löschen."""
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            for backend, models in self.models.items():
+                marks = ",".join("?" * len(models))
+                cur = db.execute(
+                    f"DELETE FROM responses WHERE backend = ? AND model NOT IN ({marks})", (backend, *models)
+                )
+                if cur.rowcount:
+                    logger.info("LLM cache: dropped %s entries of other %s models", cur.rowcount, backend)
+            if self.ttl:
+                db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            self._db = db
+        return self._db
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """(rohe Antwort, usage) oder None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._conn()
+                row = db.execute("SELECT raw, usage, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self.ttl and row[2] < now - self.ttl:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+            return row[0], json.loads(row[1] or "{}")
+        except Exception as e:
+            logger.warning("LLM cache lookup failed (%s): %s", self.path, e)
+            return None
+
+    def put(self, key: str, backend: str, model: str, raw: str, usage: Optional[Dict] = None) -> None:
+        if not self.enabled or not raw:
+            return
+        now = time.time()
+        size = len(raw.encode("utf-8"))
+        try:
+            with self._lock:
+                db = self._conn()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, backend, model, raw, usage, created, used, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, backend, model, raw, json.dumps(usage or {}), now, now, size),
+                )
+                self._evict(db)
+        except Exception as e:
+            logger.warning("LLM cache store failed (%s): %s", self.path, e)
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and (not self.max_bytes or total <= self.max_bytes):
+            return
+        dropped = 0
+        if count > self.max_entries:
+            # älteste Einträge in einem Statement löschen statt die Tabelle zu lesen
+            dropped += db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used LIMIT ?)",
+                (count - self.max_entries,),
+            ).rowcount
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if self.max_bytes and total > self.max_bytes:
+            # Cursor nur so weit lesen, bis genug Bytes frei werden
+            victims = []
+            for key, size in db.execute("SELECT key, size FROM responses ORDER BY used"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            db.executemany("DELETE FROM responses WHERE key = ?", victims)
+            dropped += len(victims)
+        self.evictions += dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn().execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            db, self._db = self._db, None
+            if db is not None:
+                db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        entries = size = 0
+        if self.enabled:
+            try:
+                with self._lock:
+                    entries, size = self._conn().execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                    ).fetchone()
+            except Exception as e:
+                logger.debug("LLM cache stats failed: %s", e)
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions,
+        }
@@ -1,41 +1,48 @@
 # retrieval.py
+import os
 import re
 import asyncio
 import logging
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Union
+
+import numpy as np
 
 from vector_store import vector_store
-from acronym_utils import detect_acronym  # einheitliche Logik der Akronyme
+from cache_utils import LRUCache
+from query_plan import QueryPlan, as_plan
+from token_budget import join_overlapping, merge_adjacent, pack_excerpts
+from ranking import apply_boosts, candidate_arrays, merge_chunks, mmr_select, rank_order
+from matchers import (
+    BAD_DEFN_MATCHER,
+    defn_regex,
+    expansion_regexes,
+    has_url,
+    is_short_acronym,
+    normalize_text,
+    normalized,
+    split_sentences,
+    term_matcher,
+)
 
 logger = logging.getLogger(__name__)
 
-# ------------------ Definition-Filterung (beibehalten) ------------------ #
-
-BAD_DEFN_WORDS = {
-    "foreword", "vorwort", "table of contents", "inhalt", "copyright",
-    "all rights reserved", "wto", "technical barriers to trade", "patent",
-    "feedback", "iec", "beuth", "best beuth",
-    "figure", "overview of this document", "general considerations",
-    "scope of this", "introduction", "normative references"
-}
+# Nebenläufige Suche nach Akronym-Ausschreibungen (Fan-out + Frist pro Stufe)
+EXPANSION_CONCURRENCY = int(os.getenv("EXPANSION_CONCURRENCY", "3"))
+EXPANSION_DEADLINE_S = float(os.getenv("EXPANSION_DEADLINE_S", "3.0"))
+# eingegrenzte Treffer ersetzen die globale Suche nur, wenn der beste mindestens so ähnlich ist
+# (1 / (1 + Kosinus-Distanz); 0.55 ≈ Kosinus 0.18) und das gefragte Akronym enthält
+SCOPED_MIN_SIMILARITY = float(os.getenv("SCOPED_MIN_SIMILARITY", "0.55"))
 
 # ------------------ Normalisierungshelfer ------------------ #
 
-def _normalize_text(s: str) -> str:
-    return re.sub(r"[\s\-/]+", "", s or "").casefold()
-
-
-def _is_short_acronym(term: str) -> bool:
-    return bool(re.fullmatch(r"[A-ZÄÖÜ]{2,5}", term or ""))
+_normalize_text = normalize_text
+_is_short_acronym = is_short_acronym
 
 
 def _matches_term(term: str, text: str) -> bool:
     if not term or not text:
         return False
-    if _is_short_acronym(term):
-        pat = re.compile(rf"(?<![A-Za-zÄÖÜäöüß]){re.escape(term)}(?![A-Za-zÄÖÜäöüß])")
-        return bool(pat.search(text))
-    return _normalize_text(term) in _normalize_text(text)
+    return term_matcher(term)(text)
 
 # ------------------ Автовывод развёрток для коротких акронимов ------------------ #
 
@@ -50,9 +57,7 @@ def _extract_expansions(term: str, chunks: List[Dict]) -> List[str]:
     """
     if not term or not chunks:
         return []
-    t = re.escape(term)
-    pat_right = re.compile(rf"\b{t}\b\s*[-–—:]\s*([A-Za-z][A-Za-z \-\/]{{2,60}})")
-    pat_left = re.compile(rf"([A-Za-z][A-Za-z \-\/]{{2,60}})\s*\(\s*{t}\s*\)")
+    pat_right, pat_left = expansion_regexes(term)
 
     candidates: List[str] = []
     for c in chunks:
@@ -66,7 +71,7 @@ def _extract_expansions(term: str, chunks: List[Dict]) -> List[str]:
     cleaned: List[str] = []
     for e in candidates:
         words = e.split()
-        if 1 <= len(words) <= 5 and not re.search(r"https?://", e, re.IGNORECASE):
+        if 1 <= len(words) <= 5 and not has_url(e):
             cleaned.append(e)
 
     # Уникальные регистронезависимо
@@ -81,11 +86,10 @@ def _extract_expansions(term: str, chunks: List[Dict]) -> List[str]:
 
 # ------------------ Definitionsextraktion ------------------ #
 
-def _defn_regex_for(term: str) -> re.Pattern:
-    return re.compile(
-        rf"\b{re.escape(term)}\b\s*(?:[-–—:]\s*)([^\n]{{5,200}})",
-        re.IGNORECASE,
-    )
+_defn_regex_for = defn_regex
+
+_TITLE_RE = re.compile(r"(Road\s+vehicles\s*—\s*Cybersecurity\s+engineering)", re.IGNORECASE)
+_TITLE_GENERIC_RE = re.compile(r"([A-Za-z\s]+?\s*—\s*Cybersecurity\s+engineering)", re.IGNORECASE)
 
 
 def _extract_standard_title(txt: str) -> Optional[str]:
@@ -93,19 +97,11 @@ def _extract_standard_title(txt: str) -> Optional[str]:
         return None
     t = txt.replace("–", "—").replace("-", "—")
 
-    m = re.search(
-        r"(Road\s+vehicles\s*—\s*Cybersecurity\s+engineering)",
-        t,
-        re.IGNORECASE,
-    )
+    m = _TITLE_RE.search(t)
     if m:
         return m.group(1)
 
-    m2 = re.search(
-        r"([A-Za-z\s]+?\s*—\s*Cybersecurity\s+engineering)",
-        t,
-        re.IGNORECASE,
-    )
+    m2 = _TITLE_GENERIC_RE.search(t)
     if m2 and "foreword" not in m2.group(1).casefold():
         return m2.group(1)
 
@@ -140,7 +136,7 @@ def find_definition_in_chunks(term: str, chunks: List[Dict]) -> List[Dict]:
             continue
 
         low = best_line.casefold()
-        if any(bad in low for bad in BAD_DEFN_WORDS):
+        if BAD_DEFN_MATCHER.search(low):
             continue
 
         if len(best_line) > 220:
@@ -165,45 +161,144 @@ def find_definition_in_chunks(term: str, chunks: List[Dict]) -> List[Dict]:
 
 # ------------------ Filterung nach Begriffspräsenz ------------------ #
 
-def filter_chunks_by_term(term: str, chunks: List[Dict]) -> List[Dict]:
-    if not term or not chunks:
-        return []
+_STD_RE = re.compile(r"(?i)\b(?:ISO|SAE)[\s\/-]*\d{3,6}\b")
+_CAN_RE = re.compile(r"(?i)\bCAN(?:-FD)?\b")
+_GEN_RE = re.compile(r"(?i)\b[A-Z]{2,10}(?:[\/\-]?[A-Z0-9]{1,10})+\b")
+# Boni für Standards / CAN / generische Akronyme (Reihenfolge wie die Flags in _term_scores)
+_TERM_BOOSTS = (0.08, 0.05, 0.03)
 
-    tn = _normalize_text(term)
-    std_re = re.compile(r"(?i)\b(?:ISO|SAE)[\s\/-]*\d{3,6}\b")
-    can_re = re.compile(r"(?i)\bCAN(?:-FD)?\b")
-    gen_re = re.compile(r"(?i)\b[A-Z]{2,10}(?:[\/\-]?[A-Z0-9]{1,10})+\b")
 
-    scored = []
-    for c in chunks:
+def _term_scores(term: str, chunks: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """(Maske "Begriff enthalten", geboostete Scores) für alle Kandidaten – vektorisiert."""
+    tn = _normalize_text(term)
+    n = len(chunks)
+    mask = np.zeros(n, dtype=bool)
+    flags = np.zeros((n, len(_TERM_BOOSTS)), dtype=bool)
+    for i, c in enumerate(chunks):
         txt = c.get("text", "") or ""
-        if tn not in _normalize_text(txt):
+        if tn not in normalized(txt):
             continue
+        mask[i] = True
+        flags[i] = (bool(_STD_RE.search(txt)), bool(_CAN_RE.search(txt)), bool(_GEN_RE.search(txt)))
+    sims, _ = candidate_arrays(chunks, dim=0)
+    return mask, apply_boosts(sims, flags, _TERM_BOOSTS)
+
 
-        score = float(c.get("similarity_score", 0.0))
-        if std_re.search(txt):
-            score += 0.08
-        if can_re.search(txt):
-            score += 0.05
-        if gen_re.search(txt):
-            score += 0.03
+def filter_chunks_by_term(term: str, chunks: List[Dict]) -> List[Dict]:
+    if not term or not chunks:
+        return []
+    mask, scores = _term_scores(term, chunks)
+    order = rank_order(np.where(mask, scores, -np.inf))
+    return [chunks[i] for i in order]
 
-        scored.append((c, score))
 
-    scored.sort(key=lambda x: x[1], reverse=True)
-    return [c for c, _ in scored]
+def select_diverse(chunks: List[Dict], k: int, scores: Optional[np.ndarray] = None) -> List[Dict]:
+    """
+    Finale Auswahl von k Chunks per MMR: hohe Relevanz, aber keine fast identischen
+    (überlappenden) Abschnitte – spart Tokens im LLM-Prompt.
+    """
+    if not chunks:
+        return []
+    sims, embs = candidate_arrays(chunks)
+    idx = mmr_select(sims if scores is None else scores, embs, k)
+    return [chunks[i] for i in idx]
 
 # ------------------ Haupt-Chunk-Auswahl ------------------ #
 
-async def get_best_chunks_for_document(query: str, doc_id: str, max_chunks: int = 4):
+# ------------------ Retrieval-Cache ------------------ #
+
+def _chunks_sizeof(chunks: List[Dict]) -> int:
+    size = 64
+    for c in chunks or []:
+        emb = c.get("embedding")
+        size += 200 + len(c.get("text") or "") + (4 * len(emb) if emb is not None else 0)
+    return size
+
+
+retrieval_cache = LRUCache(
+    int(os.getenv("RETRIEVAL_CACHE_SIZE", "512")),
+    max_bytes=int(float(os.getenv("RETRIEVAL_CACHE_MB", "32")) * 1024 * 1024),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "3600")),
+    sizeof=_chunks_sizeof,
+    name="retrieval",
+)
+
+
+def _cache_key(kind: str, plan: QueryPlan, scope: str, max_chunks: int) -> Tuple:
+    # Akronym im Schlüssel: Anfragen mit unterschiedlicher Begriffserkennung nie zusammenlegen
+    return (kind, scope, plan.normalized, plan.acronym, max_chunks, vector_store.generation)
+
+
+def retrieval_cache_stats() -> Dict:
+    return retrieval_cache.stats()
+
+
+async def get_best_chunks_for_document(query: Union[str, QueryPlan], doc_id: str, max_chunks: int = 4):
+    plan = as_plan(query)
+    key = _cache_key("doc", plan, doc_id, max_chunks)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    result = await _best_chunks_for_document(plan, doc_id, max_chunks)
+    if result:  # leere Ergebnisse (evtl. verschluckter Chroma-Fehler) nicht für die ganze TTL merken
+        retrieval_cache.put(key, list(result))
+    return result
+
+
+async def get_best_chunks_global(query: Union[str, QueryPlan], max_chunks: int = 12) -> List[Dict]:
+    plan = as_plan(query)
+    key = _cache_key("global", plan, "*", max_chunks)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    result = await _best_chunks_global(plan, max_chunks)
+    if result:
+        retrieval_cache.put(key, list(result))
+    return result
+
+
+async def get_best_chunks_scoped(
+    query: Union[str, QueryPlan], max_chunks: int = 12, doc_ids: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    Eingegrenzte Suche ("Tabelle H.3", "Kapitel 15", "Seite 12"): Kandidaten kommen aus den
+    Metadaten-Indizes statt aus der ganzen Sammlung. [] ohne Bereichsangabe oder ohne Treffer.
+    """
+    plan = as_plan(query)
+    if not plan.scope:
+        return []
+    scope_key = (plan.scope.key(), tuple(doc_ids) if doc_ids is not None else "*")
+    key = _cache_key("scoped", plan, scope_key, max_chunks)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
     try:
-        base = await asyncio.to_thread(
-            vector_store.search_in_document,
-            query,
-            doc_id,
-            n_results=max_chunks * 3,
-        )
-        chunks = base or []
+        result = await asyncio.to_thread(vector_store.search_scoped, plan, plan.scope, max_chunks, doc_ids)
+    except Exception as e:
+        logger.debug("Scoped retrieval error: %s", e)
+        return []
+    if result:
+        retrieval_cache.put(key, list(result))
+    return result
+
+
+def scoped_hits_sufficient(query: Union[str, QueryPlan], chunks: List[Dict]) -> bool:
+    """Reichen die eingegrenzten Treffer allein? Sonst werden sie mit der globalen Suche gemischt."""
+    if not chunks:
+        return False
+    plan = as_plan(query)
+    if max(float(c.get("similarity_score") or 0.0) for c in chunks) < SCOPED_MIN_SIMILARITY:
+        return False
+    # reine Zahlen ("Kapitel 15" → "15") sind Teil der Bereichsangabe, kein gefragter Begriff
+    if plan.matcher is None or not any(ch.isalpha() for ch in plan.acronym):
+        return True
+    return any(plan.matcher(c.get("text") or "", cached=True) for c in chunks)
+
+
+async def _best_chunks_for_document(plan: QueryPlan, doc_id: str, max_chunks: int = 4):
+    try:
+        cursor = await asyncio.to_thread(vector_store.open_cursor, plan, doc_id)
+        chunks = await asyncio.to_thread(cursor.fetch_until, max_chunks * 3)
     except Exception as e:
         logger.debug("Error fetching base chunks: %s", e)
         chunks = []
@@ -211,175 +306,252 @@ async def get_best_chunks_for_document(query: str, doc_id: str, max_chunks: int
     if not chunks:
         return []
 
-    term = detect_acronym(query)
+    term = plan.acronym
 
-    # Erweiterung des Fensters nur bei wenigen eindeutigen Ergebnissen (<5)
+    # Erweiterung des Fensters nur bei wenigen eindeutigen Ergebnissen (<5):
+    # derselbe Cursor liest nur die zusätzlichen Ränge (kein erneutes Einbetten/Deduplizieren)
     try:
-        seen0 = set()
-        uniq0 = []
-        for c in chunks:
-            key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-            if key in seen0:
-                continue
-            seen0.add(key)
-            uniq0.append(c)
-
-        if len(uniq0) < 5:
-            extra = await asyncio.to_thread(
-                vector_store.search_in_document,
-                query, doc_id,
-                n_results=max_chunks * 10
-            )
-            if extra:
-                chunks.extend(extra)
-
-        # erneute Überprüfung
-        seen1 = set()
-        uniq1 = []
-        for c in chunks:
-            key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-            if key in seen1:
-                continue
-            seen1.add(key)
-            uniq1.append(c)
-
-        if len(uniq1) < 5:
-            extra = await asyncio.to_thread(
-                vector_store.search_in_document,
-                query, doc_id,
-                n_results=max_chunks * 30
-            )
-            if extra:
-                chunks.extend(extra)
-
-        # erneute Überprüfung
-        seen = set()
-        uniq = []
-        for c in chunks:
-            key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-            if key in seen:
-                continue
-            seen.add(key)
-            uniq.append(c)
+        for total in (max_chunks * 10, max_chunks * 30):
+            if len(chunks) >= 5 or cursor.exhausted:
+                break
+            chunks.extend(await asyncio.to_thread(cursor.fetch_until, total))
 
-        chunks = sorted(uniq, key=lambda x: x["similarity_score"], reverse=True)
+        chunks = _sort_by_similarity(chunks)
 
     except Exception:
         pass
 
+    return _select_for_term(term, chunks, max_chunks)
+
+
+def _sort_by_similarity(chunks: List[Dict]) -> List[Dict]:
+    sims, _ = candidate_arrays(chunks, dim=0)
+    return [chunks[i] for i in np.argsort(-sims, kind="stable")]
+
+
+def _select_for_term(term: Optional[str], chunks: List[Dict], max_chunks: int) -> List[Dict]:
+    """Definition zuerst, dann Chunks mit dem Begriff, sonst alle – jeweils MMR-diversifiziert."""
     if term:
         defs = find_definition_in_chunks(term, chunks)
         if defs:
             return defs[:max_chunks]
 
-        hits = filter_chunks_by_term(term, chunks)
-        if hits:
-            return hits[:max_chunks]
+        mask, scores = _term_scores(term, chunks)
+        if mask.any():
+            return select_diverse(chunks, max_chunks, np.where(mask, scores, -np.inf))
 
-    return chunks[:max_chunks]
+    return select_diverse(chunks, max_chunks)
 
 # ------------------ globale Chunk-Auswahl ------------------ #
 
-async def get_best_chunks_global(query: str, max_chunks: int = 12) -> List[Dict]:
+def lookup_glossary_chunks(query: Union[str, QueryPlan], max_chunks: int = 12) -> List[Dict]:
+    """Definitionen aus dem beim Indexieren aufgebauten Glossar (ohne Vektorsuche)."""
+    term = as_plan(query).acronym
+    if not term:
+        return []
     try:
-        # Initialer Durchgang
-        base = await asyncio.to_thread(
-            vector_store.search_global,
-            query,
-            n_results=max_chunks * 6,
-        )
-        chunks = base or []
+        return vector_store.lookup_glossary(term, limit=max_chunks)
+    except Exception as e:
+        logger.debug("glossary lookup warn: %s", e)
+        return []
+
+
+async def _search_expansions(
+    expansions: List[str],
+    pool: Dict[str, Dict],
+    *,
+    n_results: int,
+    enough: int,
+) -> None:
+    """
+    Sucht die Ausschreibungen eines Akronyms nebenläufig (höchstens EXPANSION_CONCURRENCY
+    gleichzeitig) und übernimmt die Treffer in den Pool, sobald sie eintreffen.
+    Nach EXPANSION_DEADLINE_S oder sobald `enough` eindeutige Kandidaten vorliegen, wird keine
+    weitere Chroma-Abfrage mehr gestartet. Laufende Abfragen lassen sich im Thread nicht abbrechen;
+    sie werden nur nicht mehr abgewartet – höchstens EXPANSION_CONCURRENCY laufen noch zu Ende.
+    """
+    sema = asyncio.Semaphore(max(1, EXPANSION_CONCURRENCY))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + EXPANSION_DEADLINE_S
+
+    async def _one(expq: str) -> List[Dict]:
+        async with sema:
+            if loop.time() >= deadline or len(pool) >= enough:
+                return []
+            return await asyncio.to_thread(vector_store.search_global, expq, n_results=n_results)
+
+    tasks = [asyncio.create_task(_one(q)) for q in expansions]
+    done = 0
+    try:
+        for fut in asyncio.as_completed(tasks, timeout=max(0.0, deadline - loop.time())):
+            try:
+                merge_chunks(pool, await fut)
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                logger.debug("expansion query warn: %s", e)
+            done += 1
+            if len(pool) >= enough:
+                break
+    except asyncio.TimeoutError:
+        logger.debug("expansion deadline reached after %d/%d sub-queries", done, len(tasks))
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        # abgebrochene Tasks einsammeln, damit keine "exception was never retrieved"-Warnungen entstehen
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _best_chunks_global(plan: QueryPlan, max_chunks: int = 12) -> List[Dict]:
+    # Glossar zuerst: Definitionsfragen brauchen kein Widening; sonst werden die Treffer nur beigemischt
+    glossary_hits = lookup_glossary_chunks(plan, max_chunks)
+    if glossary_hits and plan.definition:
+        return glossary_hits
+
+    pool: Dict[str, Dict] = {}
+    try:
+        # Initialer Durchgang (Anfrage wird einmal eingebettet; Widening liest denselben Cursor weiter)
+        cursor = await asyncio.to_thread(vector_store.open_cursor, plan)
+        merge_chunks(pool, await asyncio.to_thread(cursor.fetch_until, max_chunks * 6))
 
         # Жёсткий лексический проход по кратким акронимам: гарантируем присутствие явных совпадений
-        term0 = detect_acronym(query)
+        term0 = plan.acronym
         if term0 and len(term0) <= 5:
             try:
                 kw = await asyncio.to_thread(vector_store.search_keyword, term0, max(max_chunks * 6, 50), False)
-                if kw:
-                    chunks.extend(kw)
+                merge_chunks(pool, kw)
             except Exception as e:
                 logger.debug("keyword scan warn: %s", e)
 
         # Авто-расширение для коротких акронимов: дополнительные запросы по извлечённым развёрткам
-        if term0 and len(term0) <= 5 and chunks:
+        if term0 and len(term0) <= 5 and pool:
             try:
-                expansions = _extract_expansions(term0, chunks[:30])
+                expansions = _extract_expansions(term0, list(pool.values())[:30])
                 if expansions:
-                    for expq in expansions:
-                        extra_e = await asyncio.to_thread(
-                            vector_store.search_global,
-                            expq,
-                            n_results=max(max_chunks * 6, 30),
-                        )
-                        if extra_e:
-                            chunks.extend(extra_e)
+                    await _search_expansions(
+                        expansions,
+                        pool,
+                        n_results=max(max_chunks * 2, 20),  # Ergänzung: kleinere Abfragen, kürzere Threads
+                        enough=max_chunks * 3,
+                    )
             except Exception as e:
                 logger.debug("Auto-expansion warn: %s", e)
 
-        # Progressives Widening für große Korpora
-        def _uniq_len(items: List[Dict]) -> int:
-            seen = set()
-            for c in items:
-                key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-                if key not in seen:
-                    seen.add(key)
-            return len(seen)
-
-        if _uniq_len(chunks) < max_chunks * 3:
-            extra1 = await asyncio.to_thread(
-                vector_store.search_global,
-                query,
-                n_results=max(max_chunks * 20, 200),
-            )
-            if extra1:
-                chunks.extend(extra1)
-
-        if _uniq_len(chunks) < max_chunks * 3:
-            extra2 = await asyncio.to_thread(
-                vector_store.search_global,
-                query,
-                n_results=max(max_chunks * 40, 400),
-            )
-            if extra2:
-                chunks.extend(extra2)
+        # Progressives Widening für große Korpora: nur die zusätzlichen Ränge nachladen
+        for total in (max(max_chunks * 20, 200), max(max_chunks * 40, 400)):
+            if len(pool) >= max_chunks * 3 or cursor.exhausted:
+                break
+            merge_chunks(pool, await asyncio.to_thread(cursor.fetch_until, total))
 
     except Exception as e:
         logger.debug("Error fetching global chunks: %s", e)
-        chunks = []
 
-    if not chunks:
-        return []
+    if not pool:
+        return glossary_hits
 
-    # Duplizieren nach chunk_id + führendem Text entfernen
-    seen = set()
-    uniq: List[Dict] = []
-    for c in chunks:
-        key = f"{c.get('chunk_id')}|{(c.get('text') or '')[:64]}"
-        if key in seen:
-            continue
-        seen.add(key)
-        uniq.append(c)
+    chunks = _sort_by_similarity(list(pool.values()))
 
-    chunks = sorted(uniq, key=lambda x: x.get("similarity_score", 0.0), reverse=True)
+    return _merge_glossary(glossary_hits, _select_for_term(plan.acronym, chunks, max_chunks), max_chunks)
 
-    term = detect_acronym(query)
-    if term:
-        defs = find_definition_in_chunks(term, chunks)
-        if defs:
-            return defs[:max_chunks]
-        hits = filter_chunks_by_term(term, chunks)
-        if hits:
-            return hits[:max_chunks]
 
-    return chunks[:max_chunks]
+def _merge_glossary(glossary_hits: List[Dict], chunks: List[Dict], max_chunks: int) -> List[Dict]:
+    """Glossarzeilen vor die Vektortreffer stellen, sofern ihr Quell-Chunk nicht schon ausgewählt ist."""
+    selected = {c.get("chunk_id") for c in chunks}
+    extra = [g for g in glossary_hits if g.get("chunk_id") not in selected][:max(1, max_chunks // 4)]
+    if not extra:
+        return chunks
+    return extra + chunks[:max(0, max_chunks - len(extra))]
+
+# ------------------ Nachbar-Chunks ------------------ #
+
+# Chunk-IDs sind "<hash>_chunk_<i>" (vector_store.add_chunks) → Nachbarn ohne Vektoranfrage adressierbar
+NEIGHBOUR_K = int(os.getenv("NEIGHBOUR_K", "1"))
+NEIGHBOUR_TOP = int(os.getenv("NEIGHBOUR_TOP", "4"))
+_CHUNK_ID_RE = re.compile(r"^(?P<prefix>.+_chunk_)(?P<idx>\d+)$")
+
+
+def _neighbour_ids(c: Dict, k: int) -> Dict[int, str]:
+    m = _CHUNK_ID_RE.match(c.get("chunk_id") or "")
+    if not m:
+        return {}
+    idx = int(m["idx"])
+    total = (c.get("metadata") or {}).get("total_chunks")
+    return {
+        j: f"{m['prefix']}{j}"
+        for j in range(max(0, idx - k), idx + k + 1)
+        if j != idx and (not total or j < int(total))
+    }
+
+
+async def expand_neighbours(chunks: List[Dict], k: int = NEIGHBOUR_K, top: int = NEIGHBOUR_TOP) -> List[Dict]:
+    """
+    Ergänzt die besten `top` Treffer um die Chunks i±k (direkter ID-Lookup, ein Batch, gecacht)
+    und führt sie zu zusammenhängenden Auszügen zusammen ("span": (erster, letzter chunk_index)).
+    Chunks, die bereits in einem Span stecken, entfallen; Reihenfolge und Scores bleiben.
+    """
+    if k <= 0 or top <= 0 or not chunks:
+        return chunks
+    heads = [
+        c for c in chunks[:top]
+        if not c.get("glossary") and c.get("doc_id") and c.get("chunk_index") is not None
+    ]
+    wanted = sorted({cid for c in heads for cid in _neighbour_ids(c, k).values()})
+    if not wanted:
+        return chunks
+    try:
+        found = await asyncio.to_thread(vector_store.get_chunks_by_ids, wanted)
+    except Exception as e:
+        logger.debug("Neighbour lookup error: %s", e)
+        return chunks
+
+    covered: Dict[str, set] = {}
+    out: List[Dict] = []
+    for c in chunks:
+        doc, idx = c.get("doc_id"), c.get("chunk_index")
+        cov = covered.setdefault(doc or "", set())
+        if doc and idx in cov:
+            continue
+        if not any(c is h for h in heads):
+            out.append(c)
+            continue
+        near = {j: found.get(cid) for j, cid in _neighbour_ids(c, k).items()}
+        lo = hi = idx
+        while near.get(lo - 1) is not None and lo - 1 not in cov:
+            lo -= 1
+        while near.get(hi + 1) is not None and hi + 1 not in cov:
+            hi += 1
+        cov.update(range(lo, hi + 1))
+        if lo == hi:
+            out.append(c)
+            continue
+        text = c.get("text") or ""
+        for j in range(idx - 1, lo - 1, -1):
+            text = join_overlapping(near[j]["text"], text)
+        for j in range(idx + 1, hi + 1):
+            text = join_overlapping(text, near[j]["text"])
+        out.append({**c, "text": text, "span": (lo, hi)})
+    return out
 
 # ------------------ LLM Ausschnitte ------------------ #
 
-def build_combined_excerpts(chunks: List[Dict]) -> str:
+_SKIP_LINE_RE = re.compile(r"^(figure|clause|overview|annex)\b", re.IGNORECASE)
+_TABLE_LINE_RE = re.compile(r"^(table|tabelle)\b", re.IGNORECASE)
+# (?i:ISO|SAE) | Akronym (case-sensitiv) | Ziffer – eine Suche statt drei
+_KEEP_LINE_RE = re.compile(r"\b(?i:ISO|SAE)\b|\b[A-Z]{2,10}\b|\d")
+_HEADING_RE = re.compile(r"^\d+(\.\d+)*\s+[A-Z]")
+
+
+def build_combined_excerpts(chunks: List[Dict], max_tokens: Optional[int] = None) -> str:
+    """
+    Bereinigte Auszüge als "EXCERPT i:"-Block für den Prompt.
+    max_tokens=None: feste 800 Zeichen je Auszug (alt). Mit max_tokens werden benachbarte Chunks
+    zusammengeführt, nach Score priorisiert und in das Tokenbudget gepackt (token_budget.pack_excerpts).
+    """
     if not chunks:
         return ""
 
-    def _sanitize(t: str) -> str:
+    def _sanitize(t: str, cap: Optional[int] = 800) -> str:
         if not t:
             return ""
         lines = []
@@ -389,22 +561,18 @@ def build_combined_excerpts(chunks: List[Dict]) -> str:
                 continue
 
             # skip "figure/clause/annex/overview", but NOT table/tabelle
-            if re.match(r"^(figure|clause|overview|annex)\b", s, re.IGNORECASE):
+            if _SKIP_LINE_RE.match(s):
                 continue
             # If this is a table row in Markdown or similar, save it.
-            if "|" in s or re.match(r"^(table|tabelle)\b", s, re.IGNORECASE):
+            if "|" in s or _TABLE_LINE_RE.match(s):
                 lines.append(s)
                 continue
             #
-            if (
-                re.search(r"\b(ISO|SAE)\b", s, re.IGNORECASE)
-                or re.search(r"\b[A-Z]{2,10}\b", s)
-                or re.search(r"\d", s)
-            ):
+            if _KEEP_LINE_RE.search(s):
                 lines.append(s)
                 continue
 
-            if re.match(r"^\d+(\.\d+)*\s+[A-Z]", s):
+            if _HEADING_RE.match(s):
                 continue
             if len(s.split()) <= 2:
                 continue
@@ -421,7 +589,21 @@ def build_combined_excerpts(chunks: List[Dict]) -> str:
                 out.append(s)
 
         text = " ".join(out)
-        return text[:800] + "…" if len(text) > 800 else text
+        return text[:cap] + "…" if cap and len(text) > cap else text
+
+    if max_tokens is not None:
+        spans = merge_adjacent(chunks)
+        spans.sort(key=lambda c: float(c.get("similarity_score", 0.0)), reverse=True)
+        texts = [x for x in (_sanitize(c.get("text", ""), None) for c in spans) if x]
+        if not texts:
+            texts = [(c.get("text") or "").strip() for c in spans[:6] if (c.get("text") or "").strip()]
+        packed, stats = pack_excerpts(texts, max_tokens)
+        logger.info(
+            "context packed: %s chunks → %s spans → %s excerpts, %s/%s tokens (truncated=%s, dropped=%s)",
+            len(chunks), len(spans), stats["excerpts"], stats["tokens"], max_tokens,
+            stats["truncated"], stats["dropped"],
+        )
+        return packed
 
     cleaned = [_sanitize(c.get("text", "")) for c in chunks]
     cleaned = [x for x in cleaned if x]
@@ -449,22 +631,22 @@ def find_chunk_with_term(term: str, chunks: List[Dict]) -> Optional[str]:
     """
     if not term or not chunks:
         return None
+    matches = term_matcher(term)
     for c in chunks:
         txt = (c.get("text") or "").strip()
         if not txt:
             continue
-        if not _matches_term(term, txt):
+        if not matches(txt, cached=True):
             continue
         for line in txt.splitlines():
             s = line.strip()
             if not s:
                 continue
-            if _matches_term(term, s) and 20 <= len(s) <= 220:
+            if 20 <= len(s) <= 220 and matches(s):
                 return s
-        parts = re.split(r"(?<=[\.\!\?])\s+", txt)
-        for sent in parts:
+        for sent in split_sentences(txt):
             s = sent.strip()
-            if _matches_term(term, s) and 20 <= len(s) <= 220:
+            if 20 <= len(s) <= 220 and matches(s):
                 return s
         return (txt[:220] + "…") if len(txt) > 220 else txt
     return None
\ No newline at end of file
@@ -0,0 +1,181 @@
+# scope_index.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Anfragen mit Bereichsangabe: "Seite 12", "S. 10-12", "Kapitel 15", "Abschnitt 8.4", "Anhang H", "Tabelle H.3"
+_PAGES_RE = re.compile(
+    r"\b(?:seiten?|pages?|pp?\.|s\.)\s*(\d{1,4})(?:\s*(?:-|–|bis|to)\s*(\d{1,4}))?", re.IGNORECASE
+)
+_SECTION_RE = re.compile(
+    r"\b(?:kapitel|abschnitt|klausel|ziffer|clause|section|chapter)\s+(\d{1,2}(?:\.\d{1,3})*|[A-Z](?:\.\d{1,3})+)\b",
+    re.IGNORECASE,
+)
+_ANNEX_RE = re.compile(r"\b(?:annex|anhang)\s+([A-Z])\b", re.IGNORECASE)
+_TABLE_RE = re.compile(r"\b(?:tabelle|table|tab\.)\s*([A-Z]?\.?\d{1,3}(?:\.\d{1,3})*)\b", re.IGNORECASE)
+
+
+def normalize_label(label: str) -> str:
+    """ "h.3" / "H3" / "H.3" → "H.3"; "15.2" bleibt."""
+    s = (label or "").strip().upper().rstrip(".")
+    m = re.fullmatch(r"([A-Z])\.?(\d.*)", s)
+    return f"{m.group(1)}.{m.group(2)}" if m else s
+
+
+class Scope:
+    """Eingrenzung einer Anfrage auf Seiten, Abschnitt (inkl. Unterabschnitte), Tabelle oder Inhaltstyp."""
+
+    __slots__ = ("pages", "section", "table", "content_types")
+
+    def __init__(
+        self,
+        pages: Optional[Tuple[int, int]] = None,
+        section: Optional[str] = None,
+        table: Optional[str] = None,
+        content_types: Sequence[str] = (),
+    ) -> None:
+        self.pages = pages
+        self.section = normalize_label(section) if section else None
+        self.table = normalize_label(table) if table else None
+        self.content_types = tuple(sorted(set(content_types)))
+
+    def __bool__(self) -> bool:
+        return bool(self.pages or self.section or self.table or self.content_types)
+
+    def key(self) -> Tuple:
+        return (self.pages, self.section, self.table, self.content_types)
+
+    def __repr__(self) -> str:
+        return f"Scope(pages={self.pages}, section={self.section!r}, table={self.table!r}, types={self.content_types})"
+
+
+def parse_scope(question: str) -> Optional[Scope]:
+    """Bereichsangaben aus der Frage lesen; None, wenn die Frage nicht eingegrenzt ist."""
+    q = question or ""
+    pages = section = table = None
+    m = _PAGES_RE.search(q)
+    if m:
+        lo = int(m.group(1))
+        hi = int(m.group(2) or lo)
+        pages = (min(lo, hi), max(lo, hi))
+    m = _SECTION_RE.search(q) or _ANNEX_RE.search(q)
+    if m:
+        section = m.group(1)
+    m = _TABLE_RE.search(q)
+    if m:
+        table = m.group(1)
+    # nur ausdrückliche Bezeichner zählen: das bloße Wort "Tabelle" ("table of contents",
+    # "laut Tabelle") grenzt nicht ein
+    scope = Scope(pages, section, table)
+    return scope if scope else None
+
+
+class ScopeIndex:
+    """
+    Metadaten-Indizes pro Dokument (Seite, Abschnitt, Tabelle, Inhaltstyp → chunk_index),
+    beim Indexieren aus den Chunk-Metadaten aufgebaut. candidate_ids() grenzt eine Anfrage
+    vor der Ähnlichkeitsberechnung auf wenige Chunks ein. Persistiert als JSON neben der Chroma-DB.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict] = {}
+        self._load()
+
+    # ---- Persistenz ---------------------------------------------------------
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            self._docs = dict(data.get("docs") or {})
+        except FileNotFoundError:
+            self._docs = {}
+        except Exception as e:
+            logger.warning("scope index load failed (%s): %s", self.path, e)
+            self._docs = {}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "docs": self._docs}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning("scope index save failed (%s): %s", self.path, e)
+
+    # ---- public API ---------------------------------------------------------
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def set_document(self, doc_id: str, metadatas: Iterable[Dict]) -> int:
+        """metadatas: Chunk-Metadaten (chunk_id, chunk_index, page, section, table, content_type)."""
+        entry: Dict = {"prefix": "", "pages": {}, "sections": {}, "tables": {}, "types": {}}
+        for meta in metadatas:
+            meta = meta or {}
+            idx = int(meta.get("chunk_index", 0))
+            if not entry["prefix"] and "_chunk_" in str(meta.get("chunk_id", "")):
+                entry["prefix"] = str(meta["chunk_id"]).rsplit("_chunk_", 1)[0]
+            for field, key in (("pages", "page"), ("sections", "section"), ("tables", "table"), ("types", "content_type")):
+                value = meta.get(key)
+                if value not in (None, ""):
+                    entry[field].setdefault(str(value), []).append(idx)
+        with self._lock:
+            self._docs[doc_id] = entry
+            self._save()
+        return sum(len(entry[f]) for f in ("pages", "sections", "tables", "types"))
+
+    def remove_document(self, doc_id: str) -> None:
+        with self._lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs = {}
+            self._save()
+
+    @staticmethod
+    def _select(entry: Dict, scope: Scope) -> Optional[Set[int]]:
+        """Schnittmenge der Kriterien; None = Dokument kennt ein Kriterium gar nicht."""
+        selected: Optional[Set[int]] = None
+
+        def narrow(rows: Set[int]) -> None:
+            nonlocal selected
+            selected = rows if selected is None else selected & rows
+
+        if scope.pages:
+            lo, hi = scope.pages
+            narrow({i for p, rows in entry["pages"].items() if lo <= int(p) <= hi for i in rows})
+        if scope.section:
+            s = scope.section
+            narrow({i for name, rows in entry["sections"].items() if name == s or name.startswith(s + ".") for i in rows})
+        if scope.table:
+            narrow(set(entry["tables"].get(scope.table, ())))
+        if scope.content_types:
+            narrow({i for t in scope.content_types for i in entry["types"].get(t, ())})
+        return selected
+
+    def candidate_ids(self, scope: Scope, doc_ids: Optional[Sequence[str]] = None) -> List[str]:
+        """Chunk-IDs aller Dokumente (bzw. doc_ids), die in den Bereich fallen."""
+        out: List[str] = []
+        docs = self._docs
+        for doc_id in (doc_ids if doc_ids is not None else sorted(docs)):
+            entry = docs.get(doc_id)
+            if not entry or not entry.get("prefix"):
+                continue
+            rows = self._select(entry, scope)
+            if rows:
+                out.extend(f"{entry['prefix']}_chunk_{i}" for i in sorted(rows))
+        return out
+
+    def __len__(self) -> int:
+        return len(self._docs)
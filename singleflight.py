@@ -0,0 +1,107 @@
+# singleflight.py
+# Zusammenlegen gleichzeitiger, identischer LLM-Anfragen (gleicher Prompt-Fingerprint): der erste
+# Aufrufer startet die Generierung als eigenen Task, alle weiteren warten auf dasselbe Ergebnis bzw.
+# lesen denselben Stream mit (ab dem ersten Stück). Bricht ein Wartender ab, läuft die Generierung
+# für die übrigen weiter; erst wenn niemand mehr wartet, wird sie abgebrochen.
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("singleflight")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "pieces", "event")
+
+    def __init__(self) -> None:
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.pieces: List[str] = []
+        self.event = asyncio.Event()
+
+
+class SingleFlight:
+    """
+    do(key, fn): Ergebnis einer Coroutine teilen; stream(key, fn): Textstücke eines Async-Generators
+    teilen. Zähler: leaders (gestartete Generierungen), coalesced (angehängte Aufrufer),
+    abandoned (abgebrochen, weil kein Aufrufer mehr wartete).
+    """
+
+    def __init__(self, name: str = "llm") -> None:
+        self.name = name
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def _join(self, flights: Dict[str, _Flight], key: str, start: Callable[[_Flight], Awaitable[Any]]) -> _Flight:
+        flight = flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(start(flight))
+
+            def _done(_task, key=key, flight=flight) -> None:
+                if flights.get(key) is flight:
+                    del flights[key]
+                flight.event.set()
+
+            flight.task.add_done_callback(_done)
+            flights[key] = flight
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.info("%s: joined in-flight request (%s waiting)", self.name, flight.waiters + 1)
+        flight.waiters += 1
+        return flight
+
+    def _leave(self, flights: Dict[str, _Flight], key: str, flight: _Flight) -> None:
+        flight.waiters -= 1
+        if flight.waiters <= 0 and not flight.task.done():
+            # letzter Interessent weg → Generierung abbrechen (schließt die HTTP-Verbindung)
+            if flights.get(key) is flight:
+                del flights[key]
+            flight.task.cancel()
+            self.abandoned += 1
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._join(self._calls, key, lambda _f: fn())
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(self._calls, key, flight)
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        async def pump(flight: _Flight) -> None:
+            async for piece in fn():
+                flight.pieces.append(piece)
+                event, flight.event = flight.event, asyncio.Event()
+                event.set()
+
+        flight = self._join(self._streams, key, pump)
+        i = 0
+        try:
+            while True:
+                event = flight.event
+                while i < len(flight.pieces):
+                    yield flight.pieces[i]
+                    i += 1
+                if flight.task.done():
+                    if i < len(flight.pieces):
+                        continue
+                    flight.task.result()  # Fehler der Generierung an alle weitergeben
+                    return
+                await event.wait()
+        finally:
+            self._leave(self._streams, key, flight)
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight(),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
@@ -0,0 +1,170 @@
+# spell_index.py
+# Tippfehlerkorrektur der Anfrage vor dem Retrieval ("TRAA" → "TARA", "ISO 21343" → "ISO 21434").
+# SymSpell-Verfahren: Für jedes Korpuswort werden alle Varianten mit bis zu max_distance
+# gelöschten Zeichen vorab berechnet; eine Anfrage erzeugt nur ihre eigenen Löschvarianten und
+# findet Kandidaten per Dict-Lookup, geprüft mit der Damerau-Levenshtein-Distanz (OSA).
+import os
+import re
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from acronym_utils import ACRONYM_STOP
+
+SPELL_CORRECTION = os.getenv("SPELL_CORRECTION", "1") == "1"
+# Wörter, die seltener im Korpus vorkommen, werden nicht als Korrekturziel vorgeschlagen
+SPELL_MIN_COUNT = int(os.getenv("SPELL_MIN_COUNT", "2"))
+
+_TOKEN_RE = re.compile(r"\b[A-Za-zÄÖÜäöüß0-9\-/]{2,20}\b")
+
+
+def osa_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein (Optimal String Alignment); > max_distance → max_distance + 1."""
+    if a == b:
+        return 0
+    la, lb = len(a), len(b)
+    if abs(la - lb) > max_distance:
+        return max_distance + 1
+    prev2: List[int] = []
+    prev = list(range(lb + 1))
+    for i in range(1, la + 1):
+        cur = [i] + [0] * lb
+        row_min = i
+        for j in range(1, lb + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                v = min(v, prev2[j - 2] + 1)
+            cur[j] = v
+            row_min = min(row_min, v)
+        if row_min > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return min(prev[lb], max_distance + 1)
+
+
+class SpellIndex:
+    """Löschnachbarschaften (bis max_distance) der ersten prefix_length Zeichen jedes Worts."""
+
+    def __init__(self, words: Mapping[str, int], max_distance: int = 2, prefix_length: int = 7) -> None:
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words: Dict[str, int] = dict(words)
+        self._deletes: Dict[str, List[str]] = {}
+        for w in self.words:
+            for d in self._edits(w[:prefix_length]):
+                self._deletes.setdefault(d, []).append(w)
+
+    def _edits(self, word: str) -> Set[str]:
+        out = {word}
+        frontier = {word}
+        for _ in range(self.max_distance):
+            nxt = set()
+            for w in frontier:
+                if len(w) <= 1:
+                    continue
+                for i in range(len(w)):
+                    nxt.add(w[:i] + w[i + 1:])
+            out |= nxt
+            frontier = nxt
+        return out
+
+    def lookup(self, term: str, max_distance: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """Kandidaten [(Wort, Distanz, Häufigkeit)], sortiert nach Distanz, dann Häufigkeit."""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        seen: Set[str] = set()
+        out: List[Tuple[str, int, int]] = []
+        for d in self._edits(term[: self.prefix_length]):
+            for w in self._deletes.get(d, ()):
+                if w in seen:
+                    continue
+                seen.add(w)
+                dist = osa_distance(term, w, max_distance)
+                if dist <= max_distance:
+                    out.append((w, dist, self.words[w]))
+        out.sort(key=lambda x: (x[1], -x[2]))
+        return out
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+def _best(cands: List[Tuple[str, int, int]]) -> Optional[str]:
+    """Eindeutig bester Kandidat (kleinste Distanz, dann Häufigkeit); Gleichstand → keine Korrektur."""
+    if not cands:
+        return None
+    if len(cands) > 1 and cands[1][1:] == cands[0][1:]:
+        return None
+    return cands[0][0]
+
+
+class QuerySpeller:
+    """
+    Korrigiert Anfrage-Tokens gegen Akronyme (großgeschrieben, mit Häufigkeit) und den
+    Korpus-Wortschatz (kleingeschrieben, inkl. Normnummern). Bekannte Tokens bleiben unverändert.
+    """
+
+    def __init__(
+        self,
+        acronyms: Mapping[str, int],
+        words: Mapping[str, int],
+        *,
+        accepts: Optional[Callable[..., bool]] = None,
+        min_count: int = SPELL_MIN_COUNT,
+    ) -> None:
+        self._accepts = accepts
+        self.acronyms = SpellIndex({t: n for t, n in acronyms.items() if not t.isdigit()})
+        self.words = SpellIndex({w: n for w, n in words.items() if n >= min_count or w.isdigit()})
+        self._known_words: Set[str] = set(words)
+
+    def correct_token(self, tok: str) -> Optional[str]:
+        low = tok.lower()
+        if low in ACRONYM_STOP or low in self._known_words or tok.upper() in self.acronyms.words:
+            return None
+        if any(ch.isdigit() for ch in tok):
+            # Normnummern: nur gleich lange Zahlen, ab 5 Ziffern bis zu 2 Fehler (21343 → 21434)
+            if not tok.isdigit() or len(tok) < 4:
+                return None
+            cands = [c for c in self.words.lookup(tok, 1 if len(tok) < 5 else 2) if c[0].isdigit() and len(c[0]) == len(tok)]
+            return _best(cands)
+        if len(tok) < 4:
+            return None  # zu kurz: jede Korrektur wäre geraten (ECU ≠ CPU)
+        dist = 1 if len(tok) <= 6 else 2
+        if tok.isupper():
+            return _best(self.acronyms.lookup(tok, dist))
+        # klein getippte Akronyme ("traa"), sofern das Akronym auch klein getippt gilt
+        fix = _best(self.acronyms.lookup(tok.upper(), dist))
+        if fix and (self._accepts is None or self._accepts(fix, typed_lower=True)):
+            return fix
+        if len(tok) < 6:
+            return None
+        fix = _best(self.words.lookup(low, dist))
+        if fix and tok[:1].isupper():
+            fix = fix.capitalize()
+        return fix
+
+    def correct(self, text: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """(korrigierter Text, [(Original, Korrektur)]); Text unverändert, wenn nichts zu tun ist."""
+        corrections: List[Tuple[str, str]] = []
+        parts: List[str] = []
+        pos = 0
+        for m in _TOKEN_RE.finditer(text or ""):
+            fix = self.correct_token(m.group(0))
+            if fix and fix != m.group(0):
+                parts.append(text[pos: m.start()])
+                parts.append(fix)
+                pos = m.end()
+                corrections.append((m.group(0), fix))
+        if not corrections:
+            return text, []
+        parts.append(text[pos:])
+        return "".join(parts), corrections
+
+
+def correct_query(text: str, lexicon) -> Tuple[str, List[Tuple[str, str]]]:
+    """Anfrage gegen das Korpus-Lexikon (acronym_lexicon.AcronymLexicon) korrigieren."""
+    if not SPELL_CORRECTION or lexicon is None or not len(lexicon) or not text:
+        return text, []
+    return lexicon.speller().correct(text)
+
+
+def format_corrections(corrections: Iterable[Tuple[str, str]]) -> str:
+    return ", ".join(f"{a} → {b}" for a, b in corrections)
@@ -0,0 +1,72 @@
+# bench_compression.py
+# Prompt-Tokens und End-to-End-Latenz auf einem festen Fragenkatalog, ohne vs. mit Kontextkompression.
+# Benötigt einen gefüllten Index; mit --llm wird zusätzlich ask_ollama aufgerufen (Latenz inkl. Generierung).
+# Aufruf (im App-Container): python tests/bench_compression.py [--llm]
+import asyncio
+import os
+import sys
+import time
+
+_CUR = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_CUR)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from compression import compress_chunks  # noqa: E402
+from llm_client import ask_ollama, context_token_budget  # noqa: E402
+from acronym_utils import detect_acronym  # noqa: E402
+from retrieval import build_combined_excerpts, get_best_chunks_global, select_diverse  # noqa: E402
+from token_budget import token_counter  # noqa: E402
+from vector_store import vector_store  # noqa: E402
+
+QUESTIONS = [
+    "Was ist eine TARA?",
+    "Wie werden Schadensszenarien bewertet?",
+    "Welche Arbeitsprodukte fordert Clause 15?",
+    "What is the purpose of the cybersecurity case?",
+    "How is attack feasibility rated?",
+    "Was bedeutet CAL?",
+]
+
+
+async def _one(question: str, compress: bool, call_llm: bool):
+    t0 = time.perf_counter()
+    lang = "EN" if question.lower().startswith(("what", "how")) else "DE"
+    chunks = select_diverse(await get_best_chunks_global(question, max_chunks=12), 12)
+    budget = context_token_budget(question, lang)
+    if compress and chunks:
+        q_emb = await asyncio.to_thread(vector_store.embed_query, question)
+        chunks, _ = await asyncio.to_thread(
+            compress_chunks, q_emb, chunks, budget,
+            encode=vector_store.detail_encode, term=detect_acronym(question),
+        )
+    context = build_combined_excerpts(chunks, max_tokens=budget)
+    tokens = token_counter.count(context)
+    if call_llm and context:
+        await ask_ollama(question, context, chunks, target_language=lang)
+    return tokens, (time.perf_counter() - t0) * 1000.0
+
+
+async def main(call_llm: bool) -> None:
+    # Retrieval vorwärmen: beide Varianten lesen dann aus dem Retrieval-Cache, gemessen wird nur der Unterschied
+    for q in QUESTIONS:
+        await get_best_chunks_global(q, max_chunks=12)
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    print(f"{'question':48} {'tok':>6} {'tok(c)':>6} {'ms':>8} {'ms(c)':>8}")
+    for q in QUESTIONS:
+        row = {}
+        for compress in (False, True):
+            tokens, ms = await _one(q, compress, call_llm)
+            row[compress] = (tokens, ms)
+            totals[compress][0] += tokens
+            totals[compress][1] += ms
+        print(f"{q[:48]:48} {row[False][0]:6d} {row[True][0]:6d} {row[False][1]:8.0f} {row[True][1]:8.0f}")
+    base, comp = totals[False], totals[True]
+    print(
+        f"excerpt tokens: {base[0]} → {comp[0]} ({(1 - comp[0] / base[0]) * 100 if base[0] else 0.0:.1f}% weniger); "
+        f"latency: {base[1]:.0f} → {comp[1]:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--llm" in sys.argv))
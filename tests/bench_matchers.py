@@ -0,0 +1,172 @@
+# bench_matchers.py
+# Mikrobenchmark: CPU-Zeit pro Anfrage für die Regex-Hotpaths einer 400-Kandidaten-Widening-Runde,
+# alte Implementierung (Kompilieren pro Aufruf) vs. matchers.py (vorkompiliert/gecacht).
+# Aufruf (im App-Container): python tests/bench_matchers.py [runs]
+import os
+import re
+import sys
+import time
+
+_CUR = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_CUR)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from acronym_utils import BAD_DEFN_WORDS  # noqa: E402
+from retrieval import (  # noqa: E402
+    _extract_expansions,
+    build_combined_excerpts,
+    filter_chunks_by_term,
+    find_chunk_with_term,
+    find_definition_in_chunks,
+)
+
+# ------------------ alte Implementierung (Stand vor matchers.py) ------------------ #
+
+def _legacy_normalize(s):
+    return re.sub(r"[\s\-/]+", "", s or "").casefold()
+
+
+def _legacy_matches(term, text):
+    if not term or not text:
+        return False
+    if re.fullmatch(r"[A-ZÄÖÜ]{2,5}", term or ""):
+        pat = re.compile(rf"(?<![A-Za-zÄÖÜäöüß]){re.escape(term)}(?![A-Za-zÄÖÜäöüß])")
+        return bool(pat.search(text))
+    return _legacy_normalize(term) in _legacy_normalize(text)
+
+
+def _legacy_find_chunk_with_term(term, chunks):
+    for c in chunks:
+        txt = (c.get("text") or "").strip()
+        if not txt or not _legacy_matches(term, txt):
+            continue
+        for line in txt.splitlines():
+            s = line.strip()
+            if s and _legacy_matches(term, s) and 20 <= len(s) <= 220:
+                return s
+        for sent in re.split(r"(?<=[\.\!\?])\s+", txt):
+            s = sent.strip()
+            if _legacy_matches(term, s) and 20 <= len(s) <= 220:
+                return s
+        return txt[:220]
+    return None
+
+
+def _legacy_definitions(term, chunks):
+    defn_re = re.compile(rf"\b{re.escape(term)}\b\s*(?:[-–—:]\s*)([^\n]{{5,200}})", re.IGNORECASE)
+    out = []
+    for c in chunks:
+        m = defn_re.search(c.get("text") or "")
+        if m and not any(bad in m.group(1).casefold() for bad in BAD_DEFN_WORDS):
+            out.append(m.group(1))
+    return out
+
+
+def _legacy_filter(term, chunks):
+    tn = _legacy_normalize(term)
+    std_re = re.compile(r"(?i)\b(?:ISO|SAE)[\s\/-]*\d{3,6}\b")
+    can_re = re.compile(r"(?i)\bCAN(?:-FD)?\b")
+    gen_re = re.compile(r"(?i)\b[A-Z]{2,10}(?:[\/\-]?[A-Z0-9]{1,10})+\b")
+    scored = []
+    for c in chunks:
+        txt = c.get("text", "") or ""
+        if tn not in _legacy_normalize(txt):
+            continue
+        score = float(c.get("similarity_score", 0.0))
+        score += 0.08 if std_re.search(txt) else 0.0
+        score += 0.05 if can_re.search(txt) else 0.0
+        score += 0.03 if gen_re.search(txt) else 0.0
+        scored.append((c, score))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return [c for c, _ in scored]
+
+
+def _legacy_expansions(term, chunks):
+    t = re.escape(term)
+    pat_right = re.compile(rf"\b{t}\b\s*[-–—:]\s*([A-Za-z][A-Za-z \-\/]{{2,60}})")
+    pat_left = re.compile(rf"([A-Za-z][A-Za-z \-\/]{{2,60}})\s*\(\s*{t}\s*\)")
+    out = []
+    for c in chunks:
+        s = c.get("text") or ""
+        out += [m.strip() for m in pat_right.findall(s)] + [m.strip() for m in pat_left.findall(s)]
+    return [e for e in out if not re.search(r"https?://", e, re.IGNORECASE)][:5]
+
+
+def _legacy_sanitize(chunks):
+    out = []
+    for c in chunks:
+        for raw in (c.get("text") or "").splitlines():
+            s = raw.strip()
+            if not s or re.match(r"^(figure|clause|overview|annex)\b", s, re.IGNORECASE):
+                continue
+            if "|" in s or re.match(r"^(table|tabelle)\b", s, re.IGNORECASE):
+                out.append(s)
+                continue
+            if (
+                re.search(r"\b(ISO|SAE)\b", s, re.IGNORECASE)
+                or re.search(r"\b[A-Z]{2,10}\b", s)
+                or re.search(r"\d", s)
+            ):
+                out.append(s)
+                continue
+            if re.match(r"^\d+(\.\d+)*\s+[A-Z]", s) or len(s.split()) <= 2:
+                continue
+            out.append(s)
+    return out
+
+# ------------------ Benchmark ------------------ #
+
+def _make_candidates(n: int = 400):
+    base = [
+        "The organization shall perform a threat analysis for each item.\nRisk values are determined per damage scenario.",
+        "Cybersecurity goals are derived from the risk treatment decision. The item definition is an input.",
+        "ISO/SAE 21434 Road vehicles — Cybersecurity engineering\nClause 15 describes the methods.",
+        "| Attack path | Feasibility | Rating |\n| Physical | High | 3 |",
+        "Work products shall be documented. The cybersecurity case provides the argument.",
+    ]
+    out = []
+    for i in range(n):
+        txt = base[i % len(base)] + f"\nParagraph {i} with additional explanatory text on vehicle security."
+        if i == n - 3:
+            txt += "\nTARA – Threat Analysis and Risk Assessment"
+        out.append({"chunk_id": f"x_chunk_{i}", "text": txt, "similarity_score": 0.5 - i * 0.0005})
+    return out
+
+
+def _per_request(fn, runs: int) -> float:
+    fn()  # Aufwärmen (füllt Caches wie im Dauerbetrieb)
+    t0 = time.process_time()
+    for _ in range(runs):
+        fn()
+    return (time.process_time() - t0) / runs * 1000.0
+
+
+def main(runs: int = 50) -> None:
+    chunks = _make_candidates(400)
+    term = "TARA"
+
+    def legacy():
+        _legacy_expansions(term, chunks[:30])
+        _legacy_definitions(term, chunks)
+        _legacy_filter(term, chunks)
+        _legacy_find_chunk_with_term(term, chunks)
+        _legacy_sanitize(chunks[:12])
+
+    def current():
+        _extract_expansions(term, chunks[:30])
+        find_definition_in_chunks(term, chunks)
+        filter_chunks_by_term(term, chunks)
+        find_chunk_with_term(term, chunks)
+        build_combined_excerpts(chunks[:12])
+
+    old_ms = _per_request(legacy, runs)
+    new_ms = _per_request(current, runs)
+    print(f"candidates=400 runs={runs}")
+    print(f"legacy : {old_ms:8.3f} ms CPU/request")
+    print(f"matcher: {new_ms:8.3f} ms CPU/request")
+    print(f"saved  : {old_ms - new_ms:8.3f} ms ({(1 - new_ms / max(old_ms, 1e-9)) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
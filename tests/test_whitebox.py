@@ -16,6 +16,7 @@ def _load_by_path(modname: str, filepath: str):
     assert spec and spec.loader
     spec.loader.exec_module(mod)  # type: ignore[attr-defined]
     return mod
+import contextlib
 import re
 
 try:
@@ -35,6 +36,21 @@ except ModuleNotFoundError:
     find_definition_in_chunks = _retrieval.find_definition_in_chunks  # type: ignore[attr-defined]
     build_combined_excerpts = _retrieval.build_combined_excerpts  # type: ignore[attr-defined]
 
+try:
+    from glossary import extract_glossary_entries, GlossaryIndex
+except ModuleNotFoundError:
+    _glossary = _load_by_path("glossary", os.path.join(_ROOT, "glossary.py"))
+    extract_glossary_entries = _glossary.extract_glossary_entries  # type: ignore[attr-defined]
+    GlossaryIndex = _glossary.GlossaryIndex  # type: ignore[attr-defined]
+
+try:
+    from ranking import dedup_chunks, mmr_select, apply_boosts
+except ModuleNotFoundError:
+    _ranking = _load_by_path("ranking", os.path.join(_ROOT, "ranking.py"))
+    dedup_chunks = _ranking.dedup_chunks  # type: ignore[attr-defined]
+    mmr_select = _ranking.mmr_select  # type: ignore[attr-defined]
+    apply_boosts = _ranking.apply_boosts  # type: ignore[attr-defined]
+
 
 def test_detect_acronym():
     assert detect_acronym("was ist das CAN?") == "CAN"
@@ -56,6 +72,16 @@ def test_matches_term_boundaries():
     assert _matches_term("ISO-21434", "ISO 21434") is True
 
 
+def test_matchers_are_cached_and_multiterm():
+    matchers = _load_by_path("matchers", os.path.join(_ROOT, "matchers.py"))
+    assert matchers.term_matcher("CAN") is matchers.term_matcher("CAN")
+    assert matchers.term_matcher("CAN")("This is CAN bus.")
+    assert not matchers.term_matcher("CAN")("This can lead to...")
+    m = matchers.MultiTermMatcher(["foreword", "all rights reserved"])
+    assert m.search("2021 — all rights reserved")
+    assert not m.search("controller area network")
+
+
 def test_find_definition_in_chunks():
     chunks = [
         {"text": "Foreword\nCAN: Controller Area Network communication."},  # foreword should be filtered
@@ -107,6 +133,1084 @@ def test_chunk_dedup_logic_like_retrieval():
     assert uniq_sorted[0]["chunk_id"] in ("b2", "a1")
 
 
+def test_mmr_skips_near_duplicates():
+    import numpy as np
+    embs = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    scores = apply_boosts(np.array([0.9, 0.89, 0.6]), np.array([[0], [0], [1]], dtype=bool), [0.1], threshold=0.2)
+    # zweiter Kandidat ist ein Duplikat des ersten → der andersartige dritte wird gewählt
+    assert mmr_select(scores, embs, 2, lambda_=0.7) == [0, 2]
+    # ohne Embeddings: reine Top-k
+    assert mmr_select(scores, None, 2) == [0, 1]
+    assert len(dedup_chunks([{"chunk_id": "a", "text": "x"}, {"chunk_id": "a", "text": "x"}])) == 1
+
+
+def test_expansion_fanout_stops_when_enough(monkeypatch):
+    import asyncio
+    import time
+    import retrieval
+
+    calls = []
+
+    def fake_search(q, n_results=5):
+        calls.append(q)
+        time.sleep(0.05 if q != "slow" else 0.5)
+        return [{"chunk_id": f"{q}_{i}", "text": f"{q} {i}", "similarity_score": 0.5} for i in range(3)]
+
+    monkeypatch.setattr(retrieval.vector_store, "search_global", fake_search)
+    monkeypatch.setattr(retrieval, "EXPANSION_CONCURRENCY", 2)
+    pool = {}
+
+    async def run() -> float:
+        t0 = time.perf_counter()
+        await retrieval._search_expansions(["a", "b", "slow", "c", "d"], pool, n_results=3, enough=6)
+        return time.perf_counter() - t0
+
+    elapsed = asyncio.run(run())
+    # zwei parallele Teilanfragen reichen → Rest wird abgebrochen, ohne auf "slow" zu warten
+    assert len(pool) >= 6
+    assert "d" not in calls
+    assert elapsed < 0.4
+
+    # nach Fristablauf startet keine weitere Abfrage mehr (Threads ließen sich nicht abbrechen)
+    calls.clear()
+    monkeypatch.setattr(retrieval, "EXPANSION_DEADLINE_S", 0.2)
+    pool2 = {}
+
+    def slow_search(q, n_results=5):
+        calls.append(q)
+        time.sleep(0.5)
+        return []
+
+    async def run_deadline() -> None:
+        await retrieval._search_expansions(["slow", "slow2", "e", "f"], pool2, n_results=3, enough=100)
+
+    monkeypatch.setattr(retrieval.vector_store, "search_global", slow_search)
+    asyncio.run(run_deadline())
+    time.sleep(0.7)
+    assert calls == ["slow", "slow2"]
+
+
+def test_glossary_extraction_and_lookup(tmp_path):
+    text = (
+        "TARA – Threat Analysis and Risk Assessment CAL – Cybersecurity Assurance Level. "
+        "The OEM performs a Threat Analysis and Risk Assessment (TARA). "
+        "Foreword: copyright notice"
+    )
+    entries = extract_glossary_entries(text)
+    terms = {(e["term"], e["definition"]) for e in entries}
+    assert ("TARA", "Threat Analysis and Risk Assessment") in terms
+    assert ("CAL", "Cybersecurity Assurance Level") in terms
+    # BAD_DEFN_WORDS filtern Vorwort/Impressum
+    assert not any("copyright" in e["definition"].casefold() for e in entries)
+
+    path = str(tmp_path / "glossary.json")
+    idx = GlossaryIndex(path)
+    idx.set_document("doc.pdf", [{"text": text, "chunk_id": "x_chunk_0", "chunk_index": 0, "page": 3}])
+    hits = GlossaryIndex(path).lookup("tara")  # persistiert + case-insensitiv
+    assert hits and hits[0]["definition"] == "Threat Analysis and Risk Assessment"
+    assert hits[0]["chunk_id"] == "x_chunk_0" and hits[0]["page"] == 3
+    idx.remove_document("doc.pdf")
+    assert idx.lookup("TARA") == []
+
+
+def test_glossary_shortcut_only_for_definition_questions(monkeypatch):
+    import asyncio
+    import retrieval
+    from query_plan import QueryPlan
+
+    gloss = [{"chunk_id": "g_chunk_0", "text": "TARA – Threat Analysis and Risk Assessment", "glossary": True}]
+    vec = [
+        {"chunk_id": f"d_chunk_{i}", "doc_id": "d.pdf", "text": f"TARA Schritt {i} in Kapitel 15", "similarity_score": 0.9 - i / 10}
+        for i in range(3)
+    ]
+    opened = []
+
+    class Cursor:
+        exhausted = True
+
+        def fetch_until(self, _n):
+            return list(vec)
+
+    def open_cursor(plan):
+        opened.append(plan.text)
+        return Cursor()
+
+    monkeypatch.setattr(retrieval.vector_store, "lookup_glossary", lambda term, limit=5: list(gloss))
+    monkeypatch.setattr(retrieval.vector_store, "open_cursor", open_cursor)
+    monkeypatch.setattr(retrieval.vector_store, "search_keyword", lambda *a, **k: [])
+    monkeypatch.setattr(retrieval.vector_store, "search_global", lambda *a, **k: [])
+
+    definition = QueryPlan("Was ist TARA?")
+    assert definition.definition
+    assert asyncio.run(retrieval._best_chunks_global(definition, 4)) == gloss and opened == []
+
+    howto = QueryPlan("Wie wird TARA in Kapitel 15 durchgeführt?")
+    assert not howto.definition
+    hits = asyncio.run(retrieval._best_chunks_global(howto, 4))
+    assert opened == [howto.text]  # Vektorsuche läuft, Glossarzeile nur beigemischt
+    assert hits[0]["glossary"] and {c["chunk_id"] for c in hits[1:]} == {c["chunk_id"] for c in vec}
+
+
+def test_retrieval_cache_hits_and_generation(monkeypatch):
+    import asyncio
+    import retrieval
+
+    calls = []
+
+    async def fake_global(query, max_chunks=12):
+        calls.append(query)
+        return [{"chunk_id": "a_chunk_0", "text": "TARA – Threat Analysis", "similarity_score": 0.9}]
+
+    monkeypatch.setattr(retrieval, "_best_chunks_global", fake_global)
+    monkeypatch.setattr(retrieval.vector_store, "generation", 1000)
+    retrieval.retrieval_cache.clear()
+
+    asyncio.run(retrieval.get_best_chunks_global("Was ist TARA?"))
+    # gleiche normalisierte Anfrage → Cache-Treffer
+    asyncio.run(retrieval.get_best_chunks_global("  was ist  TARA "))
+    assert len(calls) == 1
+    # Korpus geändert → neue Generation, kein veralteter Treffer
+    monkeypatch.setattr(retrieval.vector_store, "generation", 1001)
+    asyncio.run(retrieval.get_best_chunks_global("Was ist TARA?"))
+    assert len(calls) == 2
+    assert retrieval.retrieval_cache_stats()["hits"] >= 1
+
+    # leeres Ergebnis (z. B. verschluckter Chroma-Fehler) wird nicht gecacht
+    async def empty_global(query, max_chunks=12):
+        calls.append(query)
+        return []
+
+    monkeypatch.setattr(retrieval, "_best_chunks_global", empty_global)
+    asyncio.run(retrieval.get_best_chunks_global("Was ist CAL?"))
+    asyncio.run(retrieval.get_best_chunks_global("Was ist CAL?"))
+    assert len(calls) == 4
+
+
+def test_semantic_answer_cache_guards():
+    import numpy as np
+    try:
+        from answer_cache import SemanticAnswerCache
+    except ModuleNotFoundError:
+        SemanticAnswerCache = _load_by_path("answer_cache", os.path.join(_ROOT, "answer_cache.py")).SemanticAnswerCache
+
+    def unit(v):
+        v = np.asarray(v, dtype=np.float32)
+        return v / np.linalg.norm(v)
+
+    cache = SemanticAnswerCache(8, max_distance=0.1)
+    cache.store("Was bedeutet CAL?", unit([1, 0, 0]), "CAL = Cybersecurity Assurance Level", lang="DE", generation=1)
+    hit = cache.lookup("CAL Bedeutung", unit([1, 0.2, 0]), lang="DE", generation=1)
+    assert hit and hit[0].startswith("CAL =") and hit[1] > 0.9
+    # andere Sprache / Generation / Akronym / Normnummer → kein Treffer
+    assert cache.lookup("CAL Bedeutung", unit([1, 0.2, 0]), lang="EN", generation=1) is None
+    assert cache.lookup("CAL Bedeutung", unit([1, 0.2, 0]), lang="DE", generation=2) is None
+    assert cache.lookup("TARA Bedeutung", unit([1, 0.2, 0]), lang="DE", generation=1) is None
+    assert cache.lookup("CAL in ISO 26262", unit([1, 0.2, 0]), lang="DE", generation=1) is None
+    # zu weit entfernt
+    assert cache.lookup("CAL Bedeutung", unit([1, 1, 0]), lang="DE", generation=1) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_context_packing_respects_token_budget():
+    try:
+        from token_budget import TokenCounter, merge_adjacent, pack_excerpts
+    except ModuleNotFoundError:
+        _tb = _load_by_path("token_budget", os.path.join(_ROOT, "token_budget.py"))
+        TokenCounter, merge_adjacent, pack_excerpts = _tb.TokenCounter, _tb.merge_adjacent, _tb.pack_excerpts
+
+    a = "The TARA identifies threat scenarios for each asset. " * 3
+    b = a[-60:] + "Risk values are then determined per scenario."
+    chunks = [
+        {"doc_id": "d.pdf", "chunk_index": 4, "text": b, "similarity_score": 0.7},
+        {"doc_id": "e.pdf", "chunk_index": 0, "text": "CAL – Cybersecurity Assurance Level.", "similarity_score": 0.5},
+        {"doc_id": "d.pdf", "chunk_index": 3, "text": a, "similarity_score": 0.6},
+    ]
+    spans = merge_adjacent(chunks)
+    assert len(spans) == 2 and spans[0]["doc_id"] == "d.pdf"
+    # Überlappung nur einmal, Score = bester Teil-Score
+    assert spans[0]["text"].count("threat scenarios") == 3 and spans[0]["text"].endswith("per scenario.")
+    assert spans[0]["similarity_score"] == 0.7
+
+    counter = TokenCounter(chars_per_token=4.0)
+    texts = ["short excerpt about CAL.", "x " * 400, "never fits"]
+    packed, stats = pack_excerpts(texts, 120, counter=counter)
+    assert stats["tokens"] <= 120 and counter.count(packed) <= 120 + 4
+    assert packed.startswith("EXCERPT 1:\nshort excerpt") and packed.endswith("…")
+    assert stats["truncated"] == 1 and stats["dropped"] == 1
+
+    counter.calibrate(4000, 1000)
+    assert 3.9 < counter.chars_per_token < 4.1
+
+
+def test_prompt_token_calibration_skips_implausible_counts(monkeypatch):
+    import llm_client
+
+    from model_tiers import TierChoice
+
+    calls, warnings = [], []
+    monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+    monkeypatch.setattr(llm_client, "OLLAMA_NUM_CTX", 2048)
+    monkeypatch.setattr(llm_client.token_counter, "calibrate", lambda chars, tokens: calls.append(tokens))
+    monkeypatch.setattr(llm_client.logger, "warning", lambda msg, *args: warnings.append(args))
+    system, user = "s" * 2000, "u" * 2000
+    tier = TierChoice("", 256)
+    # KV-Cache: nur die neuen Tokens gezählt; abgeschnitten: auf num_ctx gedeckelt
+    llm_client._report_prompt_tokens(system, user, 1000, "ollama", tier, {"prompt_tokens": 180})
+    llm_client._report_prompt_tokens(system, user, 1900, "ollama", tier, {"prompt_tokens": 2048})
+    # Groq hat nach Failover geantwortet: andere Tokenisierung, kein Kalibrieren trotz LLM_BACKEND=ollama
+    llm_client._report_prompt_tokens(system, user, 1000, "groq", tier, {"prompt_tokens": 1100})
+    assert calls == []
+    llm_client._report_prompt_tokens(system, user, 1000, "ollama", tier, {"prompt_tokens": 1100})
+    assert calls == [1100 - llm_client.PROMPT_TEMPLATE_TOKENS]
+    # Warnung mit dem num_predict der gewählten Stufe: 1800 + 256 > 2048, 1800 + 128 nicht
+    warnings.clear()
+    llm_client._report_prompt_tokens(system, user, 1800, "ollama", TierChoice("tinyllama", 128), {"prompt_tokens": 1800})
+    assert warnings == []
+    llm_client._report_prompt_tokens(system, user, 1800, "ollama", tier, {"prompt_tokens": 1800})
+    assert warnings == [(1800, 2048)]
+
+
+def test_compression_keeps_relevant_sentences_and_definitions():
+    import numpy as np
+    try:
+        from compression import compress_chunks
+        from token_budget import TokenCounter
+    except ModuleNotFoundError:
+        compress_chunks = _load_by_path("compression", os.path.join(_ROOT, "compression.py")).compress_chunks
+        TokenCounter = _load_by_path("token_budget", os.path.join(_ROOT, "token_budget.py")).TokenCounter
+
+    def fake_encode(sentences):
+        # "Risiko"-Sätze zeigen in Richtung der Anfrage, alles andere orthogonal
+        return [[1.0, 0.0] if "Risiko" in s else [0.0, 1.0] for s in sentences]
+
+    filler = " ".join(f"Füllsatz Nummer {i} ohne Bezug zur Frage." for i in range(20))
+    chunks = [
+        {"chunk_id": "a", "text": filler + " Das Risiko wird pro Szenario bestimmt."},
+        {"chunk_id": "b", "text": "TARA – Threat Analysis and Risk Assessment\n| Stufe | Wert |"},
+        {"chunk_id": "c", "text": filler},
+    ]
+    out, stats = compress_chunks(
+        [1.0, 0.0], chunks, 500, encode=fake_encode, term="TARA", ratio=0.3, counter=TokenCounter(4.0)
+    )
+    text = "\n".join(c["text"] for c in out)
+    assert "Das Risiko wird pro Szenario bestimmt." in text
+    assert "TARA – Threat Analysis and Risk Assessment" in text and "| Stufe | Wert |" in text
+    assert stats["tokens_after"] < stats["tokens_before"] * 0.5
+    assert [c["chunk_id"] for c in out][:2] == ["a", "b"]
+
+    # echte Chunks sind eine einzige Zeile: nur der Definitionssatz hat Vorrang, nicht der ganze Absatz
+    paragraph = filler + " TARA – threat analysis and risk assessment of the item. " + filler
+    chunks = [{"chunk_id": "p", "text": paragraph}, {"chunk_id": "u", "text": "Das Risiko wird pro Szenario bestimmt."}]
+    out, stats = compress_chunks(
+        [1.0, 0.0], chunks, 120, encode=fake_encode, term="TARA", ratio=0.3, counter=TokenCounter(4.0)
+    )
+    text = "\n".join(c["text"] for c in out)
+    assert "TARA – threat analysis and risk assessment of the item." in text and text.count("Füllsatz") < 20
+    assert "Das Risiko" in text and stats["tokens_after"] <= 120
+
+    # Definition länger als das Budget → gekürzt, nie verworfen
+    long_defn = "TARA – " + "threat analysis and risk assessment " * 40
+    out, _ = compress_chunks(
+        [1.0, 0.0], [{"chunk_id": "d", "text": long_defn}, {"chunk_id": "c", "text": filler}], 100,
+        encode=fake_encode, term="TARA", ratio=0.3, counter=TokenCounter(4.0),
+    )
+    assert out and out[0]["chunk_id"] == "d" and out[0]["text"].startswith("TARA – threat")
+
+
+def test_neighbour_expansion_builds_spans(monkeypatch):
+    import asyncio
+    import retrieval
+
+    def chunk(i, text, score=0.0):
+        return {
+            "doc_id": "d.pdf", "chunk_id": f"abc_chunk_{i}", "chunk_index": i, "text": text,
+            "similarity_score": score, "metadata": {"total_chunks": 6},
+        }
+
+    texts = {i: f"Absatz {i} über Risikobewertung." for i in range(6)}
+    lookups = []
+
+    def fake_get(ids):
+        lookups.append(list(ids))
+        return {cid: chunk(int(cid.rsplit("_", 1)[1]), texts[int(cid.rsplit("_", 1)[1])]) for cid in ids}
+
+    monkeypatch.setattr(retrieval.vector_store, "get_chunks_by_ids", fake_get)
+    hits = [chunk(2, texts[2], 0.9), chunk(5, texts[5], 0.8), chunk(3, texts[3], 0.5)]
+    out = asyncio.run(retrieval.expand_neighbours(hits, k=1, top=2))
+    # ein gebatchter Lookup; Chunk 3 steckt bereits im Span 1..3 und entfällt
+    assert len(lookups) == 1
+    assert [c.get("span") for c in out] == [(1, 3), (4, 5)]
+    assert out[0]["text"].split("\n") == [texts[1], texts[2], texts[3]]
+    assert out[0]["similarity_score"] == 0.9
+
+
+def test_document_router_picks_topk(tmp_path):
+    import numpy as np
+    try:
+        from doc_router import DocumentRouter
+    except ModuleNotFoundError:
+        DocumentRouter = _load_by_path("doc_router", os.path.join(_ROOT, "doc_router.py")).DocumentRouter
+
+    def unit(*v):
+        v = np.asarray(v, dtype=np.float32)
+        return v / np.linalg.norm(v)
+
+    path = str(tmp_path / "routes.json")
+    router = DocumentRouter(path)
+    # b.pdf: überwiegend Thema y, aber ein Abschnitt zu Thema x
+    router.set_document("a.pdf", np.stack([unit(1, 0.1, 0)] * 4), [("s0", [0, 1, 2, 3])])
+    router.set_document("b.pdf", np.stack([unit(0, 1, 0)] * 6 + [unit(0.2, 0, 1)] * 2), [("s0", range(6)), ("s1", [6, 7])])
+    router.set_document("c.pdf", np.stack([unit(0, 0.2, 1)] * 3), [("s0", [0, 1, 2])])
+
+    routed = DocumentRouter(path).route(unit(0, 1, 0), 1)  # persistiert
+    assert [d for d, _ in routed] == ["b.pdf"]
+    # bester Abschnitt zählt: Thema z trifft c.pdf und den Abschnitt s1 von b.pdf
+    assert [d for d, _ in router.route(unit(0, 0, 1), 2)] == ["c.pdf", "b.pdf"]
+    # Kandidaten ohne Zentroid bleiben sichtbar
+    routed = router.route(unit(1, 0, 0), 1, candidates=["a.pdf", "new.pdf"])
+    assert routed[0][0] == "a.pdf" and routed[1] == ("new.pdf", None)
+    router.remove_document("b.pdf")
+    assert len(router) == 2
+
+
+def test_query_plan_is_computed_once(monkeypatch):
+    import retrieval
+    from query_plan import QueryPlan
+
+    plan = QueryPlan("Was bedeutet CAL laut ISO 21434?")
+    assert (plan.acronym, plan.lang, plan.want_long) == ("CAL", "DE", True)
+    assert plan.normalized == "was bedeutet cal laut iso 21434"
+    assert plan.guard == ("CAL", ("21434",))
+
+    def no_embed(_q):
+        raise AssertionError("query embedded twice")
+
+    plan.embedding = [0.0] * 8
+    monkeypatch.setattr(retrieval.vector_store, "embed_query", no_embed)
+    cursor = retrieval.vector_store.open_cursor(plan)
+    assert cursor.q_emb is plan.embedding and cursor.acr_cf == "cal"
+
+
+def test_acronym_lexicon_gates_detection(tmp_path):
+    try:
+        from acronym_lexicon import AcronymLexicon
+    except ModuleNotFoundError:
+        AcronymLexicon = _load_by_path("acronym_lexicon", os.path.join(_ROOT, "acronym_lexicon.py")).AcronymLexicon
+
+    path = str(tmp_path / "acronyms.json")
+    lex = AcronymLexicon(path)
+    lex.set_document("a.pdf", ["The TARA uses CAN-FD frames. A TARA can be repeated.", "You can skip it."])
+    lex.set_document("b.pdf", ["TARA per ISO/SAE 21434."])
+    lex = AcronymLexicon(path)  # persistiert
+    assert lex.document_frequency("tara") == 2 and "FD" in lex and "ISO" in lex
+
+    assert detect_acronym("was ist eine tara?", lexicon=lex) == "TARA"
+    # "can" steht im Korpus überwiegend klein → kein Akronym; unbekanntes RASIC ebenso nicht
+    assert detect_acronym("can you help me", lexicon=lex) is None
+    assert detect_acronym("was ist das RASIC?", lexicon=lex) is None
+    assert detect_acronym("was ist CAN-FD?", lexicon=lex) == "CAN-FD"
+    lex.remove_document("a.pdf")
+    assert "TARA" in lex and "CAN-FD" not in lex
+
+
+def test_spell_correction_against_corpus():
+    try:
+        from spell_index import QuerySpeller
+    except ModuleNotFoundError:
+        QuerySpeller = _load_by_path("spell_index", os.path.join(_ROOT, "spell_index.py")).QuerySpeller
+
+    speller = QuerySpeller(
+        {"TARA": 40, "RASIC": 5, "CAL": 12, "ISO": 30},
+        {"21434": 25, "26262": 3, "assessment": 9, "cybersecurity": 30, "threat": 8, "help": 2},
+    )
+    text, corr = speller.correct("Was ist TRAA und RASCI laut ISO 21343?")
+    assert text == "Was ist TARA und RASIC laut ISO 21434?"
+    assert corr == [("TRAA", "TARA"), ("RASCI", "RASIC"), ("21343", "21434")]
+    assert speller.correct("cybersecurty assesment")[0] == "cybersecurity assessment"
+    # bekannte, kurze und unbekannte Wörter bleiben unverändert
+    assert speller.correct("Can you help with ECU threat?") == ("Can you help with ECU threat?", [])
+    assert speller.correct("welche Schritte?")[1] == []
+
+
+def test_scoped_search_by_section_table_and_page(tmp_path):
+    from pdf_parser import StructureTracker
+    from scope_index import ScopeIndex, parse_scope
+
+    tracker = StructureTracker()
+    paras = [
+        (3, "15 Threat analysis and risk assessment methods"),
+        (3, "15.2 Asset identification The TARA starts with the assets of the item."),
+        (4, "Table H.3 — Attack feasibility rating"),
+        (4, "High | 0-13 | expert"),
+        (5, "Annex H (informative) Examples"),
+        (5, "TARA – Threat Analysis and Risk Assessment"),
+    ]
+    records = [tracker.classify(text, page) for page, text in paras]
+    assert [r.get("section") for r in records] == ["15", "15.2", "15.2", "15.2", "H", "H"]
+    assert records[3]["content_type"] == "table_row" and records[3]["table"] == "H.3"
+    assert records[5]["content_type"] == "glossary"
+
+    metas = [{**r, "chunk_id": f"abc_chunk_{i}", "chunk_index": i} for i, r in enumerate(records)]
+    index = ScopeIndex(str(tmp_path / "scopes.json"))
+    index.set_document("a.pdf", metas)
+    index = ScopeIndex(str(tmp_path / "scopes.json"))  # persistiert
+
+    assert index.candidate_ids(parse_scope("was steht in Kapitel 15 zu TARA?")) == [f"abc_chunk_{i}" for i in range(4)]
+    assert index.candidate_ids(parse_scope("Tabelle h3")) == ["abc_chunk_2", "abc_chunk_3"]
+    assert index.candidate_ids(parse_scope("Anhang H, Seite 5")) == ["abc_chunk_4", "abc_chunk_5"]
+    assert index.candidate_ids(parse_scope("Seite 9-12")) == []
+    assert parse_scope("Was ist eine TARA?") is None
+    # bloßes Wort "Tabelle"/"table" ist keine Bereichsangabe
+    assert parse_scope("Explain the table of contents") is None
+    assert parse_scope("Was ist TARA laut Tabelle?") is None
+
+    import retrieval
+    from query_plan import QueryPlan
+
+    plan = QueryPlan("TARA in Abschnitt 8.4")
+    strong = [{"text": "The TARA starts with the assets.", "similarity_score": 0.9}]
+    unrelated = [{"text": "High | 0-13 | expert", "similarity_score": 0.9}]
+    weak = [{"text": "The TARA starts with the assets.", "similarity_score": 0.4}]
+    assert retrieval.scoped_hits_sufficient(plan, strong)
+    assert not retrieval.scoped_hits_sufficient(plan, unrelated)
+    assert not retrieval.scoped_hits_sufficient(plan, weak)
+    assert not retrieval.scoped_hits_sufficient(plan, [])
+
+
+async def _stub_ollama_version(_request):
+    from aiohttp import web
+    return web.json_response({"version": "0.5.7"})
+
+
+@contextlib.asynccontextmanager
+async def _stub_server(monkeypatch, routes, *, pool_limit=2):
+    """
+    aiohttp-Testserver auf freiem Port; routes: {"POST /api/chat": handler, ...}, liefert die Basis-URL.
+    Ersetzt den Ollama-Pool durch einen frischen (pool_limit) und schließt Pools und Server am Ende.
+    """
+    from aiohttp import web
+    import http_pool
+
+    app = web.Application()
+    for route, handler in routes.items():
+        method, path = route.split(" ", 1)
+        app.router.add_route(method, path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    monkeypatch.setitem(http_pool.pools, "ollama", http_pool.BackendPool("ollama", limit=pool_limit, trust_env=False))
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await http_pool.close()
+        await runner.cleanup()
+
+
+def test_llm_calls_share_pooled_connections(monkeypatch):
+    import asyncio
+    from aiohttp import web
+    import http_pool
+    import llm_client
+
+    async def chat(request):
+        await request.json()
+        return web.json_response({"message": {"content": "ok"}, "prompt_eval_count": 10, "eval_count": 2})
+
+    async def run():
+        async with _stub_server(monkeypatch, {"POST /api/chat": chat}) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            pool = http_pool.pools["ollama"]
+            answers = [await llm_client._call_ollama_chat("sys", f"q{i}") for i in range(3)]
+        return answers, pool.stats()
+
+    answers, stats = asyncio.run(run())
+    assert answers == ["ok"] * 3
+    assert stats["requests"] == 3 and stats["connections_created"] == 1 and stats["connections_reused"] == 2
+    assert stats["ttfb_avg_ms"] > 0 and not stats["open"]
+
+    # anderer Event-Loop (zweites asyncio.run): alte Session samt Connector wird geschlossen
+    pool = http_pool.BackendPool("test", limit=1, trust_env=False)
+
+    async def open_session():
+        return pool.session()
+
+    first = asyncio.run(open_session())
+    connector = first.connector
+    second = asyncio.run(open_session())
+    assert second is not first and first.closed and connector.closed
+    asyncio.run(pool.close())
+
+
+def test_stream_renderer_and_ollama_stream(tmp_path, monkeypatch):
+    import asyncio
+    import json as _json
+    from aiohttp import web
+    import llm_client
+    from response_cache import LLMResponseCache
+
+    r = llm_client.StreamRenderer()
+    r.feed("**Titel**\n\nErster <b>Absatz")
+    assert r.render() == "<b>Titel</b>\n\nErster Absatz"  # offener Rest als Klartext
+    r.feed("</b> fertig.\n\n<pre>a | b\n\nc")
+    assert r.render().startswith("<b>Titel</b>\n\nErster <b>Absatz</b> fertig.\n\n")
+    assert "<pre>" not in r.render()  # <pre> ist noch offen → nicht als Block gerendert
+    assert llm_client._balance_tags("<b>x</pre> y") == "<b>x y</b>"
+
+    async def chat(request):
+        body = await request.json()
+        assert body["stream"] is True
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for part in ("Die ", "TARA ", "ist"):
+            await resp.write((_json.dumps({"message": {"content": part}, "done": False}) + "\n").encode())
+        await resp.write(_json.dumps({"done": True, "prompt_eval_count": 50, "eval_count": 3}).encode() + b"\n")
+        return resp
+
+    async def run():
+        async with _stub_server(monkeypatch, {"POST /api/chat": chat, "GET /api/version": _stub_ollama_version}) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache(str(tmp_path / "stream.sqlite3")))
+            # bei STREAM_MAX_CHARS gekappt → nicht cachen
+            with monkeypatch.context() as m:
+                m.setattr(llm_client, "STREAM_MAX_CHARS", 6)
+                cut = [p async for p in llm_client.ask_ollama_stream("Was ist TARA?", "TARA – Threat Analysis")]
+            stored = llm_client.response_cache.stats()["entries"]
+            full = [p async for p in llm_client.ask_ollama_stream("Was ist TARA?", "TARA – Threat Analysis")]
+            return cut, stored, full
+
+    cut, stored, full = asyncio.run(run())
+    assert "ist" not in cut and stored == 0
+    assert full == ["Die ", "TARA ", "ist"] and llm_client.response_cache.stats()["entries"] == 1
+
+
+def test_stream_error_after_first_message_keeps_partial_answer(monkeypatch):
+    import asyncio
+    import handlers1
+    from query_plan import QueryPlan
+
+    sent, edits, asked = [], [], []
+
+    class Msg:
+        async def edit_text(self, text, **_kw):
+            edits.append(text)
+
+    class Message:
+        async def reply_text(self, text, **_kw):
+            sent.append(text)
+            return Msg()
+
+    class User:
+        id = 1
+
+    class Update:
+        message = Message()
+        effective_user = User()
+
+    async def failing_stream(*_a, **_kw):
+        yield "Die TARA beginnt mit den Assets."
+        raise RuntimeError("connection reset")
+
+    async def not_started(*_a, **_kw):
+        raise RuntimeError("circuit open")
+        yield ""  # pragma: no cover
+
+    async def fake_ask(*_a, **_kw):
+        asked.append(1)
+        return "Einzelantwort"
+
+    monkeypatch.setattr(handlers1, "STREAM_ANSWERS", True)
+    monkeypatch.setattr(handlers1, "ask_ollama", fake_ask)
+    plan = QueryPlan("Wie beginnt die TARA?")
+
+    monkeypatch.setattr(handlers1, "ask_ollama_stream", failing_stream)
+    asyncio.run(handlers1._answer(Update(), None, plan, "Kontext", [], 1))
+    # Teilantwort in derselben Nachricht abgeschlossen, keine zweite Generierung/Nachricht
+    assert len(sent) == 1 and asked == []
+    assert "TARA beginnt" in edits[-1] and "abgebrochen" in edits[-1]
+
+    sent.clear()
+    monkeypatch.setattr(handlers1, "ask_ollama_stream", not_started)
+    asyncio.run(handlers1._answer(Update(), None, plan, "Kontext", [], 1))
+    assert asked == [1] and sent == ["Einzelantwort"]
+
+
+def test_ndjson_decoder_split_lines_and_early_stop(tmp_path, monkeypatch):
+    import asyncio
+    import json as _json
+    from aiohttp import web
+    import llm_client
+    from ndjson_stream import NDJSONDecoder
+    from response_cache import LLMResponseCache
+
+    raw = (_json.dumps({"response": "Größe "}) + "\n" + _json.dumps({"done": True, "eval_count": 4, "eval_duration": 2_000_000_000}) + "\n").encode()
+    dec = NDJSONDecoder()
+    objs = []
+    for i in range(0, len(raw), 5):  # Objekte und UTF-8-Sequenzen über Chunk-Grenzen geteilt
+        objs += dec.feed(raw[i:i + 5])
+    objs += dec.close()
+    assert [o.get("response") for o in objs] == ["Größe ", None] and objs[1]["eval_count"] == 4
+
+    served = {"lines": 0, "aborted": False}
+
+    async def generate(request):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        try:
+            for _ in range(500):
+                line = _json.dumps({"response": "abcdefghij", "done": False}) + "\n"
+                await resp.write(line[:7].encode())
+                await resp.write(line[7:].encode())
+                served["lines"] += 1
+                await asyncio.sleep(0.002)
+        except (ConnectionResetError, ConnectionError):
+            served["aborted"] = True
+        return resp
+
+    async def run():
+        async with _stub_server(monkeypatch, {"POST /api/generate": generate}) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "OLLAMA_STREAM", True)
+            monkeypatch.setattr(llm_client, "STREAM_MAX_CHARS", 50)
+            usage = {}
+            text = await llm_client._call_ollama_api("sys", "user", usage=usage)
+            await asyncio.sleep(0.1)  # Server bemerkt den Abbruch beim nächsten write
+            # derselbe Abbruch über ask_ollama (Endpunkt /api/generate): gekappte Antwort nicht cachen
+            caps = llm_client.OllamaCapabilities(url, llm_client.OLLAMA_MODEL, "generate", True)
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "tier_selector", None)
+            monkeypatch.setattr(llm_client, "_capabilities", {(url, llm_client.OLLAMA_MODEL): caps})
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache(str(tmp_path / "cut.sqlite3")))
+            await llm_client.ask_ollama("Wann beginnt der Vertrag?", "Kontext")
+            return text, usage
+
+    text, usage = asyncio.run(run())
+    assert text == "abcdefghij" * 5 and usage["stopped"] == "max_chars"
+    assert served["aborted"] and served["lines"] < 500
+    assert llm_client.response_cache.stats()["entries"] == 0
+
+def test_llm_response_cache(tmp_path, monkeypatch):
+    import asyncio
+    import time as _time
+    from aiohttp import web
+    import llm_client
+    from response_cache import LLMResponseCache, fingerprint
+
+    path = str(tmp_path / "llm.sqlite3")
+    cache = LLMResponseCache(path, max_entries=2, models={"ollama": ["m1"]})
+    keys = [fingerprint("sys", f"q{i}", {"num_predict": 256}) for i in range(3)]
+    assert keys[0] != fingerprint("sys", "q0", {"num_predict": 512})
+    for i, k in enumerate(keys):
+        cache.put(k, "ollama", "m1", f"raw {i}", {"completion_tokens": i})
+        _time.sleep(0.01)
+    assert cache.get(keys[0]) is None  # älteste Antwort verdrängt (max_entries=2)
+    assert cache.get(keys[2]) == ("raw 2", {"completion_tokens": 2})
+    cache.close()
+    assert LLMResponseCache(path, models={"ollama": ["m1"]}).get(keys[2]) is not None
+    assert LLMResponseCache(path, models={"ollama": ["m2"]}).get(keys[2]) is None  # Modellwechsel
+    small = LLMResponseCache(str(tmp_path / "small.sqlite3"), max_mb=1.5 / 1024)  # 1,5 KiB
+    for i, k in enumerate(keys):
+        small.put(k, "ollama", "m1", "x" * 600, {})
+        _time.sleep(0.01)
+    assert small.get(keys[0]) is None and small.get(keys[2]) is not None  # Bytegrenze
+    assert small.stats()["evictions"] >= 1
+    cache = LLMResponseCache(path, ttl=0.05)
+    cache.put(keys[1], "ollama", "m1", "raw", {})
+    _time.sleep(0.1)
+    assert cache.get(keys[1]) is None  # TTL abgelaufen
+
+    calls = []
+
+    async def chat(request):
+        calls.append(await request.json())
+        return web.json_response({"message": {"content": "**TARA** ist die Risikoanalyse."}, "done": True})
+
+    async def run():
+        async with _stub_server(monkeypatch, {"POST /api/chat": chat, "GET /api/version": _stub_ollama_version}) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache(str(tmp_path / "ask.sqlite3")))
+            return [await llm_client.ask_ollama("Was ist TARA?", "TARA – Threat Analysis") for _ in range(2)]
+
+    answers = asyncio.run(run())
+    assert len(calls) == 1 and answers[0] == answers[1] and "<b>TARA</b>" in answers[0]
+    stored = llm_client.response_cache.stats()
+    assert stored["entries"] == 1 and stored["hits"] == 1
+
+def test_singleflight_coalesces_and_cancels(tmp_path, monkeypatch):
+    import asyncio
+    from aiohttp import web
+    import llm_client
+    from response_cache import LLMResponseCache
+    from singleflight import SingleFlight
+
+    calls = []
+
+    async def chat(request):
+        calls.append(await request.json())
+        await asyncio.sleep(0.1)
+        return web.json_response({"message": {"content": "Geteilte Antwort."}, "done": True})
+
+    async def run():
+        routes = {"POST /api/chat": chat, "GET /api/version": _stub_ollama_version}
+        async with _stub_server(monkeypatch, routes, pool_limit=4) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache("", max_entries=0))
+            monkeypatch.setattr(llm_client, "llm_flights", SingleFlight("test"))
+            return await asyncio.gather(*(llm_client.ask_ollama("Was ist TARA?", "TARA") for _ in range(3)))
+
+    answers = asyncio.run(run())
+    assert len(calls) == 1 and len(set(answers)) == 1
+    assert llm_client.llm_flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2, "abandoned": 0}
+
+    async def streams():
+        sf = SingleFlight("test")
+        produced = []
+
+        async def gen():
+            for i in range(5):
+                await asyncio.sleep(0.02)
+                produced.append(i)
+                yield str(i)
+
+        async def read(limit=None):
+            out = []
+            async for p in sf.stream("k", gen):
+                out.append(p)
+                if limit and len(out) >= limit:
+                    break  # Leser steigt aus, der andere liest weiter
+            return out
+
+        a = asyncio.create_task(read(limit=2))
+        b = asyncio.create_task(read())
+        full = (await a, await b)
+        # einziger Leser bricht ab → Generierung wird abgebrochen
+        produced.clear()
+        c = asyncio.create_task(read())
+        await asyncio.sleep(0.03)
+        c.cancel()
+        await asyncio.sleep(0.1)
+        return full, produced, sf.stats()
+
+    (part, full), produced, stats = asyncio.run(streams())
+    assert part == ["0", "1"] and full == ["0", "1", "2", "3", "4"]
+    assert len(produced) < 5 and stats["leaders"] == 2 and stats["coalesced"] == 1 and stats["abandoned"] == 1
+
+def test_llm_scheduler_priorities_and_shedding():
+    import asyncio
+    from llm_scheduler import PRIORITY_ANSWER, PRIORITY_DEFINITION, LLMScheduler, SchedulerBusy
+
+    async def run():
+        sched = LLMScheduler(1, max_queue=2, queue_timeout=5.0)
+        order, results = [], {}
+
+        async def job(name, priority, hold=0.02, timeout=None):
+            try:
+                async with sched.slot(priority, timeout):
+                    order.append(name)
+                    await asyncio.sleep(hold)
+                results[name] = "ok"
+            except SchedulerBusy:
+                results[name] = "busy"
+
+        first = asyncio.create_task(job("running", PRIORITY_ANSWER, hold=0.1))
+        await asyncio.sleep(0.01)
+        tasks = [asyncio.create_task(job("answer1", PRIORITY_ANSWER))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("answer2", PRIORITY_ANSWER)))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("definition", PRIORITY_DEFINITION)))  # verdrängt answer2
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("answer3", PRIORITY_ANSWER)))  # Warteschlange voll → abgewiesen
+        await asyncio.gather(first, *tasks)
+        late = await asyncio.gather(job("waiter", PRIORITY_ANSWER, hold=0.2), job("impatient", PRIORITY_ANSWER, timeout=0.05))
+        return order, results, sched.stats()
+
+    order, results, stats = asyncio.run(run())
+    assert order == ["running", "definition", "answer1", "waiter"]
+    assert results == {"running": "ok", "answer1": "ok", "answer2": "busy", "definition": "ok", "answer3": "busy",
+                       "waiter": "ok", "impatient": "busy"}
+    assert stats["evicted"] == 1 and stats["shed"] == 1 and stats["timed_out"] == 1
+    assert stats["active"] == 0 and stats["queued"] == 0 and stats["max_queued"] == 2 and stats["wait_max_ms"] > 0
+
+def test_circuit_breaker_fails_fast_and_probes(monkeypatch):
+    import asyncio
+    import socket
+    import time as _time
+    import http_pool
+    import llm_client
+    from circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpen
+    from response_cache import LLMResponseCache
+
+    probe_result = {"ok": False, "calls": 0}
+
+    async def probe():
+        probe_result["calls"] += 1
+        return probe_result["ok"]
+
+    async def unit():
+        br = CircuitBreaker("t", window=4, min_calls=2, failure_ratio=0.5, open_seconds=0.05, probe=probe)
+        br.record(True, 0.1)
+        br.record(False, 0.1)
+        assert br.state == OPEN
+        try:
+            await br.before()
+            raise AssertionError("expected CircuitOpen")
+        except CircuitOpen:
+            pass
+        await asyncio.sleep(0.06)
+        try:
+            await br.before()  # halboffen: Test schlägt fehl → wieder offen
+        except CircuitOpen:
+            pass
+        assert br.state == OPEN and probe_result["calls"] == 1
+        probe_result["ok"] = True
+        await asyncio.sleep(0.06)
+        await br.before()
+        assert br.state == CLOSED and br.stats()["trips"] == 2
+
+    asyncio.run(unit())
+
+    with socket.socket() as sock:  # freier Port ohne Server → Verbindung wird abgelehnt
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def unreachable():
+        monkeypatch.setattr(llm_client, "OLLAMA_URL", f"http://127.0.0.1:{port}")
+        monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+        monkeypatch.setitem(http_pool.pools, "ollama", http_pool.BackendPool("ollama", limit=2, trust_env=False))
+        monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache("", max_entries=0))
+        monkeypatch.setitem(llm_client.breakers, "ollama", CircuitBreaker("ollama", min_calls=2, open_seconds=60))
+        try:
+            for i in range(2):
+                await llm_client.ask_ollama(f"Frage {i}", "Kontext")
+            t0 = _time.perf_counter()
+            answer = await llm_client.ask_ollama("Frage 3", "Kontext")
+            return answer, _time.perf_counter() - t0, http_pool.pools["ollama"].stats()["requests"]
+        finally:
+            await http_pool.close()
+
+    answer, elapsed, requests = asyncio.run(unreachable())
+    assert "nicht erreichbar" in answer and elapsed < 0.05
+    assert requests == 2  # je ein Versuch, kein /api/generate-Fallback, kein Zugriff bei offenem Kreis
+    assert llm_client.breakers["ollama"].stats()["rejected"] == 1
+
+def test_capability_probe_one_request_per_question(monkeypatch):
+    import asyncio
+    from aiohttp import web
+    import llm_client
+    from response_cache import LLMResponseCache
+
+    server = {"upgraded": False}
+    hits = []
+
+    async def version(_request):
+        hits.append("version")
+        if server["upgraded"]:
+            return web.json_response({"version": "0.5.7"})
+        return web.Response(status=404)
+
+    async def chat(request):
+        await request.json()
+        hits.append("chat")
+        if not server["upgraded"]:
+            return web.Response(status=404, text="not found")
+        return web.json_response({"message": {"content": "Chat-Antwort"}, "done": True})
+
+    async def generate(request):
+        body = await request.json()
+        hits.append("generate")
+        if server["upgraded"]:
+            return web.Response(status=404, text="gone")
+        if "num_predict" in body.get("options", {}):
+            return web.Response(status=400, text="unknown option num_predict")
+        return web.json_response({"response": "Generate-Antwort", "done": True})
+
+    async def run():
+        routes = {"GET /api/version": version, "POST /api/chat": chat, "POST /api/generate": generate}
+        async with _stub_server(monkeypatch, routes) as url:
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "OLLAMA_STREAM", False)
+            monkeypatch.setattr(llm_client, "_capabilities", {})
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache("", max_entries=0))
+            caps = await llm_client.probe_capabilities()
+            probe_hits = list(hits)
+            hits.clear()
+            answers = [await llm_client.ask_ollama(f"Frage {i}", "Kontext") for i in range(2)]
+            per_question = list(hits)
+            hits.clear()
+            server["upgraded"] = True  # Server-Update: /api/generate abgelehnt → neu testen, einmal wiederholen
+            upgraded = await llm_client.ask_ollama("Frage 3", "Kontext")
+            new_caps = llm_client._capabilities[(llm_client.OLLAMA_URL, llm_client.OLLAMA_MODEL)]
+            return caps, probe_hits, answers, per_question, upgraded, list(hits), new_caps
+
+    caps, probe_hits, answers, per_question, upgraded, refresh_hits, new_caps = asyncio.run(run())
+    assert (caps.endpoint, caps.num_predict) == ("generate", False)
+    assert probe_hits == ["version", "chat", "generate", "generate"]
+    assert per_question == ["generate", "generate"] and all("Generate-Antwort" in a for a in answers)
+    assert refresh_hits == ["generate", "version", "chat"] and "Chat-Antwort" in upgraded
+    assert (new_caps.endpoint, new_caps.num_predict) == ("chat", True)
+
+def test_llm_router_hedges_and_fails_over(tmp_path, monkeypatch):
+    import asyncio
+    import json
+    import sqlite3
+    import time as _time
+    from aiohttp import web
+    import llm_client
+    from llm_router import LLMRouter, parse_endpoints
+    from llm_scheduler import LLMScheduler
+    from response_cache import LLMResponseCache
+
+    hits = {"slow": 0, "fast": 0, "broken": 0}
+
+    def server(name, delay=0.0, status=200):
+        async def chat(request):
+            body = await request.json()
+            hits[name] += 1
+            await asyncio.sleep(delay)
+            if status != 200:
+                return web.Response(status=status, text="boom")
+            if body.get("stream"):
+                resp = web.StreamResponse()
+                await resp.prepare(request)
+                await resp.write(json.dumps({"message": {"content": f"Antwort {name}"}, "done": True}).encode() + b"\n")
+                return resp
+            return web.json_response({"message": {"content": f"Antwort {name}"}, "done": True})
+
+        return {"GET /api/version": _stub_ollama_version, "POST /api/chat": chat}
+
+    def router(spec, hedge_delay=0.0, hedge_slots=None):
+        endpoints = parse_endpoints(spec)
+        return LLMRouter(endpoints, breaker_for=llm_client._breaker_for, hedge_delay=hedge_delay, hedge_slots=hedge_slots)
+
+    async def run():
+        async with contextlib.AsyncExitStack() as stack:
+            urls = {}
+            for name, routes in (("slow", server("slow", delay=1.0)), ("fast", server("fast")), ("broken", server("broken", status=500))):
+                urls[name] = await stack.enter_async_context(_stub_server(monkeypatch, routes, pool_limit=8))
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "OLLAMA_STREAM", False)
+            monkeypatch.setattr(llm_client, "_capabilities", {})
+            monkeypatch.setattr(llm_client, "breakers", {})
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache("", max_entries=0))
+            # langsamer Endpunkt zuerst (höheres Gewicht) → nach 0,05 s Hedge an den schnellen
+            hedged = router(f"ollama|{urls['slow']}||2, ollama|{urls['fast']}", hedge_delay=0.05)
+            monkeypatch.setattr(llm_client, "llm_router", hedged)
+            t0 = _time.perf_counter()
+            hedge_answer = await llm_client.ask_ollama("Frage 1", "Kontext")
+            hedge_elapsed = _time.perf_counter() - t0
+            # defekter Endpunkt zuerst → Failover, auch vor dem ersten Stück eines Streams
+            failing = router(f"ollama|{urls['broken']}||2, ollama|{urls['fast']}")
+            monkeypatch.setattr(llm_client, "llm_router", failing)
+            failover_answer = await llm_client.ask_ollama("Frage 2", "Kontext")
+            streamed = [p async for p in llm_client.ask_ollama_stream("Frage 3", "Kontext")]
+            # Hedge belegt einen eigenen Slot: bei LLM_CONCURRENCY=1 entfällt er, bei 2 läuft er
+            single = LLMScheduler(1)
+            monkeypatch.setattr(llm_client, "llm_scheduler", single)
+            limited = router(f"ollama|{urls['slow']}||2, ollama|{urls['fast']}", hedge_delay=0.05, hedge_slots=single)
+            monkeypatch.setattr(llm_client, "llm_router", limited)
+            limited_answer = await llm_client.ask_ollama("Frage 4", "Kontext")
+            double = LLMScheduler(2)
+            monkeypatch.setattr(llm_client, "llm_scheduler", double)
+            spec = f"ollama|{urls['slow']}|slow-model|2, ollama|{urls['fast']}|fast-model"
+            monkeypatch.setattr(llm_client, "llm_router", router(spec, hedge_delay=0.05, hedge_slots=double))
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache(str(tmp_path / "hedge.sqlite3")))
+            hedged_answer = await llm_client.ask_ollama("Frage 5", "Kontext")
+            slots = (single.stats()["active"], double.stats()["active"], double.stats()["admitted"])
+            return (
+                hedge_answer, hedge_elapsed, hedged.stats(), failover_answer, streamed, failing.stats(),
+                limited_answer, limited.stats(), hedged_answer, slots,
+            )
+
+    (
+        hedge_answer, hedge_elapsed, hedge_stats, failover_answer, streamed, failover_stats,
+        limited_answer, limited_stats, hedged_answer, slots,
+    ) = asyncio.run(run())
+    assert "Antwort fast" in hedge_answer and hedge_elapsed < 0.9
+    assert hedge_stats["hedges"] == 1 and [e["hedge_wins"] for e in hedge_stats["endpoints"]] == [0, 1]
+    assert "Antwort slow" in limited_answer and (limited_stats["hedges"], limited_stats["hedges_skipped"]) == (0, 1)
+    assert "Antwort fast" in hedged_answer and slots == (0, 0, 2)
+    # Cache-Zeile trägt Backend und Modell des Gewinners
+    with sqlite3.connect(str(tmp_path / "hedge.sqlite3")) as db:
+        assert db.execute("SELECT backend, model FROM responses").fetchall() == [("ollama", "fast-model")]
+    assert hits["slow"] == 3 and hits["fast"] == 4
+    assert "Antwort fast" in failover_answer and "".join(streamed) == "Antwort fast"
+    assert failover_stats["failovers"] == 2 and [e["failures"] for e in failover_stats["endpoints"]] == [2, 0]
+
+def test_model_tiers_follow_load(tmp_path, monkeypatch):
+    import asyncio
+    from aiohttp import web
+    import llm_client
+    from llm_scheduler import LLMScheduler
+    from model_tiers import TierSelector, parse_tiers
+    from response_cache import LLMResponseCache
+
+    sel = TierSelector(parse_tiers("big, mid|384, small|200"), queue_step=2, min_tps=5.0)
+    assert sel.select(False, 0, 256).model == "big"
+    assert sel.select(False, 2, 256).model == "mid"
+    assert sel.select(True, 2, 512).model == "big"  # lange Antwort: eine Stufe länger beim großen Modell
+    assert (sel.select(True, 4, 512).model, sel.select(True, 4, 512).num_predict) == ("mid", 384)
+    shortened = sel.select(False, 6, 256)
+    assert (shortened.model, shortened.num_predict) == ("small", 100) and sel.shortened == 1
+    sel.observe("big", 2.0)  # großes Modell zuletzt zu langsam → auch im Leerlauf eine Stufe kleiner
+    assert sel.select(False, 0, 256).model == "mid"
+
+    seen = []
+
+    async def chat(request):
+        body = await request.json()
+        seen.append((body["model"], body["options"]["num_predict"]))
+        return web.json_response({
+            "message": {"content": f"Antwort von {body['model']}"}, "done": True,
+            "prompt_eval_count": 10, "eval_count": 40, "eval_duration": 2_000_000_000,
+        })
+
+    async def run():
+        async with _stub_server(monkeypatch, {"GET /api/version": _stub_ollama_version, "POST /api/chat": chat}) as url:
+            sched = LLMScheduler(1, max_queue=8)
+            selector = TierSelector(parse_tiers("llama3.2:3b, tinyllama|128"), queue_step=2, min_tps=0)
+            monkeypatch.setattr(llm_client, "OLLAMA_URL", url)
+            monkeypatch.setattr(llm_client, "LLM_BACKEND", "ollama")
+            monkeypatch.setattr(llm_client, "OLLAMA_STREAM", False)
+            monkeypatch.setattr(llm_client, "_capabilities", {})
+            monkeypatch.setattr(llm_client, "llm_scheduler", sched)
+            monkeypatch.setattr(llm_client, "tier_selector", selector)
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache("", max_entries=0))
+            async def queued():
+                async with sched.slot():
+                    pass
+
+            async def under_load(question):
+                # Slot belegt, zwei Anfragen warten → kleines Modell, kürzere Antwort
+                await sched.acquire()
+                waiters = [asyncio.ensure_future(queued()) for _ in range(2)]
+                await asyncio.sleep(0)
+                task = asyncio.ensure_future(llm_client.ask_ollama(question, "Kontext"))
+                await asyncio.sleep(0.01)
+                sched.release()
+                answer = await task
+                await asyncio.gather(*waiters)
+                return answer
+
+            idle = await llm_client.ask_ollama("Wann beginnt der Vertrag?", "Kontext")
+            busy = await under_load("Wann beginnt der Vertrag?")
+            # Antwort der kleinen Stufe wird nicht gecacht → die nächste Anfrage im Leerlauf erreicht den Server;
+            # die Antwort der großen Stufe bedient danach auch Anfragen unter Last (ohne Stufenwahl)
+            monkeypatch.setattr(llm_client, "response_cache", LLMResponseCache(str(tmp_path / "tiers.sqlite3")))
+            degraded = await under_load("Wer ist Vertragspartner?")
+            fresh = await llm_client.ask_ollama("Wer ist Vertragspartner?", "Kontext")
+            cached = await under_load("Wer ist Vertragspartner?")
+            return idle, busy, degraded, fresh, cached, selector.stats()
+
+    idle, busy, degraded, fresh, cached, stats = asyncio.run(run())
+    assert "llama3.2:3b" in idle and "tinyllama" in busy
+    assert "tinyllama" in degraded and "llama3.2:3b" in fresh and "llama3.2:3b" in cached
+    assert seen == [("llama3.2:3b", 256), ("tinyllama", 128), ("tinyllama", 128), ("llama3.2:3b", 256)]
+    assert [t["selected"] for t in stats["tiers"]] == [2, 2] and stats["tiers"][1]["tokens_per_sec"] == 20.0
+
 if __name__ == "__main__":
     # Простое выполнение без pytest
     for fn in [
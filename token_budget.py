@@ -0,0 +1,180 @@
+# token_budget.py
+# Token-Zählung und budgetiertes Packen der Auszüge für das Kontextfenster (OLLAMA_NUM_CTX).
+# Gezählt wird mit dem Tokenizer des Zielmodells, falls lokal vorhanden (TOKENIZER_NAME, transformers);
+# sonst mit einem Zeichen-pro-Token-Schätzer, der über prompt_eval_count der Ollama-Antworten nachkalibriert wird.
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("token_budget")
+
+# Startwert für gemischten DE/EN-Fachtext mit Llama-/SentencePiece-Tokenizern (konservativ)
+CHARS_PER_TOKEN = float(os.getenv("TOKEN_CHARS_PER_TOKEN", "3.2"))
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "")
+
+_SENT_END_RE = re.compile(r"[\.\!\?;:](?=\s)|\n")
+
+
+class TokenCounter:
+    """Zählt Tokens exakt (Tokenizer) oder geschätzt (kalibrierter Zeichen/Token-Faktor)."""
+
+    def __init__(self, chars_per_token: float = CHARS_PER_TOKEN, tokenizer_name: str = TOKENIZER_NAME) -> None:
+        self.chars_per_token = max(1.0, float(chars_per_token))
+        self.samples = 0
+        self._tokenizer = None
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer  # optional, kommt mit sentence-transformers
+
+                self._tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, local_files_only=True)
+                logger.info("Token counting with tokenizer %s", tokenizer_name)
+            except Exception as e:
+                logger.info("Tokenizer %s unavailable (%s); using estimator", tokenizer_name, e)
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        return int(math.ceil(len(text) / self.chars_per_token))
+
+    def calibrate(self, chars: int, tokens: Optional[int]) -> None:
+        """Beobachtung aus einer Modellantwort (Prompt-Zeichen ↔ prompt_eval_count) einrechnen (EMA)."""
+        if self._tokenizer is not None or not tokens or tokens <= 0 or chars <= 0:
+            return
+        observed = min(6.0, max(1.5, chars / float(tokens)))
+        alpha = 0.5 if self.samples < 4 else 0.2
+        self.chars_per_token = (1.0 - alpha) * self.chars_per_token + alpha * observed
+        self.samples += 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Text auf höchstens max_tokens kürzen, bevorzugt am Satz-/Zeilenende."""
+        if max_tokens <= 0 or not text:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        limit = int(max_tokens * self.chars_per_token)
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            limit = len(self._tokenizer.decode(ids))
+        while limit > 0:
+            cut = text[:limit]
+            ends = [m.end() for m in _SENT_END_RE.finditer(cut)]
+            if ends and ends[-1] >= limit // 2:
+                cut = cut[: ends[-1]]
+            elif " " in cut:
+                cut = cut[: cut.rfind(" ")]
+            cut = cut.rstrip() + "…"
+            if self.count(cut) <= max_tokens:
+                return cut
+            limit = int(limit * 0.9)
+        return ""
+
+
+token_counter = TokenCounter()
+
+
+def join_overlapping(a: str, b: str, max_overlap: int = 400) -> str:
+    """Zwei aufeinanderfolgende Chunks ohne den doppelten Überlappungsbereich verbinden."""
+    for k in range(min(len(a), len(b), max_overlap), 19, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return a + "\n" + b
+
+
+def merge_adjacent(chunks: Sequence[Dict]) -> List[Dict]:
+    """
+    Ausgewählte Chunks desselben Dokuments mit aufeinanderfolgendem chunk_index zu einem Auszug
+    zusammenführen (Chunk-Overlap wird nur einmal übernommen). Score = bester Teil-Score;
+    Rang = bester Rang der Teile. Chunks ohne doc_id bleiben unverändert.
+    """
+    spans: List[Dict] = []
+    by_doc: Dict[str, List[Tuple[int, int, int, Dict]]] = {}
+    for rank, c in enumerate(chunks):
+        doc = c.get("doc_id")
+        if doc and c.get("chunk_index") is not None and not c.get("glossary"):
+            idx = int(c.get("chunk_index") or 0)
+            lo, hi = c.get("span") or (idx, idx)  # bereits erweiterte Nachbarschaft (retrieval.expand_neighbours)
+            by_doc.setdefault(doc, []).append((lo, hi, rank, c))
+        else:
+            spans.append({**c, "_rank": rank})
+    for doc, items in by_doc.items():
+        items.sort(key=lambda x: x[0])
+        cur: Optional[Dict] = None
+        for lo, hi, rank, c in items:
+            if cur is not None and lo <= cur["_last"]:
+                continue  # Chunk bereits im laufenden Auszug enthalten
+            if cur is not None and lo == cur["_last"] + 1:
+                cur["text"] = join_overlapping(cur["text"], c.get("text") or "")
+                cur["similarity_score"] = max(cur["similarity_score"], float(c.get("similarity_score", 0.0)))
+                cur["_rank"] = min(cur["_rank"], rank)
+                cur["_last"] = hi
+                cur["merged"] = cur.get("merged", 1) + 1
+                continue
+            if cur is not None:
+                spans.append(cur)
+            cur = {
+                **c,
+                "text": c.get("text") or "",
+                "similarity_score": float(c.get("similarity_score", 0.0)),
+                "_rank": rank,
+                "_last": hi,
+            }
+        if cur is not None:
+            spans.append(cur)
+    spans.sort(key=lambda s: s["_rank"])
+    for s in spans:
+        s.pop("_rank", None)
+        s.pop("_last", None)
+    return spans
+
+
+def pack_excerpts(
+    texts: Sequence[str],
+    max_tokens: int,
+    *,
+    counter: Optional[TokenCounter] = None,
+    min_tail_tokens: int = 32,
+) -> Tuple[str, Dict]:
+    """
+    Auszüge in Prioritätsreihenfolge als "EXCERPT i:" in das Tokenbudget packen.
+    Passt ein Auszug nicht mehr ganz, wird er (ab min_tail_tokens Restbudget) gekürzt;
+    kleinere spätere Auszüge dürfen die Lücke noch füllen.
+    Rückgabe: (Kontexttext, {"tokens", "budget", "excerpts", "truncated", "dropped"}).
+    """
+    counter = counter or token_counter
+    sep = "\n---\n"
+    sep_cost = counter.count(sep)
+    parts: List[str] = []
+    used = 0
+    truncated = dropped = 0
+    for t in texts:
+        header = f"EXCERPT {len(parts) + 1}:\n"
+        overhead = counter.count(header) + (sep_cost if parts else 0)
+        cost = overhead + counter.count(t)
+        if used + cost <= max_tokens:
+            parts.append(header + t)
+            used += cost
+            continue
+        room = max_tokens - used - overhead
+        cut = counter.truncate(t, room) if room >= min_tail_tokens else ""
+        if cut:
+            parts.append(header + cut)
+            used += overhead + counter.count(cut)
+            truncated += 1
+        else:
+            dropped += 1
+    stats = {
+        "tokens": used,
+        "budget": max_tokens,
+        "excerpts": len(parts),
+        "truncated": truncated,
+        "dropped": dropped,
+    }
+    return sep.join(parts), stats
@@ -7,15 +7,23 @@ import hashlib
 import logging
 import re
 import threading
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 logging.getLogger('chromadb.telemetry').setLevel(logging.ERROR)
 
 import chromadb
+import numpy as np
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 import logging
 
-from acronym_utils import detect_acronym  # gemeinsame Logik mit retrieval
+from query_plan import QueryPlan, as_plan
+from acronym_lexicon import AcronymLexicon
+from acronym_utils import set_lexicon
+from cache_utils import LRUCache
+from doc_router import DocumentRouter
+from glossary import GlossaryIndex
+from scope_index import Scope, ScopeIndex
+from ranking import apply_boosts, chunk_key, rank_order
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("vector_store")
@@ -27,6 +35,83 @@ except Exception:
     pass
 
 
+class CandidateCursor:
+    """
+    Fortsetzbare, gerankte Kandidatenliste für eine Anfrage.
+    Die Anfrage wird genau einmal eingebettet; fetch(n) liefert die nächsten n Ränge
+    (nach Boost/Schwellwert, ohne bereits gelieferte Chunks). Chroma kennt keinen Offset,
+    daher wächst das Abruffenster geometrisch und bereits geholte Ränge werden nie erneut
+    geliefert oder bewertet.
+    """
+
+    def __init__(
+        self,
+        store: "VectorStore",
+        query: Union[str, QueryPlan],
+        *,
+        where: Optional[Dict] = None,
+        similarity_threshold: Optional[float] = None,
+    ) -> None:
+        plan = as_plan(query)
+        self._store = store
+        self.plan = plan
+        self.query = plan.text
+        self.where = where
+        self.q_emb = plan.ensure_embedding(store.embed_query)
+        self.acr_cf = plan.acronym_cf
+        self.thr = (
+            store.min_sim_threshold
+            if similarity_threshold is None
+            else float(similarity_threshold)
+        )
+        self._raw: List[Dict] = []   # Rohkandidaten in Chroma-Reihenfolge
+        self._pos = 0                # Anzahl bereits ausgelieferter Ränge
+        self._seen: set = set()      # chunk_keys aller gelieferten Kandidaten
+        self._drained = not plan.text  # Chroma hat weniger geliefert als angefragt
+        self.queries = 0             # Anzahl Chroma-Abfragen (Diagnose)
+
+    @property
+    def exhausted(self) -> bool:
+        return self._drained and self._pos >= len(self._raw)
+
+    @property
+    def position(self) -> int:
+        return self._pos
+
+    def _ensure(self, upto: int) -> None:
+        if upto <= len(self._raw) or self._drained:
+            return
+        n = max(upto, 2 * len(self._raw))
+        cands = self._store._query_candidates(self.q_emb, n, self.where)
+        self.queries += 1
+        if len(cands) < n:
+            self._drained = True
+        self._raw = cands
+
+    def fetch(self, n: int) -> List[Dict]:
+        """Nächste n Ränge prüfen; gibt die neuen Kandidaten über dem Schwellwert zurück."""
+        if n <= 0 or self.exhausted:
+            return []
+        self._ensure(self._pos + n)
+        page = self._raw[self._pos : self._pos + n]
+        self._pos += len(page)
+        fresh: List[Dict] = []
+        for c in page:
+            key = chunk_key(c)
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            fresh.append(c)
+        ranked, _ = self._store._order_candidates(
+            self._store._score_candidates(fresh, self.acr_cf, self.thr), self.acr_cf
+        )
+        return ranked
+
+    def fetch_until(self, total: int) -> List[Dict]:
+        """Bis Rang `total` weiterlesen (entspricht n_results=total einer Einzelsuche)."""
+        return self.fetch(total - self._pos)
+
+
 class VectorStore:
     def __init__(
         self,
@@ -82,6 +167,26 @@ class VectorStore:
             embedding_function=None,
         )
 
+        # Korpus-Generation: steigt bei jeder Änderung (add_chunks/delete_document/…);
+        # Caches über Retrieval-Ergebnisse nehmen sie in ihren Schlüssel auf.
+        self.generation = 0
+
+        # Anfrage-Embeddings: Antwort-Cache und Retrieval betten dieselbe Frage nur einmal ein
+        self._query_embeddings = LRUCache(256, name="query_embeddings")
+        # Chunks per ID (Nachbarschaftserweiterung); gültig bis zur nächsten Korpusänderung
+        self._chunks_by_id = LRUCache(int(os.getenv("CHUNK_CACHE_SIZE", "2048")), name="chunks_by_id")
+
+        # Glossar-Index (Akronym → Definitionszeilen), persistiert neben der Chroma-DB
+        self.glossary = GlossaryIndex(os.path.join(self.persist_directory, "glossary.json"))
+        # Akronym-Lexikon des Korpus; detect_acronym prüft Kandidaten dagegen
+        self.acronyms = AcronymLexicon(os.path.join(self.persist_directory, "acronyms.json"))
+        set_lexicon(self.acronyms)
+        # Dokument-/Abschnitts-Zentroiden für das Routing vor der Auffächerung pro Dokument
+        self.router = DocumentRouter(os.path.join(self.persist_directory, "doc_routes.json"))
+        self.route_section_chunks = int(os.getenv("ROUTE_SECTION_CHUNKS", "12"))
+        # Metadaten-Indizes (Seite/Abschnitt/Tabelle/Inhaltstyp → Chunks) für eingegrenzte Suchen
+        self.scopes = ScopeIndex(os.path.join(self.persist_directory, "scopes.json"))
+
         # Lokaler CPU-Encoder (sentence-transformers)
         model_name = os.getenv(
             "EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
@@ -99,11 +204,23 @@ class VectorStore:
         )
 
     # ---- interne Hilfsfunktionen -------------------------------------------------
+    def _bump_generation(self) -> None:
+        self.generation += 1
+        self._chunks_by_id.clear()
+
     def _embed(self, texts: List[str]) -> List[List[float]]:
         if not texts:
             return []
         return self.detail_encode(texts)
 
+    def embed_query(self, query: str) -> List[float]:
+        """Einzelne Anfrage einbetten (gecacht; Embeddings hängen nicht vom Korpus ab)."""
+        emb = self._query_embeddings.get(query)
+        if emb is None:
+            emb = self._embed([query])[0]
+            self._query_embeddings.put(query, emb)
+        return emb
+
     def detail_encode(self, texts: List[str]) -> List[List[float]]:  # Liefert Embeddings (Vektoren) für die übergebenen Texte
         return (  # Rückgabe als verschachtelte Liste von Floats (Kompatibilität zu Chroma)
             self.embedder.encode(  # sentence-transformers Aufruf mit initialisiertem Modell (CPU)
@@ -157,9 +274,16 @@ class VectorStore:
     # ---- public API -------------------------------------------------------
 
     def add_chunks(
-        self, doc_id: str, chunks: List[str], metadata: Optional[Dict] = None
+        self,
+        doc_id: str,
+        chunks: List[str],
+        metadata: Optional[Dict] = None,
+        chunk_metadata: Optional[List[Dict]] = None,
     ) -> bool:
-        """Add pre-split chunks using local embeddings (CPU)."""
+        """
+        Add pre-split chunks using local embeddings (CPU).
+        chunk_metadata: optional je Chunk (page, section, section_title, table, content_type aus pdf_parser).
+        """
         if not chunks:
             return True
 
@@ -167,8 +291,9 @@ class VectorStore:
         max_chunks = int(os.getenv("MAX_INDEX_CHUNKS", "0")) or 0
         reasons_dropped = {"short": 0, "empty": 0, "other": 0}
         to_use: List[str] = []
+        extra: List[Dict] = []
 
-        for c in chunks or []:
+        for pos, c in enumerate(chunks or []):
             if not c or not str(c).strip():
                 reasons_dropped["empty"] += 1
                 if self.disable_chunk_filter:
@@ -176,6 +301,9 @@ class VectorStore:
                     continue
             if self._passes_quality(c):
                 to_use.append(c)
+                # Chroma akzeptiert nur skalare, nicht-leere Metadatenwerte
+                cm = chunk_metadata[pos] if chunk_metadata and pos < len(chunk_metadata) else None
+                extra.append({k: v for k, v in (cm or {}).items() if v is not None and k != "text"})
             else:
                 reasons_dropped["short"] += 1
 
@@ -200,6 +328,7 @@ class VectorStore:
                 "chunk_index": i,
                 "total_chunks": len(to_use),
                 **meta_base,
+                **extra[i],
             }
             for i in range(len(to_use))
         ]
@@ -242,6 +371,7 @@ class VectorStore:
                    
                     
 
+            self._bump_generation()
             logger.info("Added %s chunks for %s", total_added, doc_id)
         return True
 
@@ -278,164 +408,294 @@ class VectorStore:
         except Exception:
             return None
 
-    def search_in_document(
+    # ---- Glossar ---------------------------------------------------------------
+    def index_glossary(self, doc_id: str) -> int:
+        """Baut Glossareinträge und Akronym-Lexikon eines Dokuments aus den gespeicherten Chunks neu auf."""
+        try:
+            res = self.collection.get(where={"source": doc_id}, include=["documents", "metadatas"])
+        except Exception as e:
+            logger.error("index_glossary get error (%s): %s", doc_id, e)
+            return 0
+        docs = (res or {}).get("documents") or []
+        metas = (res or {}).get("metadatas") or []
+        chunks = [
+            {
+                "text": doc,
+                "chunk_id": (meta or {}).get("chunk_id", ""),
+                "chunk_index": (meta or {}).get("chunk_index", 0),
+                "page": (meta or {}).get("page"),
+            }
+            for doc, meta in zip(docs, metas)
+        ]
+        added = self.glossary.set_document(doc_id, chunks)
+        terms = self.acronyms.set_document(doc_id, docs)
+        self._bump_generation()
+        logger.info("Glossary for %s: %s entries, %s acronyms", doc_id, added, terms)
+        return added
+
+    def has_glossary(self, doc_id: str) -> bool:
+        return self.glossary.has_document(doc_id) and self.acronyms.has_document(doc_id)
+
+    # ---- Dokument-Routing ------------------------------------------------------
+    def index_routing(self, doc_id: str) -> int:
+        """Berechnet Dokument- und Abschnitts-Zentroiden aus den gespeicherten Chunk-Embeddings."""
+        try:
+            res = self.collection.get(where={"source": doc_id}, include=["embeddings", "metadatas"])
+        except Exception as e:
+            logger.error("index_routing get error (%s): %s", doc_id, e)
+            return 0
+        embs = (res or {}).get("embeddings")
+        metas = (res or {}).get("metadatas") or []
+        if embs is None or not len(embs):
+            return 0
+        order = sorted(range(len(metas)), key=lambda i: (metas[i] or {}).get("chunk_index", 0))
+        mat = np.asarray([embs[i] for i in order], dtype=np.float32)
+        metas = [metas[i] or {} for i in order]
+        # Abschnitte: Metadaten "section" (bis zur 2. Ebene: 15.2.1 → 15.2), sonst feste Fenster aufeinanderfolgender Chunks
+        sections: Dict[str, List[int]] = {}
+        for row, meta in enumerate(metas):
+            section = ".".join(str(meta.get("section") or "").split(".")[:2])
+            name = section or f"chunks {row // self.route_section_chunks * self.route_section_chunks}+"
+            sections.setdefault(name, []).append(row)
+        n = self.router.set_document(doc_id, mat, list(sections.items()))
+        logger.info("Routing for %s: %s chunks, %s sections", doc_id, len(mat), n)
+        return n
+
+    def has_routing(self, doc_id: str) -> bool:
+        return self.router.has_document(doc_id)
+
+    # ---- Eingegrenzte Suche (Seite/Abschnitt/Tabelle/Inhaltstyp) ----------------
+    def index_scopes(self, doc_id: str) -> int:
+        """Baut die Metadaten-Indizes eines Dokuments aus den gespeicherten Chunk-Metadaten."""
+        try:
+            res = self.collection.get(where={"source": doc_id}, include=["metadatas"])
+        except Exception as e:
+            logger.error("index_scopes get error (%s): %s", doc_id, e)
+            return 0
+        n = self.scopes.set_document(doc_id, (res or {}).get("metadatas") or [])
+        logger.info("Scope index for %s: %s keys", doc_id, n)
+        return n
+
+    def has_scopes(self, doc_id: str) -> bool:
+        return self.scopes.has_document(doc_id)
+
+    def search_scoped(
         self,
-        query: str,
-        doc_id: str,
+        query: Union[str, QueryPlan],
+        scope: Scope,
         n_results: int = 5,
+        doc_ids: Optional[List[str]] = None,
         *,
-        similarity_threshold: Optional[float] = None,
+        similarity_threshold: float = 0.0,
     ) -> List[Dict]:
         """
-        Semantische Suche in einem einzelnen Dokument mit Fokus auf Akronyme/Begriffe:
-        - Basis Chroma-Suche
-        - Boost, wenn ein Begriff gefunden wird und im Chunk vorkommt
-        - Bei Vorhandensein eines Begriffs — Neuordnung, um mögliche Definitionen nach vorne zu bringen
+        Suche nur in den Chunks, die laut Metadaten-Index in den Bereich fallen: ein collection.get
+        für die Kandidaten, Ähnlichkeit per Skalarprodukt (normalisierte Embeddings), dann
+        derselbe Akronym-Boost/Rang wie bei der globalen Suche. [] ohne passende Chunks.
         """
+        ids = self.scopes.candidate_ids(scope, doc_ids)
+        if not ids:
+            return []
+        plan = as_plan(query)
         try:
-            if not query:
-                return []
-
-            q_emb = self._embed([query])[0]
-
-            # Einheitliche Logik: gemeinsame Funktion detect_acronym (aus acronym_utils)
-            acr = detect_acronym(query)
-            acr_cf = acr.casefold() if acr else None
-
-            # Mehr für die Nachfilterung abrufen
-            top_k = max(10, n_results * 2)
-            thr = (
-                self.min_sim_threshold
-                if similarity_threshold is None
-                else float(similarity_threshold)
+            q = np.asarray(plan.ensure_embedding(self.embed_query), dtype=np.float32)
+            res = self.collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+        except Exception as e:
+            logger.error("search_scoped error: %s", e)
+            return []
+        embs = res.get("embeddings")
+        if embs is None or not len(embs):
+            return []
+        mat = np.asarray(embs, dtype=np.float32)
+        sims = 1.0 / (2.0 - mat @ q)  # wie _query_candidates: 1 / (1 + Kosinus-Distanz)
+        cands: List[Dict] = []
+        for i, (cid, doc, meta) in enumerate(zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or [])):
+            meta = meta or {}
+            cands.append(
+                {
+                    "doc_id": meta.get("source", meta.get("doc_id", "")),
+                    "chunk_id": cid,
+                    "chunk_index": meta.get("chunk_index", 0),
+                    "text": doc or "",
+                    "similarity_score": float(sims[i]),
+                    "metadata": meta,
+                    "embedding": embs[i],
+                }
             )
+        out, _ = self._order_candidates(
+            self._score_candidates(cands, plan.acronym_cf, similarity_threshold), plan.acronym_cf
+        )
+        logger.debug("Scoped search %s: %s candidates", scope, len(ids))
+        return out[:n_results]
 
-            res = self.collection.query(
-                query_embeddings=[q_emb],
-                n_results=top_k,
-                where={"source": doc_id},
-                include=["documents", "metadatas", "distances"],
+    def route_documents(
+        self, query: Union[str, QueryPlan], k: int, candidates: Optional[List[str]] = None
+    ) -> List[Tuple[str, Optional[float]]]:
+        """Top-k Dokumente für eine Anfrage (ohne Chroma-Abfrage; nur Zentroiden)."""
+        return self.router.route(as_plan(query).ensure_embedding(self.embed_query), k, candidates)
+
+    def lookup_glossary(self, term: str, limit: int = 5) -> List[Dict]:
+        """O(1)-Lookup im Glossar; Rückgabe im gleichen Format wie search_global."""
+        out: List[Dict] = []
+        for e in self.glossary.lookup(term, limit=limit):
+            out.append(
+                {
+                    "doc_id": e.get("doc_id", ""),
+                    "chunk_id": e.get("chunk_id", ""),
+                    "chunk_index": e.get("chunk_index", 0),
+                    "text": f"{e.get('term', term)} – {e.get('definition', '')}",
+                    "similarity_score": 1.0,
+                    "metadata": {"source": e.get("doc_id", ""), "page": e.get("page"), "glossary": True},
+                    "glossary": True,
+                }
             )
+        return out
 
-            docs = res.get("documents", [[]])[0]
-            metas = res.get("metadatas", [[]])[0]
-            dists = res.get("distances", [[]])[0]
+    def _query_candidates(
+        self, q_emb: List[float], n_results: int, where: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Chroma-Abfrage → Kandidaten-Dicts (inkl. Basisähnlichkeit und Embedding für die MMR)."""
+        kwargs = {
+            "query_embeddings": [q_emb],
+            "n_results": n_results,
+            "include": ["documents", "metadatas", "distances", "embeddings"],
+        }
+        if where:
+            kwargs["where"] = where
+        res = self.collection.query(**kwargs)
 
-            out: List[Dict] = []
-            for doc, meta, dist in zip(docs, metas, dists):
-                base_sim = 1.0 / (1.0 + float(dist if isinstance(dist, (int, float)) else 0.0))
-                sim = base_sim
-
-                # Boost, wenn ein Akronym tatsächlich im Text vorkommt
-                if acr_cf and doc:
-                    doc_cf = (doc or "").casefold()
-                    if acr_cf in doc_cf:
-                        sim = min(1.0, base_sim + 0.30)
-
-                if sim >= thr:
-                    out.append(
-                        {
-                            "doc_id": meta.get("source", meta.get("doc_id", "")),
-                            "chunk_id": meta.get("chunk_id", ""),
-                            "chunk_index": meta.get("chunk_index", 0),
-                            "text": doc,
-                            "similarity_score": sim,
-                            "metadata": meta,
-                        }
-                    )
+        docs = res.get("documents", [[]])[0]
+        metas = res.get("metadatas", [[]])[0]
+        dists = res.get("distances", [[]])[0]
+        embs_all = res.get("embeddings")
+        embs = embs_all[0] if embs_all is not None and len(embs_all) else None
+        if embs is None:
+            embs = [None] * len(docs)
 
-            if not out:
-                return []
+        out: List[Dict] = []
+        for doc, meta, dist, emb in zip(docs, metas, dists, embs):
+            out.append(
+                {
+                    "doc_id": meta.get("source", meta.get("doc_id", "")),
+                    "chunk_id": meta.get("chunk_id", ""),
+                    "chunk_index": meta.get("chunk_index", 0),
+                    "text": doc,
+                    "similarity_score": 1.0 / (1.0 + float(dist if isinstance(dist, (int, float)) else 0.0)),
+                    "metadata": meta,
+                    "embedding": emb,
+                }
+            )
+        return out
 
-            out.sort(key=lambda x: x["similarity_score"], reverse=True)
+    @staticmethod
+    def _acronym_flags(cands: List[Dict], acr_cf: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(enthält Akronym, sieht nach Definition aus) je Kandidat."""
+        n = len(cands)
+        if not acr_cf or not n:
+            none = np.zeros(n, dtype=bool)
+            return none, none
+        texts = [(c.get("text") or "").casefold() for c in cands]
+        contains = np.fromiter((acr_cf in t for t in texts), dtype=bool, count=n)
+        defn_marks = (f"{acr_cf} -", f"{acr_cf}:", f"{acr_cf} (")
+        is_defn = np.fromiter((any(m in t for m in defn_marks) for t in texts), dtype=bool, count=n)
+        return contains, is_defn
+
+    @classmethod
+    def _score_candidates(cls, cands: List[Dict], acr_cf: Optional[str], thr: float) -> List[Dict]:
+        """Vektorisiert: Akronym-Boost (+0.30, gedeckelt bei 1.0) und Schwellwert."""
+        if not cands:
+            return []
+        sims = np.fromiter((c["similarity_score"] for c in cands), dtype=np.float32, count=len(cands))
+        contains, _ = cls._acronym_flags(cands, acr_cf)
+        scores = apply_boosts(sims, contains[:, None], [0.30], cap=1.0, threshold=thr)
+        out: List[Dict] = []
+        for i in np.flatnonzero(np.isfinite(scores)):
+            c = cands[i]
+            c["similarity_score"] = float(scores[i])
+            out.append(c)
+        return out
+
+    @classmethod
+    def _order_candidates(cls, cands: List[Dict], acr_cf: Optional[str]) -> Tuple[List[Dict], bool]:
+        """
+        Reihenfolge (enthält Akronym, Definitionsmuster, Ähnlichkeit).
+        Rückgabe: (sortierte Kandidaten, ob mindestens ein Kandidat das Akronym enthält).
+        """
+        if not cands:
+            return [], False
+        sims = np.fromiter((c["similarity_score"] for c in cands), dtype=np.float32, count=len(cands))
+        contains, is_defn = cls._acronym_flags(cands, acr_cf)
+        order = rank_order(sims, contains, is_defn)
+        return [cands[i] for i in order], bool(contains.any())
+
+    def get_chunks_by_ids(self, ids: List[str]) -> Dict[str, Dict]:
+        """Chunks direkt per ID (ein gebatchter collection.get für alle nicht gecachten IDs)."""
+        out: Dict[str, Dict] = {}
+        missing: List[str] = []
+        for cid in dict.fromkeys(ids):
+            c = self._chunks_by_id.get(cid)
+            if c is None:
+                missing.append(cid)
+            else:
+                out[cid] = c
+        if not missing:
+            return out
+        try:
+            res = self.collection.get(ids=missing, include=["documents", "metadatas"])
+        except Exception as e:
+            logger.debug("get_chunks_by_ids error: %s", e)
+            return out
+        for cid, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []):
+            meta = meta or {}
+            c = {
+                "doc_id": meta.get("source", meta.get("doc_id", "")),
+                "chunk_id": cid,
+                "chunk_index": meta.get("chunk_index", 0),
+                "text": doc or "",
+                "metadata": meta,
+            }
+            self._chunks_by_id.put(cid, c)
+            out[cid] = c
+        return out
 
-            # Zusätzliche Neuordnung nach "Definition zuerst"
-            if acr_cf:
-                def is_defn(txt: str) -> bool:
-                    t = (txt or "").casefold()
-                    return (
-                        f"{acr_cf} -" in t
-                        or f"{acr_cf}:" in t
-                        or f"{acr_cf} (" in t
-                    )
+    def open_cursor(
+        self,
+        query: Union[str, QueryPlan],
+        doc_id: Optional[str] = None,
+        *,
+        similarity_threshold: Optional[float] = None,
+    ) -> "CandidateCursor":
+        """Fortsetzbarer Kandidatenstrom: Anfrage wird einmal eingebettet, Seiten auf Abruf."""
+        return CandidateCursor(
+            self,
+            query,
+            where={"source": doc_id} if doc_id else None,
+            similarity_threshold=similarity_threshold,
+        )
 
-                preferred = [
-                    c for c in out if acr_cf in ((c.get("text") or "").casefold())
-                ]
-                if preferred:
-                    preferred.sort(
-                        key=lambda c: (
-                            1 if is_defn(c.get("text", "")) else 0,
-                            float(c.get("similarity_score", 0.0)),
-                        ),
-                        reverse=True,
-                    )
-                    tail = [c for c in out if c not in preferred]
-                    out = preferred + tail
-                else:
-                    # Keine eindeutigen Treffer für das Akronym — erweitern wir das Fenster und versuchen es erneut
-                    res2 = self.collection.query(
-                        query_embeddings=[q_emb],
-                        n_results=max(top_k * 2, 20),
-                        where={"source": doc_id},
-                        include=["documents", "metadatas", "distances"],
-                    )
-                    docs2 = res2.get("documents", [[]])[0]
-                    metas2 = res2.get("metadatas", [[]])[0]
-                    dists2 = res2.get("distances", [[]])[0]
-                    out2: List[Dict] = []
-                    for doc, meta, dist in zip(docs2, metas2, dists2):
-                        base_sim2 = 1.0 / (
-                            1.0
-                            + float(dist if isinstance(dist, (int, float)) else 0.0)
-                        )
-                        sim2 = base_sim2
-                        if acr_cf and doc:
-                            if acr_cf in ((doc or "").casefold()):
-                                sim2 = min(1.0, base_sim2 + 0.30)
-                        if sim2 >= thr:
-                            out2.append(
-                                {
-                                    "doc_id": meta.get(
-                                        "source", meta.get("doc_id", "")
-                                    ),
-                                    "chunk_id": meta.get("chunk_id", ""),
-                                    "chunk_index": meta.get("chunk_index", 0),
-                                    "text": doc,
-                                    "similarity_score": sim2,
-                                    "metadata": meta,
-                                }
-                            )
-                    if out2:
-                        out2.sort(
-                            key=lambda x: x["similarity_score"], reverse=True
-                        )
-                        preferred2 = [
-                            c
-                            for c in out2
-                            if acr_cf in ((c.get("text") or "").casefold())
-                        ]
-                        if preferred2:
-                            preferred2.sort(
-                                key=lambda c: (
-                                    1 if is_defn(c.get("text", "")) else 0,
-                                    float(c.get("similarity_score", 0.0)),
-                                ),
-                                reverse=True,
-                            )
-                            tail2 = [c for c in out2 if c not in preferred2]
-                            out = preferred2 + tail2
-                        else:
-                            out = out2
-
-            return out[:n_results]
+    def search_in_document(
+        self,
+        query: Union[str, QueryPlan],
+        doc_id: str,
+        n_results: int = 5,
+        *,
+        similarity_threshold: Optional[float] = None,
+    ) -> List[Dict]:
+        """
+        Semantische Suche in einem einzelnen Dokument mit Fokus auf Akronyme/Begriffe:
+        - Basis Chroma-Suche
+        - Boost, wenn ein Begriff gefunden wird und im Chunk vorkommt
+        - Bei Vorhandensein eines Begriffs — Neuordnung, um mögliche Definitionen nach vorne zu bringen
+        """
+        try:
+            return self._search(self.open_cursor(query, doc_id, similarity_threshold=similarity_threshold), n_results)
         except Exception as e:
             logger.error("search_in_document error (%s): %s", doc_id, e)
             return []
 
     def search_global(  # Globale semantische Suche über alle Dokumente
         self,
-        query: str,                        # Freitext‑Suchanfrage
+        query: Union[str, QueryPlan],      # Freitext‑Suchanfrage oder QueryPlan
         n_results: int = 5,                # gewünschte Anzahl Top‑Ergebnisse
         *,
         similarity_threshold: Optional[float] = None,  # optionale Mindestähnlichkeit
@@ -445,122 +705,26 @@ class VectorStore:
         Gibt eine Liste von Dicts zurück, ähnlich wie search_in_document.
         """
         try:
-            if not query:                  # wenn es eine Leere Anfrage gibt dann keine Resultate
-                return []
-
-            q_emb = self._embed([query])[0]     # Embedding der Anfrage erzeugen
-            acr = detect_acronym(query)         # Akronym erkennen (z. B. "TARA", "CAN, "CAL")
-            acr_cf = acr.casefold() if acr else None  # casefolded Vergleichsform
-
-            top_k = max(10, n_results * 2)      # Erst großzügig viele Kandidaten holen
-            thr = (                              # Schwellwert für Ähnlichkeit bestimmen
-                self.min_sim_threshold
-                if similarity_threshold is None
-                else float(similarity_threshold)
-            )
-
-            res = self.collection.query(         # Chroma: Vektorabfrage
-                query_embeddings=[q_emb],        # Anfrage‑Embedding
-                n_results=top_k,                 # Anzahl roher Kandidaten
-                include=["documents", "metadatas", "distances"],  # Texte, Metadaten, Distanzen
-            )
-
-            docs = res.get("documents", [[]])[0]   # Top‑Dokumenttexte
-            metas = res.get("metadatas", [[]])[0]  # Metadaten je Chunk
-            dists = res.get("distances", [[]])[0]  # Distanzwerte
-
-            out: List[Dict] = []  # gesammelte, gefilterte Ergebnisse
-            for doc, meta, dist in zip(docs, metas, dists):
-                base_sim = 1.0 / (1.0 + float(dist if isinstance(dist, (int, float)) else 0.0))  # Distanz→Ähnlichkeit
-                sim = base_sim  # Startwert
-                if acr_cf and doc:  # Akronym‑Boost, falls Akronym im Chunktext auftaucht
-                    if acr_cf in ((doc or "").casefold()):
-                        sim = min(1.0, base_sim + 0.30)  # Bonus, gedeckelt bei 1.0
-                if sim >= thr:  # nur ausreichend ähnliche behalten
-                    out.append(
-                        {
-                            "doc_id": meta.get("source", meta.get("doc_id", "")),  # Dokumentkennung
-                            "chunk_id": meta.get("chunk_id", ""),                  # Chunk‑ID
-                            "chunk_index": meta.get("chunk_index", 0),             # Position im Dokument
-                            "text": doc,                                           # gefundener Text
-                            "similarity_score": sim,                                # berechnete Ähnlichkeit
-                            "metadata": meta,                                       # weitere Metadaten
-                        }
-                    )
-
-            if not out:  # keine Treffer nach Filter
-                return []
-
-            out.sort(key=lambda x: x["similarity_score"], reverse=True)
-
-            if acr_cf:
-                def is_defn(txt: str) -> bool:
-                    t = (txt or "").casefold()
-                    return (
-                        f"{acr_cf} -" in t
-                        or f"{acr_cf}:" in t
-                        or f"{acr_cf} (" in t
-                    )
-
-                preferred = [c for c in out if acr_cf in ((c.get("text") or "").casefold())]
-                if preferred:
-                    preferred.sort(
-                        key=lambda c: (
-                            1 if is_defn(c.get("text", "")) else 0,
-                            float(c.get("similarity_score", 0.0)),
-                        ),
-                        reverse=True,
-                    )
-                    tail = [c for c in out if c not in preferred]
-                    out = preferred + tail
-                else:
-                    # widen if nothing contains acronym explicitly
-                    res2 = self.collection.query(
-                        query_embeddings=[q_emb],
-                        n_results=max(top_k * 2, 20),
-                        include=["documents", "metadatas", "distances"],
-                    )
-                    docs2 = res2.get("documents", [[]])[0]
-                    metas2 = res2.get("metadatas", [[]])[0]
-                    dists2 = res2.get("distances", [[]])[0]
-                    out2: List[Dict] = []
-                    for doc, meta, dist in zip(docs2, metas2, dists2):
-                        base_sim2 = 1.0 / (1.0 + float(dist if isinstance(dist, (int, float)) else 0.0))
-                        sim2 = base_sim2
-                        if acr_cf and doc and acr_cf in ((doc or "").casefold()):
-                            sim2 = min(1.0, base_sim2 + 0.30)
-                        if sim2 >= thr:
-                            out2.append(
-                                {
-                                    "doc_id": meta.get("source", meta.get("doc_id", "")),
-                                    "chunk_id": meta.get("chunk_id", ""),
-                                    "chunk_index": meta.get("chunk_index", 0),
-                                    "text": doc,
-                                    "similarity_score": sim2,
-                                    "metadata": meta,
-                                }
-                            )
-                    if out2:
-                        out2.sort(key=lambda x: x["similarity_score"], reverse=True)
-                        preferred2 = [c for c in out2 if acr_cf in ((c.get("text") or "").casefold())]
-                        if preferred2:
-                            preferred2.sort(
-                                key=lambda c: (
-                                    1 if is_defn(c.get("text", "")) else 0,
-                                    float(c.get("similarity_score", 0.0)),
-                                ),
-                                reverse=True,
-                            )
-                            tail2 = [c for c in out2 if c not in preferred2]
-                            out = preferred2 + tail2
-                        else:
-                            out = out2
-
-            return out[:n_results]
+            return self._search(self.open_cursor(query, similarity_threshold=similarity_threshold), n_results)
         except Exception as e:
             logger.error("search_global error: %s", e)
             return []
 
+    def _search(self, cursor: "CandidateCursor", n_results: int) -> List[Dict]:
+        # Mehr für die Nachfilterung abrufen
+        top_k = max(10, n_results * 2)
+        out, has_acr = self._order_candidates(cursor.fetch(top_k), cursor.acr_cf)
+        if not out:
+            return []
+
+        if cursor.acr_cf and not has_acr:
+            # Keine eindeutigen Treffer für das Akronym — nächste Seite desselben Cursors ansehen
+            more = cursor.fetch(max(top_k, 10))
+            if more:
+                out, _ = self._order_candidates(out + more, cursor.acr_cf)
+
+        return out[:n_results]
+
     def search_keyword(
         self,
         term: str,
@@ -657,6 +821,8 @@ class VectorStore:
                 "chunk_size": self.chunk_size,
                 "chunk_overlap": self.chunk_overlap,
                 "batch_size": self.batch_size,
+                "generation": self.generation,
+                "acronyms": len(self.acronyms),
             }
         except Exception as e:
             logger.error("get_document_info error: %s", e)
@@ -665,6 +831,11 @@ class VectorStore:
     def delete_document(self, doc_id: str) -> bool:
         try:
             self.collection.delete(where={"source": doc_id})
+            self.glossary.remove_document(doc_id)
+            self.acronyms.remove_document(doc_id)
+            self.scopes.remove_document(doc_id)
+            self.router.remove_document(doc_id)
+            self._bump_generation()
             logger.info("Deleted document: %s", doc_id)
             return True
         except Exception as e:
@@ -674,6 +845,11 @@ class VectorStore:
     def clear_all(self) -> bool:
         try:
             self.client.reset()
+            self.glossary.clear()
+            self.acronyms.clear()
+            self.scopes.clear()
+            self.router.clear()
+            self._bump_generation()
             logger.info("Vector store cleared")
             return True
         except Exception as e: